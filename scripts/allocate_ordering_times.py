@@ -1,115 +1,90 @@
 
-import random
+import bisect
 import datetime
-import json
-import os
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-config_file = os.path.join(script_dir, "..", "sim_config.json")
-config_file = os.path.abspath(config_file)  # normalize
+import numpy as np
 
+from booking_scheduler import BookingScheduler
+from columnar_orders import CATEGORIES, NO_ITEM, NO_TABLE, NO_TIME, group_orders_stage
+from metrics import instrumented
 
+# Every stage below works on a ColumnarOrders, with times as integer seconds from the service-day origin
+# (midnight at the start of the service date), see columnar_orders.py. A nested group_orders dictionary
+# passed to any of them is converted to a ColumnarOrders on the way in and back on the way out.
 
-def allocate_booking_times(group_orders):
+STARTERS, MAINS, DESSERTS, SIDES, ALC_DRINKS, NON_ALC_DRINKS, WINES, DESSERT_WINES = range(len(CATEGORIES))
+DRINK_CATEGORIES = [ALC_DRINKS, NON_ALC_DRINKS]
+# Categories whose order times a wine can be merged into
+MERGE_CATEGORIES = [STARTERS, MAINS, DESSERTS, ALC_DRINKS, NON_ALC_DRINKS]
+
+
+def _seconds(duration):
+    """Returns a timedelta from the config as whole seconds."""
+    return int(duration.total_seconds())
+
+
+@instrumented("booking", count=len)
+@group_orders_stage
+def allocate_booking_times(orders, config, scheduler=None, service_date=None, rng=None):
     """
-    Allocates booking start times for each group in group_orders.
-    
+    Allocates booking start times for each group in orders.
+
     Rules (from config):
       - 1-2 guests: 90 minutes; candidate tables: 2-seat list.
       - 3-4 guests: 150 minutes; candidate tables: 4-seat list.
       - 5+ guests: 180 minutes; candidate tables: 6-seat list.
-    
+
     Bookings can start every 15 minutes between 5:00 PM and 9:00 PM.
     The ideal start time is 8:00 PM; if that time is unavailable on a candidate table,
     the function searches for alternative start times (e.g. 7:45, 8:15, 7:30, etc.)
     until a free slot is found. It also reassigns the table if needed.
-    
-    The function returns the updated group_orders with two new keys added to each group:
-        "booking_time": a datetime object for the start time,
-        "booking_duration": a timedelta for the booking length.
+
+    Free slots are found with a BookingScheduler (a per-table occupancy bitmap over the 15-minute grid).
+    Pass one in to share it between calls or to read its list of unallocated groups afterwards;
+    otherwise a new one is created for the service on service_date (today if None).
+    The table is drawn with rng (a fresh generator if None) from the candidate tables that still have room.
+
+    The function returns the updated orders, with for each group:
+        table_no: the table, NO_TABLE if no slot was found,
+        booking_time: the start time in seconds from the service-day origin, NO_TIME if no slot was found,
+        booking_duration: the booking length in seconds, NO_TIME if no slot was found.
+    (As a nested dictionary: "booking_time" a datetime and "booking_duration" a timedelta, or None.)
     """
 
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-
-    # Fetch lists of table numbers from config 
-    tables_2_top = config["two_top_tables"]
-    tables_4_top = config["four_top_tables"]
-    tables_6_top = config["six_top_tables"]
-    
-    # Build a schedule dictionary for each table (key: table number, value: list of bookings)
-    # Each booking is a tuple: (start_time, end_time, group_key)
-    table_schedule = {}
-    
-    # Generate potential start times
-    # every 15 minutes between config["opening_time"] and config["last_booking"]
-    potential_starts = []
-    today = datetime.date.today()
-    current = datetime.datetime.combine(today, datetime.time(config["opening_time"], 0))
-    service_end = datetime.datetime.combine(today, datetime.time(config["last_booking"], 0))
-    while current <= service_end:
-        potential_starts.append(current)
-        current += datetime.timedelta(minutes=15)
-    
-    # We want times closest to config["ideal_booking_time"] first.
-    ideal = datetime.datetime.combine(today, datetime.time(config["ideal_booking_time"], 0))
-    potential_starts.sort(key=lambda t: abs((t - ideal).total_seconds()))
-    
+    # Per-table occupancy of the 15-minute grid, with start times tried closest to config["ideal_booking_time"] first.
+    if scheduler is None:
+        scheduler = BookingScheduler(config, service_date or datetime.date.today())
+    rng = rng if rng is not None else np.random.default_rng()
+
+    table_no = np.full(len(orders), NO_TABLE, dtype=np.int32)
+    booking_time = np.full(len(orders), NO_TIME, dtype=np.int32)
+    booking_duration = np.full(len(orders), NO_TIME, dtype=np.int32)
+
     # For each group, determine duration and candidate tables based on guest count.
-    for group_key, group_data in group_orders.items():
-        
-        guest_count = len(group_data["mains"])  # Each guest orders a main.
-        if guest_count <= 2:
-            duration = datetime.timedelta(minutes=config["turn_time_two_top"])
-            candidate_tables = tables_2_top
-        elif guest_count <= 4:
-            duration = datetime.timedelta(minutes=config["turn_time_four_top"])
-            candidate_tables = tables_4_top
-        else:
-            duration = datetime.timedelta(minutes=config["turn_time_six_top"])
-            candidate_tables = tables_6_top
-
-        allocated = False
-        # Try candidate tables in random order.
-        candidate_tables_order = candidate_tables[:]
-        random.shuffle(candidate_tables_order)
-        for table in candidate_tables_order:
-            # Initialize table schedule if not yet done.
-            if table not in table_schedule:
-                table_schedule[table] = []
-            # Try each potential start time.
-            for start in potential_starts:
-                end = start + duration
-                # Check for overlap with existing bookings on this table.
-                conflict = False
-                for booking in table_schedule[table]:
-                    existing_start, existing_end, _ = booking
-                    # Overlap exists if the intervals intersect.
-                    if not (end <= existing_start or start >= existing_end):
-                        conflict = True
-                        break
-                if not conflict:
-                    # Booking fits on this table at this start time.
-                    group_data["booking_time"] = start
-                    group_data["booking_duration"] = duration
-                    group_data["table_no"] = table  # Update the table if needed.
-                    table_schedule[table].append((start, end, group_key))
-                    allocated = True
-                    break
-            if allocated:
-                break
-        if not allocated:
-            # If no slot was found, set booking time and duration to None.
-            group_data["booking_time"] = None
-            group_data["booking_duration"] = None
-    return group_orders
-
-def allocate_drink_order_times(group_orders):
+    guest_counts = orders.category_sizes("mains").tolist()  # Each guest orders a main.
+    for g, (group_key, guest_count) in enumerate(zip(orders.group_keys, guest_counts)):
+        duration, candidate_tables = config.table_rule(guest_count)
+
+        # A random candidate table with room (like trying them in random order).
+        booking = scheduler.book(group_key, candidate_tables, duration, rng)
+        if booking is not None:
+            # Booking fits on this table at this start time; otherwise the group keeps NO_TABLE/NO_TIME.
+            table_no[g], booking_time[g] = booking
+            booking_duration[g] = _seconds(duration)
+
+    orders.table_no = table_no
+    orders.booking_time = booking_time
+    orders.booking_duration = booking_duration
+    orders.bookings_allocated = True
+    orders.service_date = scheduler.service_date
+    return orders
+
+@instrumented("drinks", count=len)
+@group_orders_stage
+def allocate_drink_order_times(orders, config, rng=None):
     """
-    For each group in group_orders, update the lists for "alc_drinks" and "non_alc_drinks"
-    so that each drink UUID is paired with an ordering timestamp.
-    
+    For each booked group in orders, gives every "alc_drinks" and "non_alc_drinks" row an ordering time.
+
     Rules:
       - Drinks can only be ordered after the first config["initial_drinks_order_wait_time"] minutes of the booking.
       - Drinks are ordered in rounds.
@@ -117,90 +92,90 @@ def allocate_drink_order_times(group_orders):
             * Determine total drinks.
             * Set number of rounds = min(total drinks, number of guests) (each guest is counted by the length of "mains").
             * Partition the total number randomly into that many rounds (each round gets at least one drink).
-            * The first round’s timestamp is set to booking_time plus a random time between 
+            * The first round’s timestamp is set to booking_time plus a random time between
                 config["initial_drinks_order_wait_time_min"] and config["initial_drinks_order_wait_time_max"] minutes.
             * Each subsequent round’s timestamp = previous round timestamp + 10 minutes (to make) + a random consumption time (15-25 minutes).
-      - Replace the original list (e.g. ['uuid1', 'uuid2', ...]) with a list of tuples:
-            [(uuid, order_timestamp), ...]
+      - Drinks take their round's time in list order (as a nested dictionary, the list of codes becomes a list
+        of tuples: [(code, order_timestamp), ...]).
+
+    Both drink types of every booked group are done in one pass. Each (group, drink type) with drinks is a
+    "segment" of consecutive rows: a random key per row picks the rows that start a new round (the rounds - 1
+    smallest keys among all but the segment's first row, i.e. a uniformly random partition), and the round
+    times are cumulative sums of one batch of consumption draws.
+
+    Random draws come from rng (a fresh generator if None).
     """
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-
-    for group_key, group_data in group_orders.items():
-        
-        booking_time = group_data.get("booking_time")
-        if not booking_time:
-            continue  # skip if no booking time is set
-        # Use the number of mains as the guest count (each guest orders a main).
-        guest_count = len(group_data.get("mains", []))
-        # Process both drink types.
-        for drink_type in ["alc_drinks", "non_alc_drinks"]:
-            drink_list = group_data.get(drink_type, [])
-            total_drinks = len(drink_list)
-            if total_drinks == 0:
-                continue
-            # Determine number of rounds: if there are at least as many drinks as guests, use guest_count rounds;
-            # otherwise, use total_drinks rounds.
-            rounds = guest_count if total_drinks >= guest_count else total_drinks
-            
-            # Partition total_drinks into 'rounds' parts (each at least 1).
-            if rounds == 1:
-                partition = [total_drinks]
-            else:
-                # Create a random partition by choosing (rounds - 1) divider points between 1 and total_drinks-1.
-                dividers = sorted(random.sample(range(1, total_drinks), rounds - 1))
-                partition = []
-                prev = 0
-                for d in dividers:
-                    partition.append(d - prev)
-                    prev = d
-                partition.append(total_drinks - prev)
-            
-            # Determine ordering timestamps for each round.
-            round_times = []
-            # Choose a random delay between 10 and 15 minutes for the first round.
-            current_time = booking_time + datetime.timedelta(minutes=random.randint(
-                config["initial_drinks_order_wait_time_min"],
-                config["initial_drinks_order_wait_time_max"])
-                )
-            for r in range(rounds):
-                round_times.append(current_time)
-                # Each round takes 10 minutes to make plus a random consumption time between 15 and 25 minutes.
-                consumption_time = random.randint(
-                    config["drink_consumption_time_min"],
-                    config["drink_consumption_time_max"]
-                )
-                current_time = current_time + datetime.timedelta(minutes=config["drink_round_prod_time"] + consumption_time)
-            
-            # Now assign each drink in drink_list to a round according to the partition.
-            new_drink_list = []
-            idx = 0
-            for r in range(rounds):
-                count = partition[r]
-                for i in range(count):
-                    new_drink_list.append((drink_list[idx], round_times[r]))
-                    idx += 1
-            # Update the group data for the drink type.
-            group_data[drink_type] = new_drink_list
-    return group_orders
-
-def allocate_food_order_times(group_orders):
+    rng = rng if rng is not None else np.random.default_rng()
+    round_prod_time = _seconds(config.drink_round_prod_time)
+
+    # The drink rows of booked groups, in row order: alc_drinks then non_alc_drinks of each group
+    group_id = orders.group_id
+    category = orders.category
+    drink_rows = np.flatnonzero(((category == ALC_DRINKS) | (category == NON_ALC_DRINKS))
+                                & (orders.booking_time != NO_TIME)[group_id])
+    if len(drink_rows) == 0:
+        return orders
+
+    # Split them into segments, one per (group, drink type)
+    segment_key = group_id[drink_rows].astype(np.int64) * 2 + (category[drink_rows] - ALC_DRINKS)
+    segment_first = np.concatenate([[True], segment_key[1:] != segment_key[:-1]])
+    segment = np.cumsum(segment_first) - 1        # segment of each drink row
+    segment_start = np.flatnonzero(segment_first)  # position of each segment's first row
+    total_drinks = np.diff(np.append(segment_start, len(drink_rows)))
+    segment_group = group_id[drink_rows[segment_start]]
+
+    # Determine number of rounds: if there are at least as many drinks as guests, use guest_count rounds;
+    # otherwise, use total_drinks rounds.
+    guest_counts = orders.category_sizes("mains")[segment_group]  # Each guest orders a main.
+    rounds = np.minimum(total_drinks, guest_counts)
+
+    # Partition total_drinks into 'rounds' parts (each at least 1): the rounds - 1 rows (other than the first)
+    # with the smallest random keys in their segment each start a new round.
+    keys = rng.random(len(drink_rows))
+    keys[segment_start] = np.inf  # the first row always belongs to the first round
+    by_key = np.lexsort((keys, segment))
+    rank = np.empty(len(drink_rows), dtype=np.int64)
+    rank[by_key] = np.arange(len(drink_rows)) - segment_start[segment[by_key]]
+    starts_round = rank < (rounds - 1)[segment]
+    # Round of each row within its segment (no segment's first row starts a round, so no carry-over)
+    round_count = np.cumsum(starts_round)
+    row_round = round_count - round_count[segment_start][segment]
+
+    # Determine ordering timestamps for each round: the first a random 10-15 minutes after the booking,
+    # each next one 10 minutes (to make) plus a random consumption time (15-25 minutes) after the previous.
+    first_round_time = (orders.booking_time[segment_group].astype(np.int64)
+                        + 60 * rng.integers(*config.initial_drinks_order_wait_range, size=len(rounds), endpoint=True))
+    round_segment = np.repeat(np.arange(len(rounds)), rounds)
+    round_offset = np.cumsum(rounds) - rounds  # index of each segment's first round
+    round_step = round_prod_time + 60 * rng.integers(*config.drink_consumption_time_range, size=len(round_segment),
+                                                     endpoint=True)
+    elapsed = np.cumsum(round_step) - round_step  # steps before each round, from the first round of the night
+    round_times = first_round_time[round_segment] + elapsed - elapsed[round_offset][round_segment]
+
+    # Now give each drink its round's time according to the partition.
+    order_time = orders.order_time.copy()
+    order_time[drink_rows] = round_times[round_offset[segment] + row_round]
+    orders.order_time = order_time
+    return orders
+
+@instrumented("food", count=len)
+@group_orders_stage
+def allocate_food_order_times(orders, config, rng=None):
     """
-    For each group in group_orders, assign ordering timestamps to food items (starters, mains, desserts, and sides)
+    For each booked group in orders, assign ordering timestamps to food items (starters, mains, desserts, and sides)
     following these rules:
-    
-      - A candidate food order start time is chosen randomly between 
+
+      - A candidate food order start time is chosen randomly between
         config["initial_food_order_wait_time_min"] and config["initial_food_order_wait_time_max"] minutes after booking,
         but not before 1 minute after the earliest drink order.
-      
+
       - Starters:
           * If any starters are ordered (non-None values), they are ordered at food_start.
-          * Their total time (preparation + consumption) T_starters is randomly chosen between 
+          * Their total time (preparation + consumption) T_starters is randomly chosen between
                  config["starters_consumption_time_min"] and config["starters_consumption_time_max"] minutes.
           * They finish at: starters_finish = food_start + T_starters.
           * If no starters are ordered, then starters_finish is set to food_start.
-      
+
       - Mains (and sides):
           * If starters exist:
                 - A target main preparation time T_main is chosen randomly between
@@ -213,261 +188,251 @@ def allocate_food_order_times(group_orders):
                 - The mains will be ready only after waiting a full T_main minutes, where T_main is random between 30 and 40.
           * In both cases, after the order is placed, a consumption time T_consume (random between 30 and 40 minutes)
             is added to determine when the mains are consumed.
-      
+
       - Desserts:
           * Desserts are ordered 2 minutes after the mains have been consumed.
-    
-    For each food category, each non-None item is replaced by a tuple: (uuid, order_time).
+
+    Every non-None starter and dessert, and every main and side, gets its order time
+    (as a nested dictionary, each such item is replaced by a tuple: (code, order_time)).
+
+    The whole night is done at once: each random duration is drawn for every booked group in one call,
+    the timeline is worked out with array arithmetic (one entry per group) and then scattered onto the item rows.
+    Random draws come from rng (a fresh generator if None).
     """
+    rng = rng if rng is not None else np.random.default_rng()
 
-     # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-
-    for group_key, group_data in group_orders.items():
-        
-        booking_time = group_data.get("booking_time")
-        if not booking_time:
-            continue  # Skip groups without a booking time
-
-        # Determine earliest drink order time (if any)
-        drink_times = []
-        for tup in group_data.get("alc_drinks", []):
-            drink_times.append(tup[1])
-        for tup in group_data.get("non_alc_drinks", []):
-            drink_times.append(tup[1])
-        if drink_times:
-            earliest_drink = min(drink_times)
-        else:
-            earliest_drink = booking_time
-
-        # Choose candidate food start time: random between 
-        # config["initial_food_order_wait_time_min"] and config["initial_food_order_wait_time_max"] minutes after booking,
-        # but ensure it is at least 1 minute after the earliest drink order.
-        candidate_offset = random.randint(
-            config["initial_food_order_wait_time_min"],
-            config["initial_food_order_wait_time_max"]
-            )
-        candidate_food_start = booking_time + datetime.timedelta(minutes=candidate_offset)
-        food_start = max(candidate_food_start, earliest_drink + datetime.timedelta(minutes=1))
-        
-        # Process starters.
-        starters_list = group_data.get("starters", [])
-        starters_exist = any(item is not None for item in starters_list)
-        new_starters = []
-        if starters_exist:
-            # Order all non-None starters at food_start.
-            for item in starters_list:
-                if item is None:
-                    new_starters.append(None)
-                else:
-                    new_starters.append((item, food_start))
-            group_data["starters"] = new_starters
-            # Choose T_starters (total time for starters) between 
-            # config["starters_consumption_time_min"] and config["starters_consumption_time_max"].
-            T_starters = random.randint(
-                config["starters_consumption_time_min"],
-                config["starters_consumption_time_max"]
-                )
-            starters_finish = food_start + datetime.timedelta(minutes=T_starters)
-        else:
-            starters_finish = food_start  # No starters; nothing delays mains ordering.
-
-        # Process mains and sides.
-        T_main = random.randint(
-            config["mains_prep_time_min"],
-            config["mains_prep_time_max"]
-            )
-        if starters_exist:
-            # Mains have been cooking concurrently during the starters.
-            additional_cooking = max(0, T_main - (starters_finish - food_start).seconds // 60)
-            mains_order_time = starters_finish + datetime.timedelta(minutes=additional_cooking)
-        else:
-            # If no starters, mains are ordered immediately at food_start.
-            mains_order_time = food_start
-        # When mains are ordered at food_start (no starters), they are only ready after T_main minutes.
-        mains_ready = mains_order_time if starters_exist else (food_start + datetime.timedelta(minutes=T_main))
-        T_consume = random.randint(
-            config["mains_consumption_time_min"],
-            config["mains_consumption__time_max"]
-            )
-        mains_consumed = mains_ready + datetime.timedelta(minutes=T_consume)
-        
-        # Update mains and sides: record order time as determined.
-        new_mains = [(item, mains_order_time) for item in group_data.get("mains", [])]
-        group_data["mains"] = new_mains
-        new_sides = [(item, mains_order_time) for item in group_data.get("sides", [])]
-        group_data["sides"] = new_sides
-
-        # Process desserts: order a random time between
-        # config["desserts_order_time_min"] and config["desserts_order_time_max"] minutes after the mains have been consumed.
-        desserts_offset = random.randint(
-            config["desserts_order_time_min"],
-            config["desserts_order_time_max"]
-        )
-        desserts_order_time = mains_consumed + datetime.timedelta(minutes=desserts_offset)
-        new_desserts = []
-        for item in group_data.get("desserts", []):
-            if item is None:
-                new_desserts.append(None)
-            else:
-                new_desserts.append((item, desserts_order_time))
-        group_data["desserts"] = new_desserts
-        
-    return group_orders
+    booked = orders.booking_time != NO_TIME
+    booked_count = int(booked.sum())
+    if booked_count == 0:
+        return orders
+
+    # Per-group arrays (int64 so the sums can't overflow), only the booked groups' entries are used
+    booking_time = orders.booking_time.astype(np.int64)
+    group_id = orders.group_id
+    category = orders.category
+    order_time = orders.order_time.copy()
+    has_item = orders.item_code != NO_ITEM
 
-def allocate_wine_order_times(group_orders):
+    def draw_minutes(minutes_range):
+        # One draw per booked group, as seconds; unbooked groups get 0
+        seconds = np.zeros(len(orders), dtype=np.int64)
+        seconds[booked] = 60 * rng.integers(*minutes_range, size=booked_count, endpoint=True)
+        return seconds
+
+    # Determine earliest drink order time of each group (booking_time if it has none).
+    is_drink = (category == ALC_DRINKS) | (category == NON_ALC_DRINKS)
+    timed_drinks = is_drink & (order_time != NO_TIME)
+    earliest_drink = booking_time.copy()
+    has_drinks = np.zeros(len(orders), dtype=bool)
+    has_drinks[group_id[timed_drinks]] = True
+    earliest_drink[has_drinks] = np.iinfo(np.int64).max
+    np.minimum.at(earliest_drink, group_id[timed_drinks], order_time[timed_drinks].astype(np.int64))
+
+    # Choose candidate food start time: random between
+    # config["initial_food_order_wait_time_min"] and config["initial_food_order_wait_time_max"] minutes after booking,
+    # but ensure it is at least 1 minute after the earliest drink order.
+    candidate_offset = draw_minutes(config.initial_food_order_wait_range)
+    T_starters = draw_minutes(config.starters_consumption_time_range)
+    T_main = draw_minutes(config.mains_prep_time_range)
+    T_consume = draw_minutes(config.mains_consumption_time_range)
+    desserts_offset = draw_minutes(config.desserts_order_time_range)
+    food_start = np.maximum(booking_time + candidate_offset, earliest_drink + 60)
+
+    # Groups with at least one non-None starter
+    starter_rows = (category == STARTERS) & has_item
+    starters_exist = np.bincount(group_id[starter_rows], minlength=len(orders)) > 0
+
+    # Starters finish T_starters after food_start; with no starters nothing delays mains ordering.
+    starters_finish = np.where(starters_exist, food_start + T_starters, food_start)
+    # With starters, mains have been cooking concurrently and are ordered after any additional cooking;
+    # without, they are ordered immediately at food_start.
+    mains_order_time = np.where(starters_exist, starters_finish + np.maximum(0, T_main - T_starters), food_start)
+    # When mains are ordered at food_start (no starters), they are only ready after T_main minutes.
+    mains_ready = np.where(starters_exist, mains_order_time, food_start + T_main)
+    mains_consumed = mains_ready + T_consume
+    # Desserts are ordered a random time between
+    # config["desserts_order_time_min"] and config["desserts_order_time_max"] minutes after the mains have been consumed.
+    desserts_order_time = mains_consumed + desserts_offset
+
+    # Scatter the group times onto the rows of the booked groups: every non-None starter and dessert,
+    # and every main and side.
+    row_booked = booked[group_id]
+    for rows, times in [(starter_rows, food_start),
+                        ((category == MAINS) | (category == SIDES), mains_order_time),
+                        ((category == DESSERTS) & has_item, desserts_order_time)]:
+        rows = rows & row_booked
+        order_time[rows] = times[group_id[rows]]
+
+    orders.order_time = order_time
+    return orders
+
+def merge_with_nearest(order_time, sorted_times, timeframe):
     """
-    For each group in group_orders, update both "wines" and "dessert_wines" as follows:
-    
+    Snaps order_time to the closest of sorted_times if it is within timeframe of it.
+
+    The closest time is one of the two neighbours of order_time in the sorted list, so it is found with a
+    binary search (bisect) instead of a scan of every time. On a tie the earlier time is used.
+
+    Parameters:
+        order_time (int): The drawn order time in seconds (datetimes work too, with a timedelta timeframe).
+        sorted_times (list): The candidate order times, sorted.
+        timeframe (int): The largest gap that gets merged, in seconds.
+
+    Returns:
+        int: The closest candidate time, or order_time if none is within timeframe.
+    """
+    position = bisect.bisect_left(sorted_times, order_time)
+    closest_time = None
+    if position < len(sorted_times) and sorted_times[position] - order_time <= timeframe:
+        closest_time = sorted_times[position]
+    if position > 0 and order_time - sorted_times[position - 1] <= timeframe:
+        if closest_time is None or order_time - sorted_times[position - 1] <= closest_time - order_time:
+            closest_time = sorted_times[position - 1]
+    return closest_time if closest_time is not None else order_time
+
+@instrumented("wine_times", count=len)
+@group_orders_stage
+def allocate_wine_order_times(orders, config, rng=None):
+    """
+    For each booked group in orders, give both "wines" and "dessert_wines" an order time as follows:
+
     Regular Wines:
       - Lower bound: earliest drink order time from alc_drinks/non_alc_drinks (or booking_time if none).
       - Upper bound: if any non-None dessert exists, the minimum dessert order time; otherwise, the group’s close time.
       - A random timestamp is chosen between these bounds.
       - If the chosen timestamp is within config["merge_orders_timeframe"] of any other food/drink order time
         (from starters, mains, desserts, alc_drinks, non_alc_drinks), it is adjusted to exactly match that time.
-        
+
     Dessert Wines:
       - Lower bound: if any non-None dessert exists, the minimum dessert order time; otherwise,
                      use the maximum main order time plus config["mains_consumption__time_max"] as an approximation for mains consumption.
       - Upper bound: the group’s close time.
       - A random timestamp is chosen between these bounds and then adjusted (if within timeframe of any candidate time)
-        as above.
-    
-    The function returns the updated group_orders.
+        as above, with the same config["merge_orders_timeframe"].
+
+    The candidate times of a group are gathered and sorted once, and each wine finds its closest candidate
+    with a binary search (see merge_with_nearest(...)). Wines that already have an order time are left as they are.
+
+    Random draws come from rng (a fresh generator if None). The function returns the updated orders.
     """
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-
-    for group_key, group_data in group_orders.items():
-        
-        booking_time = group_data.get("booking_time")
-        booking_duration = group_data.get("booking_duration")
-        if not (booking_time and booking_duration):
-            continue
-        close_time = booking_time + booking_duration
+    rng = rng if rng is not None else np.random.default_rng()
+    merge_timeframe = _seconds(config.merge_orders_timeframe)
+    mains_consumption_time_max = _seconds(config.mains_consumption_time_max)
+
+    order_time = orders.order_time.tolist()
+    has_item = (orders.item_code != NO_ITEM).tolist()
+    category_offsets = orders.category_offsets.tolist()
+    booking_times = orders.booking_time.tolist()
+    booking_durations = orders.booking_duration.tolist()
+
+    booked = (orders.booking_time != NO_TIME) & (orders.booking_duration != NO_TIME)
+    for g in np.flatnonzero(booked).tolist():
+        booking_time = booking_times[g]
+        close_time = booking_time + booking_durations[g]
+        offsets = category_offsets[g]
+
+        def times_of(category):
+            return [time for time in order_time[offsets[category]:offsets[category + 1]] if time != NO_TIME]
+
+        # Gather the order times of the group's other items once, sorted, to merge every wine against.
+        candidate_times = sorted(time for c in MERGE_CATEGORIES for time in times_of(c))
 
         # --- Process Regular Wines ---
         # Lower bound: earliest drink order time from alc_drinks/non_alc_drinks or booking_time.
-        drink_times = []
-        for tup in group_data.get("alc_drinks", []):
-            drink_times.append(tup[1])
-        for tup in group_data.get("non_alc_drinks", []):
-            drink_times.append(tup[1])
+        drink_times = times_of(ALC_DRINKS) + times_of(NON_ALC_DRINKS)
         lower_bound = min(drink_times) if drink_times else booking_time
 
         # Upper bound: if any dessert exists (non-None in desserts), use min(dessert order time); otherwise, close_time.
-        dessert_times = []
-        for dessert in group_data.get("desserts", []):
-            if dessert is not None:
-                dessert_times.append(dessert[1])
-        if dessert_times:
-            upper_bound = min(dessert_times)
-        else:
-            upper_bound = close_time
-
-        interval_seconds = int((upper_bound - lower_bound).total_seconds())
-        new_wines = []
-        for wine_uuid in group_data.get("wines", []):
-            # If already a tuple (already processed), skip.
-            if isinstance(wine_uuid, tuple):
-                new_wines.append(wine_uuid)
+        dessert_times = [order_time[row] for row in range(offsets[DESSERTS], offsets[DESSERTS + 1])
+                         if has_item[row] and order_time[row] != NO_TIME]
+        upper_bound = min(dessert_times) if dessert_times else close_time
+
+        interval_seconds = upper_bound - lower_bound
+        for row in range(offsets[WINES], offsets[WINES + 1]):
+            # If already allocated, skip.
+            if order_time[row] != NO_TIME:
                 continue
             if interval_seconds > 0:
-                rand_offset = random.randint(0, interval_seconds)
-                order_time = lower_bound + datetime.timedelta(seconds=rand_offset)
+                wine_time = lower_bound + int(rng.integers(0, interval_seconds, endpoint=True))
             else:
-                order_time = lower_bound
-
-            # Gather candidate times from other items.
-            candidate_times = []
-            for key in ["starters", "mains", "desserts", "alc_drinks", "non_alc_drinks"]:
-                for item in group_data.get(key, []):
-                    if item is None:
-                        continue
-                    if isinstance(item, tuple):
-                        candidate_times.append(item[1])
+                wine_time = lower_bound
             # If within config["merge_orders_timeframe"] seconds of any candidate, adjust to that candidate's time.
-            min_diff = None
-            closest_time = None
-            for candidate in candidate_times:
-                diff = abs((order_time - candidate).total_seconds())
-                if diff <= config["merge_orders_timeframe"]:
-                    if min_diff is None or diff < min_diff:
-                        min_diff = diff
-                        closest_time = candidate
-            if closest_time is not None:
-                order_time = closest_time
-            new_wines.append((wine_uuid, order_time))
-        group_data["wines"] = new_wines
+            order_time[row] = merge_with_nearest(wine_time, candidate_times, merge_timeframe)
 
         # --- Process Dessert Wines ---
-        dessert_wine_list = group_data.get("dessert_wines", [])
-        new_dessert_wines = []
         # Lower bound: if any dessert exists, use min(dessert order time); otherwise, approximate as (max(mains order time) + 35 min).
         if dessert_times:
             dessert_lower_bound = min(dessert_times)
         else:
-            mains_times = []
-            for tup in group_data.get("mains", []):
-                if isinstance(tup, tuple):
-                    mains_times.append(tup[1])
+            mains_times = times_of(MAINS)
             if mains_times:
-                dessert_lower_bound = max(mains_times) + datetime.timedelta(minutes=config["mains_consumption__time_max"])
+                dessert_lower_bound = max(mains_times) + mains_consumption_time_max
             else:
                 dessert_lower_bound = booking_time
 
-        upper_bound_dw = close_time
-        interval_seconds_dw = int((upper_bound_dw - dessert_lower_bound).total_seconds())
-        for dw in dessert_wine_list:
-            if isinstance(dw, tuple):
-                new_dessert_wines.append(dw)
+        interval_seconds_dw = close_time - dessert_lower_bound
+        for row in range(offsets[DESSERT_WINES], offsets[DESSERT_WINES + 1]):
+            if order_time[row] != NO_TIME:
                 continue
             if interval_seconds_dw > 0:
-                rand_offset = random.randint(0, interval_seconds_dw)
-                order_time_dw = dessert_lower_bound + datetime.timedelta(seconds=rand_offset)
+                wine_time = dessert_lower_bound + int(rng.integers(0, interval_seconds_dw, endpoint=True))
             else:
-                order_time_dw = dessert_lower_bound
-
-            # Adjust if within 5 minutes of any candidate from other items.
-            candidate_times_dw = []
-            for key in ["starters", "mains", "desserts", "alc_drinks", "non_alc_drinks"]:
-                for item in group_data.get(key, []):
-                    if item is None:
-                        continue
-                    if isinstance(item, tuple):
-                        candidate_times_dw.append(item[1])
-            min_diff_dw = None
-            closest_time_dw = None
-            for candidate in candidate_times_dw:
-                diff = abs((order_time_dw - candidate).total_seconds())
-                if diff <= 300:
-                    if min_diff_dw is None or diff < min_diff_dw:
-                        min_diff_dw = diff
-                        closest_time_dw = candidate
-            if closest_time_dw is not None:
-                order_time_dw = closest_time_dw
-            new_dessert_wines.append((dw, order_time_dw))
-        group_data["dessert_wines"] = new_dessert_wines
-
-    
-    return group_orders
-
-def allocate_ordering_times(group_orders):
+                wine_time = dessert_lower_bound
+            # Adjust if within config["merge_orders_timeframe"] seconds of any candidate, like the regular wines.
+            order_time[row] = merge_with_nearest(wine_time, candidate_times, merge_timeframe)
+
+    orders.order_time = np.array(order_time, dtype=np.int32)
+    return orders
+
+@group_orders_stage
+def allocate_ordering_times(orders, config, service_date=None, rngs=None, scheduler=None):
     """
     Calls the other functions in sequence in order to allocate times for booking, drinks, food, and wine.
-    
+
+    Accepts either the nested group_orders dict or a ColumnarOrders, and returns the same kind. A dict is
+    converted to a ColumnarOrders once here, every stage then works on integer seconds from the service-day
+    origin, and the result is converted back once at the end.
+
     Args:
-        group_orders (dict): The group orders that will be updated with the relevant timestamps.
-        
+        orders (dict | ColumnarOrders): The group orders that will be updated with the relevant timestamps.
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night the bookings are made for, defaults to today.
+        rngs (dict): Optional stage -> random generator mapping (see seeding.night_rngs(...)), fresh generators if None.
+        scheduler (BookingScheduler): Optional scheduler holding the bookings made so far, see allocate_booking_times(...).
+
     Returns:
-        dict: The updated group_orders with allocated times for booking, drinks, food, and wine.
+        dict | ColumnarOrders: The updated orders with allocated times for booking, drinks, food, and wine.
     """
     # Call each function in order
-    group_orders = allocate_booking_times(group_orders)
-    group_orders = allocate_drink_order_times(group_orders)
-    group_orders = allocate_food_order_times(group_orders)
-    group_orders = allocate_wine_order_times(group_orders)
+    rngs = rngs or {}
+    orders = allocate_booking_times(orders, config, scheduler=scheduler, service_date=service_date,
+                                    rng=rngs.get("bookings"))
+    orders = allocate_drink_order_times(orders, config, rng=rngs.get("drinks"))
+    orders = allocate_food_order_times(orders, config, rng=rngs.get("food"))
+    orders = allocate_wine_order_times(orders, config, rng=rngs.get("wine_times"))
+
+    return orders
+
+def allocate_ordering_time_batches(batches, config, service_date=None, rngs=None, scheduler=None):
+    """
+    Streaming version of allocate_ordering_times(...): allocates each batch of group orders (e.g. from
+    generate_group_orders.generate_group_order_batches(...)) as it comes and yields it.
 
-    return group_orders
+    The bookings are the only state shared between batches: every batch is booked on the same BookingScheduler,
+    whose size depends on the number of tables, not on the number of groups. Batches are booked in the order
+    they come, as the groups of a single ColumnarOrders would be.
+
+    Args:
+        batches (iterable): ColumnarOrders batches of one night.
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night the bookings are made for, defaults to today.
+        rngs (dict): Optional stage -> random generator mapping, each generator carries on from one batch to the next.
+        scheduler (BookingScheduler): Optional scheduler to book on, a new one for service_date if None.
+
+    Yields:
+        ColumnarOrders: Each batch with allocated times for booking, drinks, food, and wine.
+    """
+    if scheduler is None:
+        scheduler = BookingScheduler(config, service_date or datetime.date.today())
+    for batch in batches:
+        yield allocate_ordering_times(batch, config, service_date=service_date, rngs=rngs, scheduler=scheduler)
@@ -0,0 +1,283 @@
+from generate_group_orders import generate_final_group_orders, generate_group_order_batches, STREAM_BATCH_SIZE
+from allocate_ordering_times import allocate_ordering_times, allocate_ordering_time_batches
+from menu_index import MenuIndex
+from sim_config import SimConfig, load_sim_config
+from menu_source import load_offline_menu
+from run_sim import prepare_order_data
+from seeding import night_rngs
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import datetime
+import platform
+import resource
+import subprocess
+import contextlib
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_COVERS = [100, 1000, 10000, 100000, 1000000]
+COVERS_PER_TABLE = 3  # roughly what the real floor plan seats in a night (51 tables for ~150 covers)
+BENCHMARK_DATE = datetime.date(2025, 1, 6)  # a fixed night, so every run draws the same orders for a given seed
+
+# Options of generate_final_group_orders(...) for each engine, or of generate_group_order_batches(...) for streaming
+ENGINES = {
+    "reference": {"batched": False, "columnar": False},
+    "batched": {"batched": True, "columnar": False},
+    "columnar": {"batched": True, "columnar": True},
+    "streaming": {"batch_size": STREAM_BATCH_SIZE},
+}
+STAGES = ["generate", "allocate", "prepare_rows"]
+
+
+def scaled_config(config, table_count):
+    """
+    Returns a copy of config with table_count tables, split between two, four and six tops
+    in the same proportions as the configured floor plan and numbered from 1.
+    """
+    raw = dict(config.raw)
+    table_lists = ["two_top_tables", "four_top_tables", "six_top_tables"]
+    configured = [len(raw[key]) for key in table_lists]
+
+    counts = [max(1, round(table_count * count / sum(configured))) for count in configured]
+    next_table = 1
+    for key, count in zip(table_lists, counts):
+        raw[key] = list(range(next_table, next_table + count))
+        next_table += count
+    return SimConfig.from_dict(raw)
+
+
+def default_table_count(covers, config):
+    """Returns the number of tables used for a cover count when none is given: the real floor plan, or more."""
+    configured = len(config.two_top_tables) + len(config.four_top_tables) + len(config.six_top_tables)
+    return max(configured, math.ceil(covers / COVERS_PER_TABLE))
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_pipeline(menu_index, config, covers, engine, seed, measure):
+    """
+    Runs one night through every stage, wrapping each in measure(stage_name).
+
+    The streaming engine runs its stages interleaved, one batch at a time, as the rows are consumed:
+    its generate and allocate stages only set up the stream, and all the work is measured in prepare_rows.
+
+    Returns:
+        tuple: (number of groups, number of order rows)
+    """
+    rngs = night_rngs(seed, BENCHMARK_DATE)
+    if engine == "streaming":
+        with measure("generate"):
+            batches = generate_group_order_batches(menu_index, config, service_date=BENCHMARK_DATE, rngs=rngs,
+                                                   customer_count=covers, **ENGINES[engine])
+        with measure("allocate"):
+            batches = allocate_ordering_time_batches(batches, config, service_date=BENCHMARK_DATE, rngs=rngs)
+        with measure("prepare_rows"):
+            group_count = row_count = 0
+            for batch in batches:
+                group_count += len(batch)
+                row_count += sum(1 for _ in prepare_order_data(batch, menu_index, rngs["order_ids"]))
+        return group_count, row_count
+
+    with measure("generate"):
+        group_orders = generate_final_group_orders(menu_index, config, service_date=BENCHMARK_DATE, rngs=rngs,
+                                                   customer_count=covers, **ENGINES[engine])
+    with measure("allocate"):
+        group_orders = allocate_ordering_times(group_orders, config, service_date=BENCHMARK_DATE, rngs=rngs)
+    with measure("prepare_rows"):
+        row_count = sum(1 for _ in prepare_order_data(group_orders, menu_index, rngs["order_ids"]))
+    return len(group_orders), row_count
+
+
+def run_case(covers, table_count, engine, seed, trace_allocations):
+    """
+    Benchmarks one (covers, tables, engine) case. Runs in its own fresh process, so the peak RSS is the case's own.
+
+    The timed pass runs first, without tracing. With trace_allocations the same night is then run again
+    under tracemalloc (which slows Python down a lot) to record each stage's allocation peak.
+
+    Returns:
+        dict: The case parameters and, per stage, seconds, peak_rss_mb and (if traced) alloc_peak_mb/alloc_net_mb.
+    """
+    config = scaled_config(load_sim_config(), table_count)
+    menu_index = MenuIndex(load_offline_menu(), config.categories)
+    stages = {stage: {} for stage in STAGES}
+
+    @contextlib.contextmanager
+    def timed(stage):
+        start = time.perf_counter()
+        yield
+        stages[stage]["seconds"] = time.perf_counter() - start
+        stages[stage]["peak_rss_mb"] = peak_rss_mb()
+
+    @contextlib.contextmanager
+    def traced(stage):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        yield
+        after, peak = tracemalloc.get_traced_memory()
+        stages[stage]["alloc_peak_mb"] = (peak - before) / (1024 * 1024)
+        stages[stage]["alloc_net_mb"] = (after - before) / (1024 * 1024)
+
+    group_count, row_count = run_pipeline(menu_index, config, covers, engine, seed, timed)
+    if trace_allocations:
+        tracemalloc.start()
+        try:
+            run_pipeline(menu_index, config, covers, engine, seed, traced)
+        finally:
+            tracemalloc.stop()
+
+    stages["pipeline"] = {
+        "seconds": sum(stages[stage]["seconds"] for stage in STAGES),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if trace_allocations:
+        stages["pipeline"]["alloc_peak_mb"] = max(stages[stage]["alloc_peak_mb"] for stage in STAGES)
+
+    return {
+        "engine": engine,
+        "covers": covers,
+        "tables": table_count,
+        "groups": group_count,
+        "rows": row_count,
+        "stages": stages,
+    }
+
+
+def git_commit():
+    """Returns the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=script_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(covers_list, table_counts=None, engines=("batched",), seed=0, trace_allocations=True):
+    """
+    Runs every (engine, covers, tables) case, each in a fresh spawned process.
+
+    Parameters:
+        covers_list (list): Cover counts to simulate.
+        table_counts (list): Table counts to pair with every cover count, scaled with the covers if None.
+        engines (list): Names from ENGINES.
+        seed (int): Seed of every simulated night.
+        trace_allocations (bool): Also record allocations with tracemalloc (in a second, untimed pass).
+
+    Returns:
+        dict: Run metadata and the list of case results, ready to be written as JSON.
+    """
+    config = load_sim_config()
+    results = []
+    for engine in engines:
+        for covers in covers_list:
+            for table_count in table_counts or [default_table_count(covers, config)]:
+                print(f"Benchmarking {engine}: {covers} covers, {table_count} tables")
+                # A fresh process per case, so its peak RSS isn't inflated by the cases before it
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(run_case, covers, table_count, engine, seed, trace_allocations).result()
+                print(f"    {result['groups']} groups, {result['rows']} rows: " + ", ".join(
+                    f"{stage} {timing['seconds']:.3f}s" for stage, timing in result["stages"].items()))
+                results.append(result)
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.10, min_seconds=0.05):
+    """
+    Compares two benchmark result files stage by stage, for the cases present in both.
+
+    Parameters:
+        baseline (dict): Results of the reference commit.
+        current (dict): Results of the commit being checked.
+        threshold (float): Relative slowdown above which a stage counts as a regression (0.10 = 10% slower).
+        min_seconds (float): Stages faster than this in the baseline are listed but never flagged, their timings are mostly noise.
+
+    Returns:
+        list: (engine, covers, tables, stage, baseline seconds, current seconds) of every regression.
+    """
+    baseline_cases = {(r["engine"], r["covers"], r["tables"]): r for r in baseline["results"]}
+    regressions = []
+
+    print(f"{'engine':<10} {'covers':>8} {'tables':>7} {'stage':<13} {'baseline':>10} {'current':>10} {'change':>8}")
+    for result in current["results"]:
+        key = (result["engine"], result["covers"], result["tables"])
+        if key not in baseline_cases:
+            continue
+        for stage, timing in result["stages"].items():
+            base_seconds = baseline_cases[key]["stages"].get(stage, {}).get("seconds")
+            if not base_seconds:
+                continue
+            change = timing["seconds"] / base_seconds - 1
+            regressed = change > threshold and base_seconds >= min_seconds
+            flag = "  <-- slower" if regressed else ""
+            print(f"{key[0]:<10} {key[1]:>8} {key[2]:>7} {stage:<13} {base_seconds:>9.3f}s "
+                  f"{timing['seconds']:>9.3f}s {change:>+7.1%}{flag}")
+            if regressed:
+                regressions.append(key + (stage, base_seconds, timing["seconds"]))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the simulation at growing scales.")
+    parser.add_argument("--covers", type=int, nargs="+", default=DEFAULT_COVERS,
+                        help="cover counts to simulate (default: %(default)s)")
+    parser.add_argument("--tables", type=int, nargs="+", default=None,
+                        help="table counts to run every cover count with (default: one table per "
+                             f"{COVERS_PER_TABLE} covers, at least the configured floor plan)")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=["batched"],
+                        help="generation engines to benchmark (the reference engine is slow at large scales)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of every simulated night")
+    parser.add_argument("--allocations", action=argparse.BooleanOptionalAction, default=True,
+                        help="also trace allocations with tracemalloc, in a second untimed pass")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running, exit with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression by --compare (default: %(default)s)")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="stages faster than this in the baseline are never reported as regressions (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline_path, current_path = args.compare
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        with open(current_path, "r") as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold, args.min_seconds)
+        print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    # Compile the menu snapshot once up front, so no case pays for parsing the CSVs
+    load_offline_menu()
+
+    benchmark = run_benchmarks(args.covers, args.tables, args.engines, args.seed, args.allocations)
+    with open(args.output, "w") as f:
+        json.dump(benchmark, f, indent=4)
+    print(f"Benchmark results saved as {args.output}")
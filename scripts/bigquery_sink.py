@@ -0,0 +1,287 @@
+import concurrent.futures
+import datetime
+import io
+import itertools
+import json
+import tempfile
+import threading
+import time
+import uuid
+
+
+class BigQuerySinkError(Exception):
+    """Raised when rows could not be written to BigQuery, even after retrying. Holds the rows in failed_rows."""
+
+    def __init__(self, message, failed_rows):
+        super().__init__(message)
+        self.failed_rows = failed_rows
+
+
+class BigQuerySink:
+    """
+    Writes order rows to a BigQuery table.
+
+    In "stream" mode (the default) rows are split into batches bounded by both row count and encoded size
+    (to stay under the streaming insert request limits), and the batches are sent through a bounded thread
+    pool with insert_rows_json(...). Rows that BigQuery rejects, or whole batches whose request fails, are
+    retried with exponential backoff. Each row keeps the same insert id across retries, so BigQuery can
+    de-duplicate a retried row that had in fact been written.
+
+    In "load" mode all rows are written to one NDJSON (or Parquet, if pyarrow is installed) file and sent as
+    a single load job, which is cheaper and has no per-request size limit for bulk volumes.
+
+    Any rows still failing at the end are reported by raising BigQuerySinkError rather than being dropped.
+    """
+
+    def __init__(self, client, table_id="restaurant_data.orders", mode="stream", load_format="ndjson",
+                 max_batch_rows=500, max_batch_bytes=5 * 1024 * 1024, max_workers=4,
+                 max_retries=5, backoff_seconds=1.0):
+        """
+        Parameters:
+            client: A bigquery.Client, or a stand-in with the same interface (e.g. FakeBigQueryClient).
+            table_id (str): "dataset.table" to write to.
+            mode (str): "stream" for batched streaming inserts, "load" for a single load job.
+            load_format (str): "ndjson" or "parquet", the file format used in "load" mode.
+            max_batch_rows (int): Most rows per streaming insert request.
+            max_batch_bytes (int): Most JSON-encoded bytes per streaming insert request.
+            max_workers (int): Most requests in flight at once.
+            max_retries (int): Retries for failed rows/requests before giving up on them.
+            backoff_seconds (float): Delay before the first retry, doubled for every following one.
+        """
+        if mode not in ("stream", "load"):
+            raise ValueError(f"Unknown BigQuery sink mode: {mode}")
+        if load_format not in ("ndjson", "parquet"):
+            raise ValueError(f"Unknown BigQuery load format: {load_format}")
+        self.client = client
+        self.table_id = table_id
+        self.mode = mode
+        self.load_format = load_format
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_bytes = max_batch_bytes
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def write(self, rows):
+        """
+        Writes all rows (any iterable of JSON-serialisable dicts, e.g. the prepare_order_data(...) generator).
+
+        Returns:
+            int: The number of rows written.
+
+        Raises:
+            BigQuerySinkError: If some rows could not be written.
+        """
+        if self.mode == "load":
+            return self._write_load_job(rows)
+        return self._write_streaming(rows)
+
+    # --- Streaming inserts ---
+
+    def _write_streaming(self, rows):
+        written = 0
+        failed_rows = []
+        lock = threading.Lock()
+
+        def send(batch):
+            nonlocal written
+            batch_failed = self._insert_with_retries(batch)
+            with lock:
+                written += len(batch) - len(batch_failed)
+                failed_rows.extend(batch_failed)
+
+        # Keep at most 2 batches per worker queued, so memory stays bounded for a streamed input
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for batch in self._batches(rows):
+                if len(pending) >= 2 * self.max_workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(send, batch))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+
+        if failed_rows:
+            raise BigQuerySinkError(f"{len(failed_rows)} rows could not be inserted into {self.table_id}", failed_rows)
+        return written
+
+    def _batches(self, rows):
+        """Yields lists of (insert_id, row) bounded by max_batch_rows and max_batch_bytes."""
+        batch, batch_bytes = [], 0
+        for row in rows:
+            row_bytes = len(json.dumps(row))
+            if batch and (len(batch) >= self.max_batch_rows or batch_bytes + row_bytes > self.max_batch_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append((str(uuid.uuid4()), row))
+            batch_bytes += row_bytes
+        if batch:
+            yield batch
+
+    def _insert_with_retries(self, batch):
+        """Inserts one batch, retrying the rows that fail. Returns the rows that still failed."""
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            try:
+                errors = self.client.insert_rows_json(self.table_id, [row for _, row in batch],
+                                                      row_ids=[insert_id for insert_id, _ in batch])
+            except Exception as e:
+                print(f"BigQuery insert request failed (attempt {attempt + 1}): {e}")
+                continue
+            if not errors:
+                return []
+            failed_indexes = sorted({error["index"] for error in errors})
+            print(f"BigQuery Insert Errors (attempt {attempt + 1}): {len(failed_indexes)} of {len(batch)} rows")
+            batch = [batch[i] for i in failed_indexes]
+        return [row for _, row in batch]
+
+    # --- Load jobs ---
+
+    def _write_load_job(self, rows):
+        from google.cloud import bigquery
+
+        # Spool the rows to a temporary file rather than memory, the load job reads it from the start
+        with tempfile.TemporaryFile() as data:
+            if self.load_format == "parquet":
+                row_count = _write_parquet(rows, data)
+                source_format = bigquery.SourceFormat.PARQUET
+            else:
+                row_count = 0
+                for row in rows:
+                    data.write(json.dumps(row).encode("utf-8") + b"\n")
+                    row_count += 1
+                source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+
+            job_config = bigquery.LoadJobConfig(source_format=source_format)
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+                data.seek(0)
+                try:
+                    self.client.load_table_from_file(data, self.table_id, job_config=job_config).result()
+                    return row_count
+                except Exception as e:
+                    print(f"BigQuery load job failed (attempt {attempt + 1}): {e}")
+
+            data.seek(0)
+            failed_rows = _read_parquet(data) if self.load_format == "parquet" else \
+                [json.loads(line) for line in data.read().decode("utf-8").splitlines()]
+        raise BigQuerySinkError(f"Load job into {self.table_id} failed", failed_rows)
+
+
+def _write_parquet(rows, file_obj, chunk_size=65536):
+    """
+    Writes order rows to file_obj as Parquet, chunk_size rows at a time, matching the orders table schema
+    (table_no as a STRING, datetime_ordered as a TIMESTAMP). Needs the optional pyarrow dependency.
+
+    Returns:
+        int: The number of rows written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Loading Parquet into BigQuery needs pyarrow: pip install pyarrow") from e
+
+    schema = pa.schema([
+        ("table_no", pa.string()),
+        ("item_uuid", pa.string()),
+        ("datetime_ordered", pa.timestamp("s")),
+        ("dep", pa.string()),
+        ("order_uuid", pa.string()),
+    ])
+    row_count = 0
+    with pq.ParquetWriter(file_obj, schema) as writer:
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            columns = {field: [row[field] for row in chunk] for field in schema.names}
+            columns["table_no"] = [str(table_no) for table_no in columns["table_no"]]
+            columns["datetime_ordered"] = [
+                datetime.datetime.fromisoformat(t) if t else None for t in columns["datetime_ordered"]
+            ]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            row_count += len(chunk)
+    return row_count
+
+
+def _read_parquet(file_obj):
+    import pyarrow.parquet as pq
+    return pq.read_table(file_obj).to_pylist()
+
+
+class FakeBigQueryClient:
+    """
+    A local stand-in for bigquery.Client covering the calls BigQuerySink makes.
+
+    Inserted rows are kept in self.tables (table_id -> list of rows), and every load job that succeeded in
+    self.load_jobs (dicts of destination, source_format and, for Parquet, the file's Arrow schema).
+    Failures can be injected:
+        - fail_requests: the next n insert_rows_json/load_table_from_file calls raise an exception
+        - fail_row: a function row -> bool; matching rows are rejected, failing_attempts times each
+    """
+
+    def __init__(self, fail_requests=0, fail_row=None, failing_attempts=1):
+        self.tables = {}
+        self.load_jobs = []
+        self.requests = 0
+        self.fail_requests = fail_requests
+        self.fail_row = fail_row
+        self.failing_attempts = failing_attempts
+        self._row_failures = {}
+        self._inserted_ids = set()
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table, json_rows, row_ids=None):
+        with self._lock:
+            self.requests += 1
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                raise ConnectionError("injected request failure")
+
+            row_ids = row_ids or [None] * len(json_rows)
+            errors = []
+            for index, (row, row_id) in enumerate(zip(json_rows, row_ids)):
+                key = row_id if row_id is not None else id(row)
+                if self.fail_row is not None and self.fail_row(row) and \
+                        self._row_failures.get(key, 0) < self.failing_attempts:
+                    self._row_failures[key] = self._row_failures.get(key, 0) + 1
+                    errors.append({"index": index, "errors": [{"reason": "injected", "message": "injected row failure"}]})
+                    continue
+                if row_id is not None and row_id in self._inserted_ids:
+                    continue  # de-duplicated by insert id, like BigQuery
+                if row_id is not None:
+                    self._inserted_ids.add(row_id)
+                self.tables.setdefault(str(table), []).append(row)
+            return errors
+
+    def load_table_from_file(self, file_obj, destination, job_config=None):
+        with self._lock:
+            self.requests += 1
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                raise ConnectionError("injected request failure")
+            data = file_obj.read()
+            schema = None
+            if data.startswith(b"PAR1"):
+                import pyarrow.parquet as pq
+                rows = _read_parquet(io.BytesIO(data))
+                schema = pq.read_schema(io.BytesIO(data))
+            else:
+                rows = [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+            self.tables.setdefault(str(destination), []).extend(rows)
+            self.load_jobs.append({
+                "destination": str(destination),
+                "source_format": job_config.source_format if job_config is not None else None,
+                "schema": schema,
+            })
+            return _FakeLoadJob()
+
+
+class _FakeLoadJob:
+    def result(self):
+        return self
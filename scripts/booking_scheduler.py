@@ -0,0 +1,152 @@
+import datetime
+import math
+
+import numpy as np
+
+
+SLOT_MINUTES = 15  # bookings start on a 15-minute grid
+
+
+class _TablesWithRoom:
+    """
+    The bitmap rows of one set of candidate tables that still have a free start for one booking length,
+    as an unordered array with O(1) removal (the removed row is swapped with the last one).
+    """
+
+    def __init__(self, rows, table_count):
+        self.rows = np.array(rows, dtype=np.int64)
+        self.count = len(self.rows)
+        self.positions = np.full(table_count, -1, dtype=np.int64)  # bitmap row -> its index in rows, -1 if absent
+        self.positions[self.rows] = np.arange(self.count)
+
+    def discard(self, row):
+        position = self.positions[row]
+        if position < 0:
+            return
+        self.count -= 1
+        last = self.rows[self.count]
+        self.rows[position] = last
+        self.positions[last] = position
+        self.positions[row] = -1
+
+
+class BookingScheduler:
+    """
+    Keeps the bookings of one night's service as a per-table occupancy bitmap over the 15-minute grid.
+
+    Row i of the bitmap is a table, column j is the 15-minute slot starting j * 15 minutes after opening.
+    A booking of d minutes starting at slot j marks slots j .. j + ceil(d / 15) - 1 as taken. Because bookings
+    only start on the grid, two bookings overlap exactly when their marked slots intersect, so a free-slot
+    check is a window over the bitmap instead of a scan over every existing booking.
+
+    For every booking length in use, a (tables x potential starts) matrix of which starts are still free is
+    kept up to date, along with, for every set of candidate tables (a table class such as the two tops), the
+    tables that still have a free start. A table only ever loses room, so booking one updates its own row and
+    drops it from those sets; finding a table is a random pick from a set plus an argmax over one row, whatever
+    the number of tables.
+
+    Attributes:
+        service_date (datetime.date): The date of the service.
+        table_numbers (list): Table numbers, in bitmap row order.
+        occupancy (np.ndarray): Boolean (tables x slots) bitmap, True where a table is taken.
+        unallocated (list): Keys of the groups that couldn't be given a table.
+    """
+
+    def __init__(self, config, service_date):
+        """
+        Parameters:
+            config (SimConfig): The compiled simulation config.
+            service_date (datetime.date): The date the bookings are made for.
+        """
+        self.service_date = service_date
+        self.table_numbers = list(dict.fromkeys(config.two_top_tables + config.four_top_tables + config.six_top_tables))
+        self.table_rows = {table: row for row, table in enumerate(self.table_numbers)}
+
+        # Potential starts as slot numbers from opening, already ordered nearest to the ideal booking time first
+        self.opening = min(config.booking_slots)
+        self.start_slots = np.array([(offset - self.opening) // datetime.timedelta(minutes=SLOT_MINUTES)
+                                     for offset in config.booking_slots], dtype=np.int64)
+
+        longest_booking = max(duration for duration, _ in config.table_rules)
+        slot_count = int(self.start_slots.max()) + 1 + self.duration_slots(longest_booking)
+        self.occupancy = np.zeros((len(self.table_numbers), slot_count), dtype=bool)
+        self.free_starts = {}  # booking length in slots -> (tables x start_slots) matrix of free starts
+        self.has_room = {}  # booking length in slots -> bool array, True for the tables with any free start
+        # booking length in slots -> {id(candidate tables) -> (candidate tables, _TablesWithRoom)}
+        self.tables_with_room = {}
+        self.unallocated = []
+
+    @staticmethod
+    def duration_slots(duration):
+        """Returns the number of grid slots a booking of the given timedelta covers."""
+        return math.ceil(duration / datetime.timedelta(minutes=SLOT_MINUTES))
+
+    def slot_time(self, slot):
+        """Returns the datetime at which a grid slot starts."""
+        midnight = datetime.datetime.combine(self.service_date, datetime.time(0, 0))
+        return midnight + datetime.timedelta(seconds=self.slot_seconds(slot))
+
+    def slot_seconds(self, slot):
+        """Returns the time at which a grid slot starts, in seconds from midnight at the start of the service date."""
+        return int(self.opening.total_seconds()) + SLOT_MINUTES * 60 * int(slot)
+
+    def book(self, group_key, candidate_tables, duration, rng=None):
+        """
+        Books a random candidate table that has a free start time, at its start time nearest to the ideal booking time.
+
+        The table is drawn uniformly from the candidates that still have room, which is the same as trying the
+        candidates in a random order and taking the first one with room.
+
+        Parameters:
+            group_key (str): The key of the group being seated.
+            candidate_tables (tuple): Table numbers to choose from. Its tables with room are tracked per object, so
+                                      pass the same tuple for every group of a table class, as config.table_rule(...)
+                                      returns (hashing thousands of table numbers per booking would cost more
+                                      than the booking).
+            duration (datetime.timedelta): Length of the booking.
+            rng (np.random.Generator): Random generator picking the table, a fresh one is created if None.
+
+        Returns:
+            tuple: (table number, start in seconds from midnight of the service date, see slot_seconds(...)),
+                   or None if no candidate table has room (the group is then recorded in self.unallocated).
+        """
+        length = self.duration_slots(duration)
+        if length not in self.free_starts:
+            self.free_starts[length] = self._free_starts(slice(None), length)
+            self.has_room[length] = self.free_starts[length].any(axis=1)
+            self.tables_with_room[length] = {}
+
+        tracked, tables = self.tables_with_room[length].get(id(candidate_tables), (None, None))
+        if tracked is not candidate_tables:
+            rows = np.array(list(dict.fromkeys(self.table_rows[table] for table in candidate_tables)), dtype=np.int64)
+            tables = _TablesWithRoom(rows[self.has_room[length][rows]], len(self.table_numbers))
+            # The tuple is kept alongside, so its id can't be reused by another object while it is tracked
+            self.tables_with_room[length][id(candidate_tables)] = (candidate_tables, tables)
+
+        if tables.count == 0:
+            self.unallocated.append(group_key)
+            return None
+
+        rng = rng if rng is not None else np.random.default_rng()
+        row = int(tables.rows[rng.integers(tables.count)])
+        start_slot = self.start_slots[np.argmax(self.free_starts[length][row])]
+        self.occupancy[row, start_slot:start_slot + length] = True
+
+        # Only the booked table's free starts change, and it can only lose room
+        for other_length, free_starts in self.free_starts.items():
+            free_starts[row] = self._free_starts(row, other_length)
+            if self.has_room[other_length][row] and not free_starts[row].any():
+                self.has_room[other_length][row] = False
+                for _, other_tables in self.tables_with_room[other_length].values():
+                    other_tables.discard(row)
+        return self.table_numbers[row], self.slot_seconds(start_slot)
+
+    def _free_starts(self, rows, length):
+        """
+        Returns which potential starts of the given table rows have a free window [start, start + length).
+        """
+        occupancy = np.atleast_2d(self.occupancy[rows])
+        taken_before = np.zeros((occupancy.shape[0], occupancy.shape[1] + 1), dtype=np.int32)
+        np.cumsum(occupancy, axis=1, out=taken_before[:, 1:])
+        free = taken_before[:, self.start_slots + length] == taken_before[:, self.start_slots]
+        return free if isinstance(rows, slice) else free[0]
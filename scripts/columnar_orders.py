@@ -0,0 +1,204 @@
+import datetime
+import functools
+
+import numpy as np
+
+
+# Order line categories, in the order prepare_order_data(...) emits them, and the department of each
+CATEGORIES = ["starters", "mains", "desserts", "sides", "alc_drinks", "non_alc_drinks", "wines", "dessert_wines"]
+DEPARTMENTS = ["kitchen", "bar"]
+CATEGORY_DEPARTMENTS = np.array([0, 0, 0, 0, 1, 1, 1, 1], dtype=np.int8)  # index into DEPARTMENTS
+
+NO_TABLE = -1  # table_no of a group without a booking
+NO_ITEM = -1   # item_code of an empty course placeholder
+NO_TIME = -1   # order_time / booking_time / booking_duration not set (not allocated, or no booking)
+
+
+class ColumnarOrders:
+    """
+    A struct-of-arrays representation of a night's group orders.
+
+    Instead of a dict of "group_N" dicts of lists (of item codes, then (code, datetime) tuples), every order line is a
+    row in a handful of flat arrays. Rows are sorted by group, then by category (in CATEGORIES order), then by
+    their position within the category, so each group and each (group, category) pair is a contiguous slice.
+    Empty course placeholders (the None entries in "starters"/"desserts"/"mains") are kept as rows with the NO_ITEM
+    code so that a round trip through to_group_orders() gives back the same lists.
+
+    Times are integer seconds from the service-day origin (midnight at the start of service_date), so the
+    allocation stages do plain integer arithmetic on arrays. They are turned into datetimes only when the
+    orders are exported (see datetimes(...)) or converted back with to_group_orders().
+
+    Row arrays (one entry per order line):
+        group_id (np.ndarray):     int32 position of the row's group in group_keys.
+        category (np.ndarray):     int8 index into CATEGORIES.
+        item_code (np.ndarray):    int32 item code (see MenuIndex), NO_ITEM for placeholders.
+        order_time (np.ndarray):   int32 ordering time in seconds from the origin, NO_TIME until allocated.
+        department (np.ndarray):   int8 index into DEPARTMENTS.
+
+    Group arrays (one entry per group):
+        group_keys (list):         the "group_N" keys.
+        offsets (np.ndarray):      rows of group g are offsets[g]:offsets[g + 1].
+        category_offsets (np.ndarray): (groups x len(CATEGORIES) + 1), rows of category c in group g are
+                                   category_offsets[g, c]:category_offsets[g, c + 1].
+        table_no (np.ndarray):     int32 table number, NO_TABLE if not booked.
+        booking_time (np.ndarray): int32 booking start in seconds from the origin, NO_TIME if not booked.
+        booking_duration (np.ndarray): int32 booking length in seconds, NO_TIME if not booked.
+        bookings_allocated (bool): whether allocate_booking_times(...) has run on these orders.
+        service_date (datetime.date): the night the times are counted from, None until bookings are allocated.
+    """
+
+    def __init__(self, group_keys, group_id, category, item_code, order_time=None,
+                 table_no=None, booking_time=None, booking_duration=None, bookings_allocated=False,
+                 service_date=None):
+        group_count = len(group_keys)
+        category_count = len(CATEGORIES)
+        group_id = np.asarray(group_id, dtype=np.int32)
+        category = np.asarray(category, dtype=np.int8)
+
+        # Keep rows grouped by (group, category); the stable sort preserves positions within a category
+        row_order = np.argsort(group_id.astype(np.int64) * category_count + category, kind="stable")
+
+        self.group_keys = list(group_keys)
+        self.group_id = group_id[row_order]
+        self.category = category[row_order]
+        self.item_code = np.asarray(item_code, dtype=np.int32)[row_order]
+        if order_time is None:
+            self.order_time = np.full(len(row_order), NO_TIME, dtype=np.int32)
+        else:
+            self.order_time = np.asarray(order_time, dtype=np.int32)[row_order]
+        self.department = CATEGORY_DEPARTMENTS[self.category]
+
+        rows_per_category = np.bincount(self.group_id.astype(np.int64) * category_count + self.category,
+                                        minlength=group_count * category_count)
+        self.category_offsets = np.zeros((group_count, category_count + 1), dtype=np.int64)
+        self.category_offsets[:, 1:] = np.cumsum(rows_per_category).reshape(group_count, category_count)
+        self.category_offsets[1:, 0] = self.category_offsets[:-1, -1]
+        self.offsets = np.append(self.category_offsets[:, 0], len(self.group_id))
+
+        self.table_no = (np.full(group_count, NO_TABLE, dtype=np.int32) if table_no is None
+                         else np.asarray(table_no, dtype=np.int32))
+        self.booking_time = (np.full(group_count, NO_TIME, dtype=np.int32) if booking_time is None
+                             else np.asarray(booking_time, dtype=np.int32))
+        self.booking_duration = (np.full(group_count, NO_TIME, dtype=np.int32) if booking_duration is None
+                                 else np.asarray(booking_duration, dtype=np.int32))
+        self.bookings_allocated = bookings_allocated
+        self.service_date = service_date
+
+    def __len__(self):
+        """Returns the number of groups."""
+        return len(self.group_keys)
+
+    def category_rows(self, group, category):
+        """Returns the slice of rows holding one group's items of one category (a name from CATEGORIES)."""
+        c = CATEGORIES.index(category)
+        return slice(self.category_offsets[group, c], self.category_offsets[group, c + 1])
+
+    def category_sizes(self, category):
+        """Returns the number of rows of one category (a name from CATEGORIES) in every group."""
+        c = CATEGORIES.index(category)
+        return self.category_offsets[:, c + 1] - self.category_offsets[:, c]
+
+    def origin(self):
+        """Returns the service-day origin the times are counted from, as a datetime.datetime."""
+        return datetime.datetime.combine(self.service_date or datetime.date.today(), datetime.time(0, 0))
+
+    def datetimes(self, seconds):
+        """
+        Converts times in seconds from the origin (e.g. order_time, or a slice of it) to datetime64[s],
+        with NaT where they are NO_TIME.
+        """
+        seconds = np.asarray(seconds)
+        times = np.datetime64(self.origin(), "s") + seconds.astype("timedelta64[s]")
+        times[seconds == NO_TIME] = np.datetime64("NaT")
+        return times
+
+    @classmethod
+    def from_group_orders(cls, group_orders, service_date=None):
+        """
+        Builds the columnar representation of a nested group_orders dictionary, before or after
+        any of the allocate_* stages have run.
+
+        Parameters:
+            group_orders (dict): Mapping of "group_N" -> group dict, as built by generate_final_group_orders(...).
+            service_date (datetime.date): The night the times are counted from. If None, the date of the first
+                                          booking time is used (bookings start and end on the service date).
+
+        Returns:
+            ColumnarOrders: The same orders as flat arrays.
+        """
+        if service_date is None:
+            service_date = next((group_data["booking_time"].date() for group_data in group_orders.values()
+                                 if group_data.get("booking_time") is not None), None)
+        origin = datetime.datetime.combine(service_date or datetime.date.today(), datetime.time(0, 0))
+
+        def seconds(time):
+            return NO_TIME if time is None else int((time - origin).total_seconds())
+
+        group_id, category, item_code, order_time = [], [], [], []
+        table_no, booking_time, booking_duration = [], [], []
+        bookings_allocated = False
+
+        for g, group_data in enumerate(group_orders.values()):
+            for c, category_name in enumerate(CATEGORIES):
+                for item in group_data.get(category_name, []):
+                    item, time = item if isinstance(item, tuple) else (item, None)
+                    group_id.append(g)
+                    category.append(c)
+                    item_code.append(NO_ITEM if item is None else item)
+                    order_time.append(seconds(time))
+
+            bookings_allocated = bookings_allocated or "booking_time" in group_data
+            booked = group_data.get("booking_time") is not None
+            table_no.append(group_data["table_no"] if booked else NO_TABLE)
+            booking_time.append(seconds(group_data.get("booking_time")))
+            duration = group_data.get("booking_duration")
+            booking_duration.append(NO_TIME if duration is None else int(duration.total_seconds()))
+
+        return cls(list(group_orders.keys()), group_id, category, item_code, order_time,
+                   table_no, booking_time, booking_duration, bookings_allocated, service_date)
+
+    def to_group_orders(self):
+        """
+        Compatibility adapter: rebuilds the nested group_orders dictionary the rest of the pipeline uses,
+        with (code, datetime) tuples for the items that have an order time.
+
+        Returns:
+            dict: Mapping of "group_N" -> group dict.
+        """
+        items = [None if code == NO_ITEM else code for code in self.item_code.tolist()]
+        times = self.datetimes(self.order_time).tolist()  # datetime.datetime, or None for NaT
+        table_nos = self.table_no.tolist()
+        booking_times = self.datetimes(self.booking_time).tolist()
+        booking_durations = [None if duration == NO_TIME else datetime.timedelta(seconds=duration)
+                             for duration in self.booking_duration.tolist()]
+
+        group_orders = {}
+        for g, group_key in enumerate(self.group_keys):
+            group_data = {}
+            for c, category_name in enumerate(CATEGORIES):
+                start, end = self.category_offsets[g, c], self.category_offsets[g, c + 1]
+                group_data[category_name] = [
+                    item if item is None or time is None else (item, time)
+                    for item, time in zip(items[start:end], times[start:end])
+                ]
+            if self.bookings_allocated:
+                group_data["booking_time"] = booking_times[g]
+                group_data["booking_duration"] = booking_durations[g]
+                if table_nos[g] != NO_TABLE:
+                    group_data["table_no"] = table_nos[g]
+            group_orders[group_key] = group_data
+        return group_orders
+
+
+def group_orders_stage(stage):
+    """
+    Decorator for pipeline stages written against ColumnarOrders, so they can also be given (and will then
+    return) the nested group_orders dictionary. The dictionary is converted once on the way in and once on
+    the way out, so chain such stages inside one decorated function rather than decorating each call.
+    """
+    @functools.wraps(stage)
+    def wrapper(group_orders, *args, **kwargs):
+        if isinstance(group_orders, ColumnarOrders):
+            return stage(group_orders, *args, **kwargs)
+        return stage(ColumnarOrders.from_group_orders(group_orders), *args, **kwargs).to_group_orders()
+    return wrapper
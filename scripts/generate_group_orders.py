@@ -1,153 +1,211 @@
-import random
 import json
 import datetime
 import os
-import sys
+
+import numpy as np
+
+from columnar_orders import CATEGORIES, NO_ITEM, ColumnarOrders
+from seeding import shared_rngs
+import metrics
 
 
 file_counter = 1 # used to name file logs
 verbose = False # turn to true if you want to see what the structures look like
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-config_file = os.path.join(script_dir, "..", "sim_config.json")
-config_file = os.path.abspath(config_file)  # normalize
+# Columns of the batched intention table, see generate_intention_table(...)
+INTENTION_COUNT_FIELDS = ["n_alc_drinks", "n_wine_servings", "n_dessert_wine_servings", "n_non_alc_drinks"]
+INTENTION_BOOL_FIELDS = ["b_starter", "b_main", "b_dessert"]
+INTENTION_DTYPE = np.dtype(
+    [(field, np.int16) for field in INTENTION_COUNT_FIELDS] + [(field, np.bool_) for field in INTENTION_BOOL_FIELDS]
+)
 
-print("🔍 Looking for config at:", config_file)
+STREAM_BATCH_SIZE = 5000  # customers per batch of generate_group_order_batches(...)
 
-if not os.path.exists(config_file):
-    print("❌ sim_config.json not found at:", config_file)
-    sys.exit(1)
 
-
-def generate_customer_order_intention():
+def generate_customer_order_intention(config, rng=None):
     """
-    Generates a random order intention based on probabilities loaded from a config file.
+    Generates a random order intention based on probabilities from the simulation config.
+
+    Parameters:
+        config (SimConfig): The compiled simulation config.
+        rng (np.random.Generator): Optional random generator.
 
     Returns:
         dict: A dictionary representing what a single customer would order during the course of the night.
     """
-    # Load the order configuration from the JSON file
-    with open(config_file, "r") as f:
-        probabilities = json.load(f)
-
+    rng = rng if rng is not None else np.random.default_rng()
     customer_order_intention_dict = {
-        "n_alc_drinks":             sum(int(random.random() < p) for p in probabilities["n_alc_drinks"]),
-        "n_wine_servings":          sum(int(random.random() < p) for p in probabilities["n_wine_servings"]),          # Determines how many 250ml servings the customer will have
-        "n_dessert_wine_servings":  sum(int(random.random() < p) for p in probabilities["n_dessert_wine_servings"]),  # Determines how many 70ml servings the customer will have
-        "n_non_alc_drinks":         sum(int(random.random() < p) for p in probabilities["n_non_alc_drinks"]),
-        "b_starter":                bool(random.random() < probabilities["b_starter"][0]),
-        "b_main":                   bool(random.random() < probabilities["b_main"][0]),
-        "b_dessert":                bool(random.random() < probabilities["b_dessert"][0])
+        "n_alc_drinks":             int((rng.random(len(config.n_alc_drinks)) < config.n_alc_drinks).sum()),
+        "n_wine_servings":          int((rng.random(len(config.n_wine_servings)) < config.n_wine_servings).sum()),                  # Determines how many 250ml servings the customer will have
+        "n_dessert_wine_servings":  int((rng.random(len(config.n_dessert_wine_servings)) < config.n_dessert_wine_servings).sum()),  # Determines how many 70ml servings the customer will have
+        "n_non_alc_drinks":         int((rng.random(len(config.n_non_alc_drinks)) < config.n_non_alc_drinks).sum()),
+        "b_starter":                bool(rng.random() < config.b_starter),
+        "b_main":                   bool(rng.random() < config.b_main),
+        "b_dessert":                bool(rng.random() < config.b_dessert)
     }
 
     return customer_order_intention_dict
 
-def generate_list_of_intentions():
+def generate_list_of_intentions(config, service_date=None, rng=None, customer_count=None):
     """
     Generates a list of customer order intentions based on the day of the week.
+
+    Parameters:
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night being simulated, defaults to today.
+        rng (np.random.Generator): Optional random generator, used for the customer count and every intention.
+        customer_count (int): Number of customers, drawn with draw_customer_count(...) if None.
     
     Returns:
         list: A list of order intention dictionaries.
     """
-    # Load the order configuration from the JSON file
-    with open(config_file, "r") as f:
-        probabilities = json.load(f)
-    
-    # Get the min and max number of customers depending on the day of the week set in the config file
-    today_weekday = datetime.datetime.today().weekday()
-    min_customers, max_customers = probabilities["customer_count_range"][str(today_weekday)]
+    rng = rng if rng is not None else np.random.default_rng()
+    order_count = customer_count if customer_count is not None else draw_customer_count(config, service_date, rng)
     
-    order_count = random.randint(min_customers, max_customers)
-    
-    all_customer_orderintentions = [generate_customer_order_intention() for _ in range(order_count)]
+    all_customer_orderintentions = [generate_customer_order_intention(config, rng) for _ in range(order_count)]
     
     log_generation_step(all_customer_orderintentions, "list_of_intentions")
     return all_customer_orderintentions
 
-def generate_customer_order(customer_order_intention_dict, full_menu_df):
+def draw_customer_count(config, service_date=None, rng=None):
+    """
+    Draws the number of customers for a night's service.
+
+    Parameters:
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night being simulated, defaults to today.
+        rng (np.random.Generator): Optional random generator.
+
+    Returns:
+        int: A random count between the min and max set in the config file for the service date's day of the week.
+    """
+    if service_date is None:
+        service_date = datetime.date.today()
+
+    # Get the min and max number of customers depending on the day of the week set in the config file
+    min_customers, max_customers = config.customer_count_range[service_date.weekday()]
+    
+    rng = rng if rng is not None else np.random.default_rng()
+    return int(rng.integers(min_customers, max_customers, endpoint=True))
+
+def generate_intention_table(config, customer_count=None, rng=None, service_date=None):
+    """
+    Batched version of generate_list_of_intentions(...): draws every customer's order intention
+    for the night at once.
+
+    A single (customers x probabilities) matrix of uniform draws is compared against all the
+    config probability vectors laid side by side, and each field is the sum (or the single value)
+    of its block of columns. The result is the same distribution as generate_customer_order_intention(...).
+
+    Parameters:
+        config (SimConfig): The compiled simulation config.
+        customer_count (int): Number of customers, drawn with draw_customer_count(...) if None.
+        rng (np.random.Generator): Optional random generator.
+        service_date (datetime.date): The night being simulated (sets the customer count range), defaults to today.
+
+    Returns:
+        np.ndarray: A structured array with one row per customer and one column per intention field
+                    (see INTENTION_DTYPE).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if customer_count is None:
+        customer_count = draw_customer_count(config, service_date, rng)
+
+    probability_vectors = [getattr(config, field) for field in INTENTION_COUNT_FIELDS]
+    probability_vectors += [[getattr(config, field)] for field in INTENTION_BOOL_FIELDS]
+    probabilities = np.concatenate(probability_vectors)
+    block_starts = np.cumsum([0] + [len(vector) for vector in probability_vectors[:-1]])
+
+    # One Bernoulli trial per (customer, probability), then add up each field's block of columns
+    hits = rng.random((customer_count, len(probabilities))) < probabilities
+    counts = np.add.reduceat(hits, block_starts, axis=1)
+
+    intention_table = np.empty(customer_count, dtype=INTENTION_DTYPE)
+    for column, field in enumerate(INTENTION_COUNT_FIELDS + INTENTION_BOOL_FIELDS):
+        intention_table[field] = counts[:, column]
+
+    if verbose:
+        log_generation_step(intentions_from_table(intention_table), "list_of_intentions")
+    return intention_table
+
+def intentions_from_table(intention_table):
+    """
+    Converts a batched intention table back into the list of dictionaries returned by generate_list_of_intentions(...).
+    """
+    columns = {field: intention_table[field].tolist() for field in INTENTION_DTYPE.names}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+def generate_customer_order(customer_order_intention_dict, menu_index):
     """
     Processes a customer order intention (in the form of an order dictionary) 
-    and returns a new structured dictionary with UUIDs of items
+    and returns a new structured dictionary with the item codes (see MenuIndex) of items
     from the menu and wine serving counts (to be processed later on).
 
     Parameters:
         order_dict (dict): The dictionary containing order details.
-        full_menu_df (pd.DataFrame): The master dataframe containing menu items.
+        menu_index (MenuIndex): The precomputed index of the master menu.
 
     Returns:
         dict: A structured dictionary with ordered items and serving counts.
     """
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-    
     customer_order_dict = {
-        "alc_drinks": [],                                                  # List of alcoholic drink UUIDs
+        "alc_drinks": [],                                                  # List of alcoholic drink item codes
         "n_wine_servings": customer_order_intention_dict["n_wine_servings"],                  # Total wine servings, to be processed later
         "n_dessert_wine_servings": customer_order_intention_dict["n_dessert_wine_servings"],  # Total dessert wine servings, to be processed later
-        "non_alc_drinks": [],                                              # List of non-alcoholic drink UUIDs
-        "starter_id": None,                                                # Starter UUID
-        "main_id": None,                                                   # Main UUID
-        "dessert_id": None                                                 # Dessert UUID
+        "non_alc_drinks": [],                                              # List of non-alcoholic drink item codes
+        "starter_id": None,                                                # Starter item code
+        "main_id": None,                                                   # Main item code
+        "dessert_id": None                                                 # Dessert item code
     }
 
     # Select alcoholic drinks
     if customer_order_intention_dict["n_alc_drinks"] > 0:
-        alc_categories = config["categories"]["alc_drinks"]
-        alc_options = full_menu_df[full_menu_df["category"].isin(alc_categories)]
-        customer_order_dict["alc_drinks"] = alc_options.sample(n=min(customer_order_intention_dict["n_alc_drinks"], len(alc_options)))["item_uuid"].tolist()
+        customer_order_dict["alc_drinks"] = menu_index.sample("alc_drinks", customer_order_intention_dict["n_alc_drinks"])
 
     # Select non-alcoholic drinks
     if customer_order_intention_dict["n_non_alc_drinks"] > 0:
-        non_alc_categories = config["categories"]["non_alc_drinks"]
-        non_alc_options = full_menu_df[full_menu_df["category"].isin(non_alc_categories)]
-        customer_order_dict["non_alc_drinks"] = non_alc_options.sample(n=min(customer_order_intention_dict["n_non_alc_drinks"], len(non_alc_options)))["item_uuid"].tolist()
+        customer_order_dict["non_alc_drinks"] = menu_index.sample("non_alc_drinks", customer_order_intention_dict["n_non_alc_drinks"])
 
     # Select a starter
     if customer_order_intention_dict["b_starter"]:
-        starter_categories = config["categories"]["starters"]
-        starter_options = full_menu_df[full_menu_df["category"].isin(starter_categories)]
-        if not starter_options.empty:
-            customer_order_dict["starter_id"] = starter_options.sample(n=1)["item_uuid"].values[0]
+        customer_order_dict["starter_id"] = menu_index.choice("starters")
 
     # Select a main course
     if customer_order_intention_dict["b_main"]:
-        main_categories = config["categories"]["mains"]
-        main_options = full_menu_df[full_menu_df["category"].isin(main_categories)]
-        if not main_options.empty:
-            customer_order_dict["main_id"] = main_options.sample(n=1)["item_uuid"].values[0]
+        customer_order_dict["main_id"] = menu_index.choice("mains")
 
     # Select a dessert
     if customer_order_intention_dict["b_dessert"]:
-        dessert_categories = config["categories"]["desserts"]
-        dessert_options = full_menu_df[full_menu_df["category"].isin(dessert_categories)]
-        if not dessert_options.empty:
-            customer_order_dict["dessert_id"] = dessert_options.sample(n=1)["item_uuid"].values[0]
+        customer_order_dict["dessert_id"] = menu_index.choice("desserts")
 
     # WINE TO BE PROCESSED NEXT AS A SHARED ITEM WITHIN A GROUP
     
     return customer_order_dict
 
-def group_customer_orders(all_customer_orders, full_menu_df):
+def group_customer_orders(all_customer_orders, menu_index, rng=None, first_group_id=1):
     """
     Groups processed customer orders into parties based on two criteria:
       1. Customers without starters are grouped into parties of 1 to 4.
       2. Customers with the same sharing main item (if its category is "Large Cuts") are grouped into parties of 2 to 6.
       3. The remaining customers are grouped into parties of 1 to 4.
+
+    Group sizes and the shuffle of the remaining customers are drawn from rng (a fresh generator if None).
+    Groups are numbered from first_group_id.
       
     Returns:
         dict: A dictionary mapping group_id to a list of customer order indices.
     """
+    rng = rng if rng is not None else np.random.default_rng()
     
     group_mapping = {}
     assigned = set()
-    group_id = 1
+    group_id = first_group_id
 
     # Grouping 1: Customers without starters
     non_starter_orders = [idx for idx, order in all_customer_orders if order["starter_id"] is None]
     i = 0
     while i < len(non_starter_orders):
-        group_size = random.randint(1, 4)
+        group_size = int(rng.integers(1, 4, endpoint=True))
         group_size = min(group_size, len(non_starter_orders) - i)
         group_members = non_starter_orders[i:i+group_size]
         group_mapping[group_id] = group_members
@@ -162,8 +220,7 @@ def group_customer_orders(all_customer_orders, full_menu_df):
             continue
         main_id = order["main_id"]
         if main_id is not None:
-            main_cat_series = full_menu_df.loc[full_menu_df["item_uuid"] == main_id, "category"]
-            if not main_cat_series.empty and main_cat_series.values[0] == "Large Cuts":
+            if menu_index.category(main_id) == "Large Cuts":
                 large_cuts_groups.setdefault(main_id, []).append(idx)
     for main_id, order_list in large_cuts_groups.items():
         if len(order_list) >= 2:
@@ -181,10 +238,10 @@ def group_customer_orders(all_customer_orders, full_menu_df):
 
     # Group remaining customers randomly in groups of 1 to 4
     remaining = [idx for idx, order in all_customer_orders if idx not in assigned]
-    random.shuffle(remaining)
+    remaining = [remaining[i] for i in rng.permutation(len(remaining))]
     i = 0
     while i < len(remaining):
-        group_size = random.randint(1, 4)
+        group_size = int(rng.integers(1, 4, endpoint=True))
         group_size = min(group_size, len(remaining) - i)
         group_members = remaining[i:i+group_size]
         group_mapping[group_id] = group_members
@@ -195,106 +252,70 @@ def group_customer_orders(all_customer_orders, full_menu_df):
     log_generation_step(group_mapping, "group_mapping")
     return group_mapping
 
-def select_wine_from_menu(required_ml, wine_categories, full_menu_df):
+def select_wine_from_menu(required_ml, wine_group, menu_index):
     """
-    Selects wine items from the provided categories in full_menu_df to meet the required volume.
+    Selects wine items from the provided category group of the menu index to meet the required volume.
     
     Parameters:
         required_ml (int): The total required wine volume in milliliters.
-        wine_categories (list): List of wine categories to filter by.
-        full_menu_df (DataFrame): The full menu dataframe.
+        wine_group (str): The category group to select from ("wine" or "dessert_wine").
+        menu_index (MenuIndex): The precomputed index of the master menu.
     
     Returns:
-        list: A list of wine orders (item_uuid, item_name, serving_size).
+        list: A list of wine item codes.
     """
-    wine_order_list = []
+    # A single-row call of the batched selector, which draws until the cumulative serving size covers required_ml
+    return menu_index.draw_until_volume(wine_group, [required_ml])[0]
 
-    # Loop until we meet the required volume
-    while required_ml > 0:
-        # Select a random wine from the available categories
-        candidates = full_menu_df[full_menu_df["category"].isin(wine_categories)]
-        
-        if candidates.empty:
-            raise ValueError("No wines found in the specified categories.")
-        
-        # Randomly sample one wine item from the selected candidates
-        chosen = candidates.sample(n=1).iloc[0]
-        
-        # Add the selected wine's UUID to the wine order list
-        wine_order_list.append(chosen["item_uuid"])
-
-        # Decrease the required volume by the selected wine's serving size
-        required_ml -= chosen["serving_size"]
-
-    return wine_order_list
-
-def generate_group_wine_orders(customer_groups, all_customer_orders, full_menu_df):
+def generate_group_wine_orders(customer_groups, all_customer_orders, menu_index, config):
     """
     For each group, aggregates required wine ml based on the number of servings ordered
-    and selects wine items from full_menu_df until the requirement is met.
+    and selects wine items from menu_index until the requirement is met.
     
     Returns:
         dict: Mapping of group_id to a dictionary containing lists of wine orders and dessert wine orders.
-              Each order tuple is (item_uuid, item_name, serving_size).
+              Each list holds wine item codes.
     """
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-    
-    # Get wine categories from the config file
-    wine_categories = config["categories"]["wine"]
-    dessert_wine_categories = config["categories"]["dessert_wine"]
-    
-    # Initialize an empty dictionary to store the wine orders for each group
-    group_wine_orders = {}
+    group_ids = list(customer_groups)
 
-    # Loop through each group to generate the wine orders
-    for group_id, indices in customer_groups.items():
-        
-        # Calculate the total number of regular wine and dessert wine servings for the group
-        total_wine_servings = sum(all_customer_orders[i][1]["n_wine_servings"] for i in indices)
-        total_dessert_wine_servings = sum(all_customer_orders[i][1]["n_dessert_wine_servings"] for i in indices)
-        
-        # Calculate the required wine and dessert wine volume (in milliliters)
-        required_wine_ml = total_wine_servings * config["wine_serving_sizes"]["wine_serving"]  # 250ml per wine serving
-        required_dessert_wine_ml = total_dessert_wine_servings * config["wine_serving_sizes"]["dessert_wine_serving"]  # 70ml per dessert wine serving
+    # Calculate the total number of regular wine and dessert wine servings of every group
+    total_wine_servings = np.array([sum(all_customer_orders[i][1]["n_wine_servings"] for i in customer_groups[group_id])
+                                    for group_id in group_ids], dtype=np.int64)
+    total_dessert_wine_servings = np.array([sum(all_customer_orders[i][1]["n_dessert_wine_servings"] for i in customer_groups[group_id])
+                                            for group_id in group_ids], dtype=np.int64)
 
-        # Select regular wines
-        wine_order_list = select_wine_from_menu(required_wine_ml, wine_categories, full_menu_df)
-        
-        # Select dessert wines
-        dessert_wine_order_list = select_wine_from_menu(required_dessert_wine_ml, dessert_wine_categories, full_menu_df)
+    # Calculate the required wine and dessert wine volume (in milliliters)
+    required_wine_ml = total_wine_servings * config.wine_serving_ml  # 250ml per wine serving
+    required_dessert_wine_ml = total_dessert_wine_servings * config.dessert_wine_serving_ml  # 70ml per dessert wine serving
 
-        # Store the wine and dessert wine orders for the group
-        group_wine_orders[group_id] = {
+    # Select the wines of every group in one batched call per wine category group
+    wine_order_lists = menu_index.draw_until_volume("wine", required_wine_ml)
+    dessert_wine_order_lists = menu_index.draw_until_volume("dessert_wine", required_dessert_wine_ml)
+
+    # Store the wine and dessert wine orders for each group
+    group_wine_orders = {
+        group_id: {
             "wine_orders": wine_order_list,
             "dessert_wine_orders": dessert_wine_order_list
         }
-    
+        for group_id, wine_order_list, dessert_wine_order_list in zip(group_ids, wine_order_lists, dessert_wine_order_lists)
+    }
+
     log_generation_step(group_wine_orders, "group_wine_orders")
     return group_wine_orders
 
-def generate_group_side_orders(customer_groups, all_customer_orders, full_menu_df):
+def generate_group_side_orders(customer_groups, all_customer_orders, menu_index, config):
     """
     For each group, generates side orders for each customer.
     Each customer gets one random item from category "Sides".
     If the customer's main item is in "Large Cuts" or "Steaks",
     they also get a random item from "Sauces" and some random chance for
-    an item from "extras".
+    an item from "extras". All draws come from menu_index.rng.
     
     Returns:
         dict: Mapping of group_id to a dictionary mapping customer index to their side orders,
-              where each side order is a dict with keys "side", "sauce", and "extras" (all are UUID's).
+              where each side order is a dict with keys "side", "sauce", and "extras" (all are item codes).
     """
-    # Load the configuration from the JSON file
-    with open(config_file, "r") as f:
-        config = json.load(f)
-    
-    # Get the side, sauce, and extras categories from the config file
-    side_categories = config["categories"]["sides"]
-    sauce_categories = config["categories"]["sauces"]
-    extras_categories = config["categories"]["extras"]
-    
     group_side_orders = {}
     for group_id, indices in customer_groups.items():
         side_orders = {}
@@ -302,31 +323,20 @@ def generate_group_side_orders(customer_groups, all_customer_orders, full_menu_d
             order = all_customer_orders[idx][1]
             
             # Random side from category "Sides"
-            side_candidates = full_menu_df[full_menu_df["category"].isin(side_categories)]
-            if not side_candidates.empty:
-                side_item = side_candidates.sample(n=1).iloc[0]["item_uuid"]
-            else:
-                side_item = None
+            side_item = menu_index.choice("sides")
 
             sauce_item = None
             extras_item = None
             
             # If main item is from "Large Cuts" or "Steaks", add sauce and possibly extras
             if order["main_id"] is not None:
-                main_cat_series = full_menu_df.loc[full_menu_df["item_uuid"] == order["main_id"], "category"]
-                if not main_cat_series.empty and main_cat_series.values[0] in ["Large Cuts", "Steaks"]:
+                if menu_index.category(order["main_id"]) in ["Large Cuts", "Steaks"]:
                     # Select a sauce
-                    sauce_candidates = full_menu_df[full_menu_df["category"].isin(sauce_categories)]
-                    if not sauce_candidates.empty:
-                        sauce_item = sauce_candidates.sample(n=1).iloc[0]["item_uuid"]
+                    sauce_item = menu_index.choice("sauces")
                     
                     # Chance for extras from config
-                    if random.random() < random.uniform(
-                                                    config["chance_of_ordering_an_extra"]["min_chance"], 
-                                                    config["chance_of_ordering_an_extra"]["max_chance"]):
-                        extras_candidates = full_menu_df[full_menu_df["category"].isin(extras_categories)]
-                        if not extras_candidates.empty:
-                            extras_item = extras_candidates.sample(n=1).iloc[0]["item_uuid"]
+                    if menu_index.rng.random() < menu_index.rng.uniform(*config.extra_chance_range):
+                        extras_item = menu_index.choice("extras")
             
             side_orders[idx] = {"side": side_item, "sauce": sauce_item, "extras": extras_item}
         group_side_orders[group_id] = side_orders
@@ -334,7 +344,94 @@ def generate_group_side_orders(customer_groups, all_customer_orders, full_menu_d
     log_generation_step(group_side_orders, "group_side_orders")
     return group_side_orders
 
-def generate_final_group_orders(full_menu_df, verboseMode=False):
+def generate_customer_orders_batched(intention_table, menu_index, config):
+    """
+    Batched version of generate_customer_order(...) and the per-customer part of generate_group_side_orders(...).
+
+    Takes the whole night's intention table (see generate_intention_table(...)) and selects the items for
+    every customer with one vectorized draw per category: drinks (with per-customer counts), optional
+    starter/main/dessert, a side, and the sauce/extras for customers whose main is a "Large Cuts" or "Steaks" item.
+
+    Parameters:
+        intention_table (np.ndarray): The structured intention table, one row per customer.
+        menu_index (MenuIndex): The precomputed index of the master menu.
+        config (SimConfig): The compiled simulation config.
+
+    Returns:
+        tuple: (all_customer_orders, customer_side_orders) where
+            - all_customer_orders is the list of (index, customer_order_dict) consumed by group_customer_orders(...)
+            - customer_side_orders is a list, by customer index, of {"side", "sauce", "extras"} dicts
+              to be grouped by generate_group_side_orders_batched(...)
+    """
+    customer_count = len(intention_table)
+    rng = menu_index.rng
+
+    # Drinks: a distinct set of items per customer, sized by the intention counts
+    alc_drinks = menu_index.sample_many("alc_drinks", intention_table["n_alc_drinks"])
+    non_alc_drinks = menu_index.sample_many("non_alc_drinks", intention_table["n_non_alc_drinks"])
+
+    # Courses: at most one item each, only for customers who want it
+    starter_ids, _ = _select_optional_items(menu_index, "starters", intention_table["b_starter"])
+    main_ids, main_positions = _select_optional_items(menu_index, "mains", intention_table["b_main"])
+    dessert_ids, _ = _select_optional_items(menu_index, "desserts", intention_table["b_dessert"])
+
+    # Sides: one per customer, plus a sauce and a chance of an extra with "Large Cuts" and "Steaks"
+    side_ids, _ = _select_optional_items(menu_index, "sides", np.ones(customer_count, dtype=bool))
+    main_categories = menu_index.item_categories["mains"][np.maximum(main_positions, 0)]
+    needs_sauce = (main_positions >= 0) & np.isin(main_categories, ["Large Cuts", "Steaks"])
+    sauce_ids, _ = _select_optional_items(menu_index, "sauces", needs_sauce)
+    wants_extra = needs_sauce & (rng.random(customer_count) < rng.uniform(*config.extra_chance_range, size=customer_count))
+    extras_ids, _ = _select_optional_items(menu_index, "extras", wants_extra)
+
+    all_customer_orders = []
+    for i, order in enumerate(zip(alc_drinks, intention_table["n_wine_servings"].tolist(),
+                                  intention_table["n_dessert_wine_servings"].tolist(), non_alc_drinks,
+                                  starter_ids, main_ids, dessert_ids)):
+        all_customer_orders.append((i, dict(zip(
+            ["alc_drinks", "n_wine_servings", "n_dessert_wine_servings", "non_alc_drinks",
+             "starter_id", "main_id", "dessert_id"], order))))
+
+    customer_side_orders = [
+        {"side": side_item, "sauce": sauce_item, "extras": extras_item}
+        for side_item, sauce_item, extras_item in zip(side_ids, sauce_ids, extras_ids)
+    ]
+
+    return all_customer_orders, customer_side_orders
+
+def _select_optional_items(menu_index, group, wanted):
+    """
+    Draws one item from a category group for every row where wanted is True.
+
+    Returns:
+        tuple: (list of item codes with None where nothing was drawn,
+                array of positions into the group's arrays with -1 where nothing was drawn)
+    """
+    wanted = np.asarray(wanted, dtype=bool)
+    positions = np.full(len(wanted), -1, dtype=np.int64)
+    if menu_index.size(group) > 0:
+        positions[wanted] = menu_index.draw_positions(group, int(wanted.sum()))
+
+    items = np.full(len(wanted), None, dtype=object)
+    drawn = positions >= 0
+    items[drawn] = menu_index.codes[group][positions[drawn]].tolist()
+    return items.tolist(), positions
+
+def generate_group_side_orders_batched(customer_groups, customer_side_orders):
+    """
+    Arranges the per-customer side orders drawn by generate_customer_orders_batched(...) by group.
+
+    Returns:
+        dict: Same structure as generate_group_side_orders(...).
+    """
+    group_side_orders = {}
+    for group_id, indices in customer_groups.items():
+        group_side_orders[group_id] = {idx: customer_side_orders[idx] for idx in indices}
+
+    log_generation_step(group_side_orders, "group_side_orders")
+    return group_side_orders
+
+def generate_final_group_orders(menu_index, config, verboseMode=False, batched=False, columnar=False,
+                                service_date=None, rngs=None, customer_count=None):
     """
     Processes all orders, groups them, and builds a nested dictionary of group orders.
     Then, it prints a human-readable summary to "group_orders.txt" and returns the nested dictionary.
@@ -343,40 +440,86 @@ def generate_final_group_orders(full_menu_df, verboseMode=False):
     
       {
          "group_1": {
-              "starters": [uuid, uuid, ...],
-              "mains": [uuid, uuid, ...],
-              "desserts": [uuid, ...],
-              "alc_drinks": [uuid, uuid, ...],
-              "non_alc_drinks": [uuid, ...],
-              "sides": [uuid, uuid, ...],
-              "wines": [uuid, ...],
-              "dessert_wines": [uuid, ...]
+              "starters": [code, code, ...],
+              "mains": [code, code, ...],
+              "desserts": [code, ...],
+              "alc_drinks": [code, code, ...],
+              "non_alc_drinks": [code, ...],
+              "sides": [code, code, ...],
+              "wines": [code, ...],
+              "dessert_wines": [code, ...]
          },
          "group_2": { ... },
          ...
       }
 
+    Items are int item codes (see MenuIndex), turned back into item UUIDs by run_sim.prepare_order_data(...).
+
+    With batched=True the order intentions are drawn all at once with generate_intention_table(...), and
+    items and sides are selected for all customers at once with generate_customer_orders_batched(...).
+    With columnar=True the orders are written straight into a ColumnarOrders instead of the nested dictionary.
+    service_date is the night being simulated (its day of the week sets the number of customers), defaults to today.
+
+    rngs maps each stage (see seeding.STAGES) to its random generator, e.g. seeding.night_rngs(seed, service_date)
+    for a reproducible night. If None, every stage draws from menu_index.rng.
+    customer_count overrides the number of customers drawn from the config (e.g. for benchmarks).
     """
     global verbose
     if verboseMode: 
         verbose = True
     
     
-    all_order_intentions = generate_list_of_intentions()
-
-    # Generate individual customer orders and add them to a list
-    all_customer_orders = []
-    for i, order_intention_dict in enumerate(all_order_intentions):
-        customer_order = generate_customer_order(order_intention_dict, full_menu_df)
-        all_customer_orders.append((i, customer_order))           
+    if rngs is None:
+        rngs = shared_rngs(menu_index.rng)
+    
+    # Each step is measured as a stage when metrics are enabled, see metrics.py
+    if batched:
+        with metrics.stage("intentions") as stage:
+            intention_table = generate_intention_table(config, customer_count, rngs["intentions"], service_date)
+            stage.add_items(len(intention_table))
+        with metrics.stage("customer_orders") as stage:
+            all_customer_orders, customer_side_orders = generate_customer_orders_batched(
+                intention_table, menu_index.with_rng(rngs["items"]), config)
+            stage.add_items(len(all_customer_orders))
+    else:
+        with metrics.stage("intentions") as stage:
+            all_order_intentions = generate_list_of_intentions(config, service_date, rngs["intentions"], customer_count)
+            stage.add_items(len(all_order_intentions))
+
+        # Generate individual customer orders and add them to a list
+        with metrics.stage("customer_orders") as stage:
+            item_index = menu_index.with_rng(rngs["items"])
+            all_customer_orders = []
+            for i, order_intention_dict in enumerate(all_order_intentions):
+                customer_order = generate_customer_order(order_intention_dict, item_index)
+                all_customer_orders.append((i, customer_order))
+            stage.add_items(len(all_customer_orders))
 
     # Group customers into parties based on a few critera, see group_customer_orders(...)
-    customer_groups = group_customer_orders(all_customer_orders, full_menu_df)
+    with metrics.stage("grouping") as stage:
+        customer_groups = group_customer_orders(all_customer_orders, menu_index, rngs["groups"])
+        stage.add_items(len(customer_groups))
     
     # Generate group wine orders and side orders 
-    group_wine_orders = generate_group_wine_orders(customer_groups, all_customer_orders, full_menu_df)
-    group_side_orders = generate_group_side_orders(customer_groups, all_customer_orders, full_menu_df)
+    with metrics.stage("wine") as stage:
+        group_wine_orders = generate_group_wine_orders(customer_groups, all_customer_orders,
+                                                       menu_index.with_rng(rngs["wines"]), config)
+        stage.add_items(len(group_wine_orders))
+    with metrics.stage("sides") as stage:
+        if batched:
+            group_side_orders = generate_group_side_orders_batched(customer_groups, customer_side_orders)
+        else:
+            group_side_orders = generate_group_side_orders(customer_groups, all_customer_orders,
+                                                           menu_index.with_rng(rngs["sides"]), config)
+        stage.add_items(len(group_side_orders))
     
+    if columnar:
+        columnar_group_orders = build_columnar_group_orders(customer_groups, all_customer_orders,
+                                                            group_wine_orders, group_side_orders)
+        if verbose:
+            log_generation_step(columnar_group_orders.to_group_orders(), "final_group_orders")
+        return columnar_group_orders
+
     # Build nested dictionary structure: keys are "group_X"
     final_group_orders = {}
     for group_id, customers in customer_groups.items():
@@ -412,14 +555,14 @@ def generate_final_group_orders(full_menu_df, verboseMode=False):
         # Sides: aggregate each customer's side, sauce, extras from group_side_orders
         for customer in customers:
             side_order = group_side_orders.get(group_id, {}).get(customer, {})
-            if side_order.get("side"):
+            if side_order.get("side") is not None:
                 final_group_orders[group_key]["sides"].append(side_order.get("side"))
-            if side_order.get("sauce"):
+            if side_order.get("sauce") is not None:
                 final_group_orders[group_key]["sides"].append(side_order.get("sauce"))
-            if side_order.get("extras"):
+            if side_order.get("extras") is not None:
                 final_group_orders[group_key]["sides"].append(side_order.get("extras"))
 
-        # Wines: use the wine orders from group_wine_orders; we want the UUID (first element of the tuple)
+        # Wines: use the wine orders from group_wine_orders
         wines = group_wine_orders.get(group_id, {}).get("wine_orders", [])
         dessert_wines = group_wine_orders.get(group_id, {}).get("dessert_wine_orders", [])
         
@@ -429,6 +572,100 @@ def generate_final_group_orders(full_menu_df, verboseMode=False):
     log_generation_step(final_group_orders, "final_group_orders")
     return final_group_orders
 
+def generate_group_order_batches(menu_index, config, batch_size=STREAM_BATCH_SIZE, service_date=None, rngs=None,
+                                 customer_count=None):
+    """
+    Streaming version of generate_final_group_orders(..., batched=True, columnar=True): the night's customers
+    are generated batch_size at a time, and each batch is grouped and given its wines and sides on its own
+    before it is yielded, so only one batch of customers is held in memory at a time.
+
+    Customers are only grouped with others of the same batch (e.g. for "Large Cuts" sharing parties), so a batch
+    of a few thousand customers keeps the parties close to those of the whole-night engines. Group numbers carry
+    on from one batch to the next, so every group key is unique over the night.
+
+    Parameters:
+        menu_index (MenuIndex): The precomputed index of the master menu.
+        config (SimConfig): The compiled simulation config.
+        batch_size (int): Number of customers per batch.
+        service_date (datetime.date): The night being simulated (sets the number of customers), defaults to today.
+        rngs (dict): Stage -> random generator mapping, see generate_final_group_orders(...).
+        customer_count (int): Overrides the number of customers drawn from the config.
+
+    Yields:
+        ColumnarOrders: The group orders of each batch, not yet allocated.
+    """
+    if rngs is None:
+        rngs = shared_rngs(menu_index.rng)
+    if customer_count is None:
+        customer_count = draw_customer_count(config, service_date, rngs["intentions"])
+    item_index = menu_index.with_rng(rngs["items"])
+    wine_index = menu_index.with_rng(rngs["wines"])
+
+    next_group_id = 1
+    for batch_start in range(0, customer_count, batch_size):
+        # The same stages as generate_final_group_orders(...), each measured once per batch
+        with metrics.stage("intentions") as stage:
+            intention_table = generate_intention_table(config, min(batch_size, customer_count - batch_start),
+                                                       rngs["intentions"])
+            stage.add_items(len(intention_table))
+        with metrics.stage("customer_orders") as stage:
+            all_customer_orders, customer_side_orders = generate_customer_orders_batched(intention_table, item_index, config)
+            stage.add_items(len(all_customer_orders))
+        with metrics.stage("grouping") as stage:
+            customer_groups = group_customer_orders(all_customer_orders, menu_index, rngs["groups"], next_group_id)
+            next_group_id += len(customer_groups)
+            stage.add_items(len(customer_groups))
+        with metrics.stage("wine") as stage:
+            group_wine_orders = generate_group_wine_orders(customer_groups, all_customer_orders, wine_index, config)
+            stage.add_items(len(group_wine_orders))
+        with metrics.stage("sides") as stage:
+            group_side_orders = generate_group_side_orders_batched(customer_groups, customer_side_orders)
+            stage.add_items(len(group_side_orders))
+
+        yield build_columnar_group_orders(customer_groups, all_customer_orders, group_wine_orders, group_side_orders)
+
+def build_columnar_group_orders(customer_groups, all_customer_orders, group_wine_orders, group_side_orders):
+    """
+    Builds the final group orders as a ColumnarOrders, with the same content as the nested dictionary
+    assembled at the end of generate_final_group_orders(...) but without the per-group lists.
+
+    Returns:
+        ColumnarOrders: One row per order line (including None course placeholders).
+    """
+    category_codes = {category: c for c, category in enumerate(CATEGORIES)}
+    group_keys, group_ids, categories, item_codes = [], [], [], []
+
+    def add_items(group, category, items):
+        group_ids.extend([group] * len(items))
+        categories.extend([category_codes[category]] * len(items))
+        item_codes.extend(NO_ITEM if item is None else item for item in items)
+
+    for group, (group_id, customers) in enumerate(customer_groups.items()):
+        group_keys.append(f"group_{group_id}")
+        customer_orders = [all_customer_orders[customer][1] for customer in customers]
+
+        # One starter, main and dessert entry per customer (None if they didn't order one) and all their drinks
+        add_items(group, "starters", [order["starter_id"] for order in customer_orders])
+        add_items(group, "mains", [order["main_id"] for order in customer_orders])
+        add_items(group, "desserts", [order["dessert_id"] for order in customer_orders])
+        add_items(group, "alc_drinks", [drink for order in customer_orders for drink in order["alc_drinks"]])
+        add_items(group, "non_alc_drinks", [drink for order in customer_orders for drink in order["non_alc_drinks"]])
+
+        # Sides: each customer's side, sauce and extras, when they have one
+        side_orders = group_side_orders.get(group_id, {})
+        add_items(group, "sides", [
+            item
+            for customer in customers
+            for item in (side_orders.get(customer, {}).get(key) for key in ("side", "sauce", "extras"))
+            if item is not None
+        ])
+
+        wine_orders = group_wine_orders.get(group_id, {})
+        add_items(group, "wines", wine_orders.get("wine_orders", []))
+        add_items(group, "dessert_wines", wine_orders.get("dessert_wine_orders", []))
+
+    return ColumnarOrders(group_keys, group_ids, categories, item_codes)
+
 def log_generation_step(data, filename_prefix="output"):
     """Deletes the content of the file if it exists, and writes the new data to the 'data/raw/sim_logs' directory only if verbose is True."""
     global verbose, file_counter
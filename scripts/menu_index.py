@@ -0,0 +1,252 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+class MenuIndex:
+    """
+    A precomputed index over the master menu dataframe.
+
+    The index is built once from the concatenated menu tables. Every menu item is interned into a dense
+    int32 item code (its row in the menu-wide arrays below), and every config category group
+    (e.g. "alc_drinks", "starters", "mains", "wine", "sides", ...) is mapped to NumPy arrays of the codes
+    and serving sizes of its items. Selecting an item is then a random position into an array instead of
+    filtering and sampling the whole dataframe.
+
+    Every draw returns item codes, which is what the order structures hold through the whole pipeline.
+    They are turned back into item UUID strings only when the order rows are written out (see decode(...)
+    and run_sim.prepare_order_data(...)).
+
+    Attributes:
+        menu_df (pd.DataFrame): The master dataframe the index was built from.
+        rng (np.random.Generator): Random generator used for all draws.
+        codes (dict): Category group -> int32 array of the item codes of the group.
+        item_uuids (dict): Category group -> array of item UUIDs.
+        serving_sizes (dict): Category group -> array of serving sizes in ml (0 where not set).
+        item_categories (dict): Category group -> array of each item's menu category.
+        item_codes (dict): Item UUID -> item code.
+        menu_item_uuids (np.ndarray): Item UUID of every item code.
+        menu_categories (np.ndarray): Menu category of every item code.
+        menu_prices (np.ndarray): Price of every item code (NaN where not set).
+        menu_serving_sizes (np.ndarray): Serving size in ml of every item code (0 where not set).
+    """
+
+    def __init__(self, full_menu_df, category_groups, rng=None):
+        """
+        Parameters:
+            full_menu_df (pd.DataFrame): The master dataframe containing menu items.
+            category_groups (dict): Mapping of category group -> list of menu categories,
+                                    as found under "categories" in the config file.
+            rng (np.random.Generator): Optional random generator, a fresh one is created if None.
+        """
+        self.menu_df = full_menu_df
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        # Menu-wide attribute arrays and a hash map from item UUID to its code (its row), so looking up an item's
+        # category, price or serving size is an array index instead of a dataframe scan.
+        # If a UUID appears on several menus, its first row is used (like filtering the dataframe and taking .values[0]).
+        self.menu_item_uuids = full_menu_df["item_uuid"].to_numpy(dtype=object)
+        self.menu_categories = full_menu_df["category"].to_numpy(dtype=object)
+        if "price" in full_menu_df.columns:
+            # Text prices (e.g. "Market price" on an un-normalised menu) become NaN
+            self.menu_prices = pd.to_numeric(full_menu_df["price"], errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            self.menu_prices = np.full(len(full_menu_df), np.nan)
+        if "serving_size" in full_menu_df.columns:
+            self.menu_serving_sizes = (pd.to_numeric(full_menu_df["serving_size"], errors="coerce")
+                                       .fillna(0).to_numpy(dtype=np.int64))
+        else:
+            self.menu_serving_sizes = np.zeros(len(full_menu_df), dtype=np.int64)
+        self.item_codes = {}
+        for code, item_uuid in enumerate(self.menu_item_uuids.tolist()):
+            self.item_codes.setdefault(item_uuid, code)
+
+        self.codes = {}
+        self.item_uuids = {}
+        self.serving_sizes = {}
+        self.item_categories = {}
+
+        for group, categories in category_groups.items():
+            options = full_menu_df[full_menu_df["category"].isin(categories)]
+            self.codes[group] = np.array([self.item_codes[item_uuid] for item_uuid in options["item_uuid"]], dtype=np.int32)
+            self.item_uuids[group] = self.menu_item_uuids[self.codes[group]]
+            self.item_categories[group] = self.menu_categories[self.codes[group]]
+            self.serving_sizes[group] = self.menu_serving_sizes[self.codes[group]]
+
+    def with_rng(self, rng):
+        """
+        Returns a copy of the index that draws from another random generator, sharing the same arrays.
+        Used to give each stage of the simulation its own random stream (see seeding.py).
+        """
+        index = copy.copy(self)
+        index.rng = rng
+        return index
+
+    def code(self, item_uuid):
+        """Returns the item code of an item UUID, or None if it isn't on the menu."""
+        return self.item_codes.get(item_uuid)
+
+    def decode(self, codes):
+        """Returns the item UUID of an item code, or an array of item UUIDs for an array of codes."""
+        return self.menu_item_uuids[codes]
+
+    def category(self, code):
+        """Returns the menu category of an item code."""
+        return self.menu_categories[code]
+
+    def price(self, code):
+        """Returns the price of an item code (NaN if it has none)."""
+        return float(self.menu_prices[code])
+
+    def serving_size(self, code):
+        """Returns the serving size in ml of an item code (0 if it has none)."""
+        return int(self.menu_serving_sizes[code])
+
+    def size(self, group):
+        """Returns the number of menu items in a category group."""
+        return len(self.codes[group])
+
+    def choice(self, group):
+        """
+        Draws one random item from a category group.
+
+        Returns:
+            int: The item code, or None if the category group has no items.
+        """
+        options = self.codes[group]
+        if len(options) == 0:
+            return None
+        return int(options[self.rng.integers(len(options))])
+
+    def sample(self, group, n):
+        """
+        Draws up to n distinct random items from a category group.
+
+        Returns:
+            list: min(n, size of the group) item codes.
+        """
+        options = self.codes[group]
+        n = min(n, len(options))
+        if n <= 0:
+            return []
+        return options[self.rng.choice(len(options), size=n, replace=False)].tolist()
+
+    def choice_with_serving_size(self, group):
+        """
+        Draws one random item from a category group together with its serving size.
+
+        Returns:
+            tuple: (item code, serving_size), or None if the category group has no items.
+        """
+        options = self.codes[group]
+        if len(options) == 0:
+            return None
+        position = self.rng.integers(len(options))
+        return int(options[position]), int(self.serving_sizes[group][position])
+
+    def draw_positions(self, group, n):
+        """
+        Draws n random positions (with replacement) into a category group's arrays.
+
+        Returns:
+            np.ndarray: n integer positions, usable with codes[group], item_categories[group], etc.
+        """
+        return self.rng.integers(self.size(group), size=n)
+
+    def sample_many(self, group, counts):
+        """
+        Batched version of sample(...): for every entry in counts, draws that many distinct items.
+
+        Each row takes the first counts[i] positions of its own random permutation of the group,
+        so items within a row are drawn without replacement, like sample(...).
+
+        Parameters:
+            group (str): The category group to draw from.
+            counts (array-like): Number of items wanted for each row.
+
+        Returns:
+            list: One list of item codes per row, each capped at the size of the group.
+        """
+        options = self.codes[group]
+        counts = np.minimum(np.asarray(counts, dtype=np.int64), len(options))
+        samples = [[] for _ in range(len(counts))]
+
+        rows = np.flatnonzero(counts > 0)
+        if len(rows) == 0:
+            return samples
+        row_counts = counts[rows]
+        max_count = int(row_counts.max())
+
+        # A random permutation prefix per row, keeping only the first row_counts[i] columns
+        permutations = np.argsort(self.rng.random((len(rows), len(options))), axis=1)[:, :max_count]
+        picked = options[permutations[np.arange(max_count) < row_counts[:, None]]].tolist()
+
+        ends = np.cumsum(row_counts).tolist()
+        start = 0
+        for row, end in zip(rows.tolist(), ends):
+            samples[row] = picked[start:end]
+            start = end
+        return samples
+
+    def draw_until_volume(self, group, required_ml):
+        """
+        Batched volume-based selection: for every entry in required_ml, draws random items (with replacement)
+        from a category group until their serving sizes add up to at least that many ml.
+
+        Instead of drawing one item at a time, every row gets a block of random positions at once, the
+        running total of their serving sizes is taken with np.cumsum and the row keeps its draws up to (and
+        including) the first one where the total covers its requirement. Rows whose block falls short get
+        another block, which is rare as the blocks are sized from the largest requirements.
+
+        Parameters:
+            group (str): The category group to draw from (e.g. "wine" or "dessert_wine").
+            required_ml (array-like): Volume wanted for each row, rows with 0 or less get no items.
+
+        Returns:
+            list: One list of item codes per row.
+        """
+        required_ml = np.asarray(required_ml, dtype=np.int64)
+        selections = [[] for _ in range(len(required_ml))]
+
+        rows = np.flatnonzero(required_ml > 0)
+        if len(rows) == 0:
+            return selections
+        if self.size(group) == 0:
+            raise ValueError(f"No items found in category group '{group}'.")
+        serving_sizes = self.serving_sizes[group]
+        if serving_sizes.max() <= 0:
+            raise ValueError(f"No item of category group '{group}' has a serving size.")
+
+        # Enough draws per row to cover nearly every requirement at the average serving size, with some headroom.
+        # Sized on a high percentile rather than the maximum, so one very large requirement doesn't widen every row's block.
+        remaining = required_ml[rows]
+        block_width = int(np.percentile(remaining, 99) / serving_sizes.mean() * 1.5) + 2
+
+        blocks = []
+        pending = np.arange(len(rows))  # rows (positions into rows) still short of their requirement
+        while len(pending):
+            positions = self.rng.integers(self.size(group), size=(len(pending), block_width))
+            volume = np.cumsum(serving_sizes[positions], axis=1)
+
+            # Number of draws each row keeps from this block: those before the total covers the requirement, plus that one
+            covered = volume >= remaining[pending, None]
+            done = covered[:, -1]
+            taken = np.where(done, covered.argmax(axis=1) + 1, block_width)
+            blocks.append((pending, positions, taken))
+
+            remaining[pending] -= volume[:, -1]
+            pending = pending[~done]
+
+        # Gather each row's draws in order, block after block
+        picked = [[] for _ in range(len(rows))]
+        for pending, positions, taken in blocks:
+            kept = self.codes[group][positions[np.arange(block_width) < taken[:, None]]].tolist()
+            start = 0
+            for row, count in zip(pending.tolist(), taken.tolist()):
+                picked[row].extend(kept[start:start + count])
+                start += count
+
+        for row, items in zip(rows.tolist(), picked):
+            selections[row] = items
+        return selections
@@ -0,0 +1,317 @@
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+menus_directory = os.path.abspath(os.path.join(script_dir, "..", "data", "raw", "menus"))
+snapshot_directory = os.path.abspath(os.path.join(script_dir, "..", "data", "cache", "menu_snapshot"))
+bigquery_cache_directory = os.path.abspath(os.path.join(script_dir, "..", "data", "cache", "bigquery_menu"))
+
+BIGQUERY_DATASET = "restaurant_data"
+
+# The four menu tables, in the order they are concatenated into the master menu
+MENU_TABLES = ["a_la_carte_menu", "dessert_menu", "cocktails_and_beer_menu", "wine_menu"]
+
+# Columns every menu source is normalised to, and the dtype each is stored as in the snapshot
+MENU_COLUMNS = {
+    "item_uuid": "U",
+    "item_name": "U",
+    "category": "U",
+    "price": np.float64,                # NaN where the menu has no numeric price (e.g. "Market price")
+    "serving_size": np.int64,           # ml, only set for wine; 0 elsewhere
+    "is_priced_per_weight": np.bool_,   # only set on the a la carte menu; False elsewhere
+}
+
+
+def normalize_menu(menu_df):
+    """
+    Normalises one menu table to the shared MENU_COLUMNS schema.
+
+    The raw tables don't share a schema: only the wine menu has serving_size, only the a la carte menu
+    has is_priced_per_weight (as "t"/"f") and some prices are text. Missing columns are filled in and
+    the rest are coerced to a single dtype each.
+
+    Parameters:
+        menu_df (pd.DataFrame): One menu table, from a CSV file or BigQuery.
+
+    Returns:
+        pd.DataFrame: The table with exactly the MENU_COLUMNS columns.
+    """
+    normalized = pd.DataFrame({
+        "item_uuid": menu_df["item_uuid"].astype(str),
+        "item_name": menu_df["item_name"].astype(str),
+        "category": menu_df["category"].astype(str),
+    })
+    if "price" in menu_df.columns:
+        normalized["price"] = pd.to_numeric(menu_df["price"], errors="coerce").astype(np.float64)
+    else:
+        normalized["price"] = np.full(len(menu_df), np.nan)
+    if "serving_size" in menu_df.columns:
+        normalized["serving_size"] = pd.to_numeric(menu_df["serving_size"], errors="coerce").fillna(0).astype(np.int64)
+    else:
+        normalized["serving_size"] = np.zeros(len(menu_df), dtype=np.int64)
+    if "is_priced_per_weight" in menu_df.columns:
+        normalized["is_priced_per_weight"] = menu_df["is_priced_per_weight"].isin([True, "t", "true", "True"])
+    else:
+        normalized["is_priced_per_weight"] = np.zeros(len(menu_df), dtype=bool)
+    return normalized
+
+
+def read_menu_csvs(menus_dir=menus_directory):
+    """
+    Reads the checked-in menu CSV files and concatenates them into one normalised master menu.
+
+    Returns:
+        pd.DataFrame: The master menu, with the MENU_COLUMNS columns.
+    """
+    menu_tables = [normalize_menu(pd.read_csv(menu_csv_path(table, menus_dir))) for table in MENU_TABLES]
+    return pd.concat(menu_tables, ignore_index=True)
+
+
+def menu_csv_path(table, menus_dir=menus_directory):
+    """Returns the path of a menu table's CSV file."""
+    return os.path.join(menus_dir, f"{table}.csv")
+
+
+def menu_csv_fingerprints(menus_dir=menus_directory):
+    """
+    Returns a content hash of each menu CSV file, used to tell whether a snapshot is stale.
+    (Content rather than mtime, so a fresh git checkout doesn't invalidate the cache.)
+    """
+    fingerprints = {}
+    for table in MENU_TABLES:
+        with open(menu_csv_path(table, menus_dir), "rb") as f:
+            fingerprints[table] = hashlib.sha256(f.read()).hexdigest()
+    return fingerprints
+
+
+def compile_menu_snapshot(menu_df, fingerprints, snapshot_dir=snapshot_directory):
+    """
+    Writes a normalised master menu to a binary snapshot: one .npy file per column (strings as fixed-width
+    unicode, so no column needs pickling) plus a manifest.json holding the source fingerprints.
+
+    The snapshot is written to a temporary directory and moved into place, so readers never see a partial one.
+    """
+    parent_dir = os.path.dirname(snapshot_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=parent_dir)
+
+    for column, dtype in MENU_COLUMNS.items():
+        np.save(os.path.join(staging_dir, f"{column}.npy"), menu_df[column].to_numpy().astype(dtype))
+    with open(os.path.join(staging_dir, "manifest.json"), "w") as f:
+        json.dump({"sources": fingerprints, "rows": len(menu_df), "columns": list(MENU_COLUMNS)}, f, indent=4)
+
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(staging_dir, snapshot_dir)
+
+
+def load_menu_snapshot(fingerprints, snapshot_dir=snapshot_directory):
+    """
+    Loads a compiled menu snapshot.
+
+    The columns are read whole rather than memory-mapped: pandas copies fixed-width unicode arrays into object
+    columns anyway, and the menu is a few hundred rows. What the snapshot saves is parsing and normalising the CSVs.
+
+    Parameters:
+        fingerprints (dict): The current source fingerprints, see menu_csv_fingerprints(...).
+
+    Returns:
+        pd.DataFrame: The master menu, or None if there is no snapshot or it was built from different sources.
+    """
+    manifest_path = os.path.join(snapshot_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest["sources"] != fingerprints or manifest["columns"] != list(MENU_COLUMNS):
+        return None
+
+    return pd.DataFrame({
+        column: np.load(os.path.join(snapshot_dir, f"{column}.npy"))
+        for column in MENU_COLUMNS
+    })
+
+
+def load_offline_menu(menus_dir=menus_directory, snapshot_dir=snapshot_directory):
+    """
+    Loads the master menu from the checked-in CSV files without any network access.
+
+    The first run (or the first run after any CSV changes) parses and normalises the CSVs and compiles
+    them into a snapshot; later runs just load the snapshot.
+
+    Returns:
+        pd.DataFrame: The master menu, with the MENU_COLUMNS columns.
+    """
+    fingerprints = menu_csv_fingerprints(menus_dir)
+    menu_df = load_menu_snapshot(fingerprints, snapshot_dir)
+    if menu_df is None:
+        menu_df = read_menu_csvs(menus_dir)
+        compile_menu_snapshot(menu_df, fingerprints, snapshot_dir)
+    return menu_df
+
+
+def fetch_bigquery_menu(client=None, cache_dir=bigquery_cache_directory, ttl=datetime.timedelta(hours=12)):
+    """
+    Fetches the four menu tables from BigQuery and concatenates them into the master menu dataframe,
+    going through a local cache.
+
+    - If the cached menu is younger than ttl, it is returned without contacting BigQuery.
+    - If it is older, a cheap freshness check compares each table's last-modified time (table metadata
+      only, no query) with the one recorded in the cache. If no table changed, the cache is kept and its
+      age is reset.
+    - Otherwise the four tables are queried concurrently and the cache is rewritten.
+    - If BigQuery can't be reached (the client, the freshness check or a query raises), the cached menu is
+      returned even though it is stale; without a cache the error is raised.
+
+    Parameters:
+        client: A bigquery.Client, or anything with the same query(...)/get_table(...) interface
+                (e.g. LocalMenuClient). A bigquery.Client() is created if None.
+        cache_dir (str): Directory holding the cached menu, None to always query.
+        ttl (datetime.timedelta): How long a cached menu is used without a freshness check.
+
+    Returns:
+        pd.DataFrame: The master menu, the four tables normalised (see normalize_menu(...)) and
+                      concatenated in MENU_TABLES order, like read_menu_csvs(...).
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cached = _read_menu_cache(cache_dir) if cache_dir else None
+    if cached is not None:
+        cached_df, metadata = cached
+        cached_df = normalize_menu(cached_df)  # a no-op unless the cache was written before tables were normalised
+        if now - datetime.datetime.fromisoformat(metadata["fetched_at"]) < ttl:
+            return cached_df
+
+    try:
+        if client is None:
+            from google.cloud import bigquery
+            client = bigquery.Client()
+
+        if cached is not None and _tables_modified(client) == metadata["tables_modified"]:
+            metadata["fetched_at"] = now.isoformat()
+            _write_menu_cache_metadata(cache_dir, metadata)
+            return cached_df
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(MENU_TABLES)) as executor:
+            menu_futures = [
+                executor.submit(lambda table: client.query(f"SELECT * FROM `{BIGQUERY_DATASET}.{table}`").to_dataframe(), table)
+                for table in MENU_TABLES
+            ]
+            tables_modified_future = executor.submit(_tables_modified, client)
+            menu_df = pd.concat([normalize_menu(pd.DataFrame(future.result())) for future in menu_futures],
+                                ignore_index=True)
+            tables_modified = tables_modified_future.result()
+    except Exception as e:
+        print(f"Error occurred while fetching data from BigQuery: {e}")
+        if cached is None:
+            raise
+        # Keep the cache's fetched_at, so the next run tries BigQuery again
+        print(f"Using the cached menu fetched at {metadata['fetched_at']}")
+        return cached_df
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        menu_df.to_pickle(os.path.join(cache_dir, "menu.pkl"))
+        _write_menu_cache_metadata(cache_dir, {"fetched_at": now.isoformat(), "tables_modified": tables_modified})
+    return menu_df
+
+
+def _tables_modified(client):
+    """Returns the last-modified time (ISO string) of each menu table, read concurrently from the table metadata."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(MENU_TABLES)) as executor:
+        tables = executor.map(lambda table: client.get_table(f"{BIGQUERY_DATASET}.{table}"), MENU_TABLES)
+        return {table: t.modified.isoformat() if t.modified else None for table, t in zip(MENU_TABLES, tables)}
+
+
+def _read_menu_cache(cache_dir):
+    """Returns (cached menu dataframe, cache metadata), or None if there is no complete cache."""
+    metadata_path = os.path.join(cache_dir, "metadata.json")
+    menu_path = os.path.join(cache_dir, "menu.pkl")
+    if not (os.path.exists(metadata_path) and os.path.exists(menu_path)):
+        return None
+    with open(metadata_path, "r") as f:
+        metadata = json.load(f)
+    return pd.read_pickle(menu_path), metadata
+
+
+def _write_menu_cache_metadata(cache_dir, metadata):
+    with open(os.path.join(cache_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+class LocalMenuClient:
+    """
+    A local stand-in for bigquery.Client that serves the menu tables from the CSV files in data/raw/menus.
+
+    It implements the two calls fetch_bigquery_menu(...) makes, query(sql).to_dataframe() and
+    get_table(table_id).modified, so the BigQuery path (concurrency, caching, freshness checks) can be
+    exercised without a network or credentials. Each call is counted in query_count/get_table_count.
+    """
+
+    def __init__(self, menus_dir=menus_directory):
+        self.menus_dir = menus_dir
+        self.query_count = 0
+        self.get_table_count = 0
+
+    def query(self, sql):
+        self.query_count += 1
+        table = re.search(r"`[\w-]+\.(\w+)`", sql).group(1)
+        return _LocalQueryJob(menu_csv_path(table, self.menus_dir))
+
+    def get_table(self, table_id):
+        self.get_table_count += 1
+        path = menu_csv_path(table_id.split(".")[-1], self.menus_dir)
+        modified = datetime.datetime.fromtimestamp(os.path.getmtime(path), tz=datetime.timezone.utc)
+        return _LocalTable(table_id, modified)
+
+
+class _LocalQueryJob:
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+
+    def to_dataframe(self):
+        return pd.read_csv(self.csv_path)
+
+
+class _LocalTable:
+    def __init__(self, table_id, modified):
+        self.table_id = table_id
+        self.modified = modified
+
+
+def check_menu_sources(menus_dir=menus_directory):
+    """
+    Checks that the BigQuery path gives the same master menu as the offline CSV path, and that a MenuIndex
+    can be built from it. The BigQuery tables are served from the CSV files by a LocalMenuClient (no cache),
+    so this runs without credentials.
+
+    Raises:
+        ValueError: If the two menus differ in columns, dtypes or values.
+    """
+    from menu_index import MenuIndex
+    from sim_config import load_sim_config
+
+    categories = load_sim_config().categories
+    offline_df = read_menu_csvs(menus_dir)
+    bigquery_df = fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=None)
+    if not bigquery_df.dtypes.equals(offline_df.dtypes):
+        raise ValueError(f"BigQuery menu dtypes {dict(bigquery_df.dtypes)} differ from "
+                         f"the CSV menu's {dict(offline_df.dtypes)}")
+    if not bigquery_df.equals(offline_df):
+        raise ValueError("The BigQuery menu differs from the CSV menu")
+
+    menu_index = MenuIndex(bigquery_df, categories)
+    print(f"Menu sources match: {len(bigquery_df)} items, {np.isnan(menu_index.menu_prices).sum()} without "
+          f"a numeric price, {len(menu_index.codes)} category groups indexed")
+
+
+if __name__ == "__main__":
+    check_menu_sources()
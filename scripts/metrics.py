@@ -0,0 +1,288 @@
+import argparse
+import cProfile
+import datetime
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+
+# The collector of the current process, None while metrics are disabled. Every hook below checks it first,
+# so a disabled layer costs one global lookup per stage.
+_collector = None
+
+
+class _NullStage:
+    """Stands in for a StageRecord while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_items(self, count):
+        pass
+
+
+class _Span:
+    """A timed region with no record of its own (one next() of timed_iter(...)), so nested stages can exclude it."""
+
+    def __init__(self):
+        self.excluded = 0.0
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageRecord:
+    """
+    Times one call of a stage (and optionally profiles it / traces its allocations), then adds it to the
+    collector's totals for that stage. Use add_items(...) inside the block to record how much work was done.
+
+    The time of stages nested inside it (e.g. row_prep pulled by the sink) is excluded, so no second is
+    counted under two stages and the stage totals never add up to more than the wall time.
+    """
+
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+        self.items = 0
+        self.excluded = 0.0
+
+    def add_items(self, count):
+        self.items += count
+
+    def __enter__(self):
+        collector = self.collector
+        self.profiler = None
+        if collector.profile and not collector._profiling:
+            # Only the outermost profiled stage runs a profiler, cProfile can't nest
+            self.profiler = collector._profilers.setdefault(self.name, cProfile.Profile())
+            collector._profiling = True
+            self.profiler.enable()
+        if collector.trace_memory:
+            tracemalloc.reset_peak()
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+            self.snapshot_before = tracemalloc.take_snapshot()
+        collector._active.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        collector = self.collector
+        collector._exit_span(elapsed)
+        seconds = elapsed - self.excluded
+        if self.profiler is not None:
+            self.profiler.disable()
+            collector._profiling = False
+
+        totals = collector.stages.setdefault(self.name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "items": 0})
+        totals["calls"] += 1
+        totals["seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], seconds)
+        totals["items"] += self.items
+
+        if collector.trace_memory:
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            totals["alloc_peak_mb"] = max(totals.get("alloc_peak_mb", 0.0), (memory_peak - self.memory_before) / 2**20)
+            totals["alloc_net_mb"] = totals.get("alloc_net_mb", 0.0) + (memory_after - self.memory_before) / 2**20
+            growth = _without_tracemalloc(tracemalloc.take_snapshot()).compare_to(
+                _without_tracemalloc(self.snapshot_before), "lineno")[:5]
+            totals["top_allocations"] = [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} "
+                                         f"{stat.size_diff / 1024:+.1f} KiB" for stat in growth]
+        return False
+
+
+def _without_tracemalloc(snapshot):
+    """Drops the allocations made by tracemalloc itself from a snapshot."""
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+class MetricsCollector:
+    """
+    Accumulates per-stage metrics for one process: number of calls, total and longest duration,
+    item counts and, if asked for, a cProfile profile and tracemalloc allocation figures per stage.
+    """
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._profilers = {}
+        self._profiling = False
+        self._active = []  # the stages (and timed_iter spans) currently running, innermost last
+
+    def _exit_span(self, elapsed):
+        """Pops the innermost running stage and excludes its elapsed time from the stage it ran in."""
+        self._active.pop()
+        if self._active:
+            self._active[-1].excluded += elapsed
+
+    def stage(self, name):
+        return StageRecord(self, name)
+
+    def merge(self, stages):
+        """Adds the stage totals of another collector (e.g. from a worker process, see summary()) to this one."""
+        for name, other in stages.items():
+            totals = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "items": 0})
+            totals["calls"] += other["calls"]
+            totals["seconds"] += other["seconds"]
+            totals["max_seconds"] = max(totals["max_seconds"], other["max_seconds"])
+            totals["items"] += other["items"]
+            if "alloc_peak_mb" in other:
+                totals["alloc_peak_mb"] = max(totals.get("alloc_peak_mb", 0.0), other["alloc_peak_mb"])
+                totals["alloc_net_mb"] = totals.get("alloc_net_mb", 0.0) + other["alloc_net_mb"]
+
+    def summary(self):
+        """Returns a copy of the stage totals."""
+        return json.loads(json.dumps(self.stages))
+
+    def write(self, path):
+        """
+        Writes the stage totals to a JSON metrics file. Stage profiles, if any, are written next to it
+        as <path without .json>.<stage>.prof (readable with pstats or snakeviz).
+        """
+        stages = self.summary()
+        for name, profiler in self._profilers.items():
+            profile_path = f"{os.path.splitext(path)[0]}.{name}.prof"
+            profiler.dump_stats(profile_path)
+            stages.setdefault(name, {})["profile"] = profile_path
+
+        with open(path, "w") as f:
+            json.dump({
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "profile": self.profile,
+                "trace_memory": self.trace_memory,
+                "stages": stages,
+            }, f, indent=4)
+
+
+def enable(profile=False, trace_memory=False):
+    """
+    Turns metrics collection on for this process and returns the collector.
+
+    Parameters:
+        profile (bool): Also run each stage under cProfile.
+        trace_memory (bool): Also trace each stage's allocations with tracemalloc (slows everything down).
+    """
+    global _collector
+    _collector = MetricsCollector(profile, trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _collector
+
+
+def disable():
+    """Turns metrics collection off and returns the collector that was active, if any."""
+    global _collector
+    collector, _collector = _collector, None
+    if collector is not None and collector.trace_memory:
+        tracemalloc.stop()
+    return collector
+
+
+def collector():
+    """Returns the active collector, or None while metrics are disabled."""
+    return _collector
+
+
+def stage(name):
+    """
+    Context manager measuring one stage:
+
+        with metrics.stage("grouping") as record:
+            groups = group_customer_orders(...)
+            record.add_items(len(groups))
+
+    Does nothing while metrics are disabled.
+    """
+    if _collector is None:
+        return _NULL_STAGE
+    return _collector.stage(name)
+
+
+def instrumented(name, count=None):
+    """
+    Decorator measuring every call of a function as a stage.
+
+    Parameters:
+        name (str): The stage name.
+        count (callable): Optional function of the return value giving the stage's item count (e.g. len).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _collector is None:
+                return function(*args, **kwargs)
+            with _collector.stage(name) as record:
+                result = function(*args, **kwargs)
+                if count is not None:
+                    record.add_items(count(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterable):
+    """
+    Measures the time spent producing the items of an iterable (e.g. a generator of rows) as a stage,
+    counting one item per element. Returns the iterable itself while metrics are disabled.
+
+    Like a nested stage, that time is excluded from the stage consuming the iterable, and the stages run
+    while producing an item (e.g. generating the next batch of a stream) are excluded from this one.
+    """
+    if _collector is None:
+        return iterable
+    return _timed_iter(_collector, name, iterable)
+
+
+def _timed_iter(collector, name, iterable):
+    iterator = iter(iterable)
+    seconds = 0.0
+    items = 0
+    try:
+        while True:
+            span = _Span()
+            collector._active.append(span)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed = time.perf_counter() - start
+                collector._exit_span(elapsed)
+                seconds += elapsed - span.excluded
+            items += 1
+            yield item
+    finally:
+        collector.merge({name: {"calls": 1, "seconds": seconds, "max_seconds": seconds, "items": items}})
+
+
+def compare_metrics(baseline, current):
+    """Prints the change in total seconds of every stage between two metrics files."""
+    print(f"{'stage':<16} {'baseline':>10} {'current':>10} {'change':>8} {'items':>10}")
+    for name, totals in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if not base or not base["seconds"]:
+            print(f"{name:<16} {'-':>10} {totals['seconds']:>9.3f}s {'':>8} {totals['items']:>10}")
+            continue
+        change = totals["seconds"] / base["seconds"] - 1
+        print(f"{name:<16} {base['seconds']:>9.3f}s {totals['seconds']:>9.3f}s {change:>+7.1%} {totals['items']:>10}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compare two metrics files written with --metrics.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    args = parser.parse_args()
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(args.current, "r") as f:
+        current = json.load(f)
+    compare_metrics(baseline, current)
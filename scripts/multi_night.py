@@ -0,0 +1,197 @@
+from generate_group_orders import generate_final_group_orders
+from allocate_ordering_times import allocate_ordering_times
+from menu_index import MenuIndex
+from sim_config import load_sim_config
+from menu_source import load_offline_menu, fetch_bigquery_menu
+from run_sim import save_orders_summary_csv, save_orders_parquet, stream_group_orders
+from seeding import night_rngs, resolve_seed
+import metrics
+
+import os
+import argparse
+import datetime
+import concurrent.futures
+
+# Set once per worker process by _init_worker(...), so the menu and config are sent to each worker only once
+_worker_state = {}
+
+
+def service_dates(start_date, end_date):
+    """Returns every date from start_date to end_date, both included."""
+    return [start_date + datetime.timedelta(days=day) for day in range((end_date - start_date).days + 1)]
+
+
+def _init_worker(master_df, config, metrics_options=None):
+    _worker_state["config"] = config
+    _worker_state["menu_index"] = MenuIndex(master_df, config.categories)
+    if metrics_options is not None:
+        metrics.enable(**metrics_options)
+
+
+def simulate_night(service_date, output_dir, output_format="csv", compression=None, seed=None, stream_batch_size=None):
+    """
+    Simulates one night's service and writes its orders straight to disk, so no night is kept in memory
+    once written. Runs inside a worker process set up by _init_worker(...).
+
+    Parameters:
+        service_date (datetime.date): The night to simulate.
+        output_dir (str): Directory the night's file is written to.
+        output_format (str): "csv" (one orders_for_night_YYYY-MM-DD.csv per night) or
+                             "parquet" (a dataset partitioned by service date, see parquet_export).
+        compression (str): CSV compression, see save_orders_summary_csv(...).
+        seed (int): The run's seed. The night's random streams only depend on it and service_date
+                    (see seeding.night_rngs(...)), so the output doesn't depend on which worker runs the night.
+        stream_batch_size (int): If given, the night is generated, allocated and written this many customers
+                                 at a time (see run_sim.stream_group_orders(...)) instead of all at once.
+
+    Returns:
+        tuple: (service_date, number of groups, path of the written file, the night's stage metrics or None
+                if metrics are disabled)
+    """
+    config = _worker_state["config"]
+    menu_index = _worker_state["menu_index"]
+    rngs = night_rngs(seed, service_date)
+
+    group_count = 0
+    if stream_batch_size:
+        def counted(batches):
+            # Counts the groups as the batches go by, the stream is only consumed by the writer
+            nonlocal group_count
+            for batch in batches:
+                group_count += len(batch)
+                yield batch
+        group_orders = counted(stream_group_orders(menu_index, config, stream_batch_size, service_date, rngs))
+    else:
+        group_orders = generate_final_group_orders(menu_index, config, service_date=service_date, rngs=rngs)
+        group_orders = allocate_ordering_times(group_orders, config, service_date=service_date, rngs=rngs)
+        group_count = len(group_orders)
+
+    if output_format == "parquet":
+        path = save_orders_parquet(group_orders, menu_index, output_dir, service_date=service_date, rng=rngs["order_ids"])
+    else:
+        filename = os.path.join(output_dir, f"orders_for_night_{service_date.isoformat()}.csv")
+        path = save_orders_summary_csv(group_orders, menu_index, filename, compression=compression, service_date=service_date,
+                                       rng=rngs["order_ids"])
+
+    # Hand this night's stage totals back to the parent process, and start afresh for the next night
+    night_metrics = None
+    collector = metrics.collector()
+    if collector is not None:
+        night_metrics = collector.summary()
+        collector.stages.clear()
+    return service_date, group_count, path, night_metrics
+
+
+def simulate_nights(start_date, end_date, master_df, config, output_dir, output_format="csv",
+                    compression=None, workers=None, seed=None, metrics_options=None, stream_batch_size=None):
+    """
+    Simulates every night from start_date to end_date (both included), each with its own weekday's
+    customer count range and bookings anchored to its own date.
+
+    Nights are independent, so they are spread over a pool of worker processes; each worker writes its
+    nights' output as soon as they are done. With workers=1 the nights run one after another in this process.
+
+    Parameters:
+        start_date (datetime.date): First night to simulate.
+        end_date (datetime.date): Last night to simulate.
+        master_df (pd.DataFrame): The master menu.
+        config (SimConfig): The compiled simulation config.
+        output_dir (str): Directory the output is written to (created if needed).
+        output_format (str): "csv" or "parquet", see simulate_night(...).
+        compression (str): CSV compression, see save_orders_summary_csv(...).
+        workers (int): Number of worker processes, defaults to the number of CPUs.
+        seed (int): Seed of the run. The same seed gives identical output for any number of workers;
+                    fresh entropy is used if None.
+        metrics_options (dict): Keyword arguments of metrics.enable(...) to collect stage metrics in every
+                                worker, None to leave them off. Each night's metrics are merged into the
+                                collector active in this process.
+        stream_batch_size (int): Customers per batch to stream every night in, see simulate_night(...).
+
+    Returns:
+        list: (service_date, number of groups, path, stage metrics) for every night, in date order.
+    """
+    nights = service_dates(start_date, end_date)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Resolved once here, so every worker derives its nights' streams from the same seed
+    seed = resolve_seed(seed)
+
+    parent_collector = metrics.collector()
+    results = []
+    if workers == 1:
+        # Nights run in this process, so they record straight into its collector (if any)
+        _worker_state["config"] = config
+        _worker_state["menu_index"] = MenuIndex(master_df, config.categories)
+        results = [simulate_night(night, output_dir, output_format, compression, seed, stream_batch_size)
+                   for night in nights]
+        if parent_collector is not None:
+            for result in results:
+                parent_collector.merge(result[3])
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(master_df, config, metrics_options)) as executor:
+        futures = [executor.submit(simulate_night, night, output_dir, output_format, compression, seed, stream_batch_size)
+                   for night in nights]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if parent_collector is not None and result[3] is not None:
+                parent_collector.merge(result[3])
+            results.append(result)
+    return sorted(results, key=lambda result: result[0])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate every night of restaurant orders in a date range.")
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, required=True,
+                        help="first night to simulate (YYYY-MM-DD)")
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat, required=True,
+                        help="last night to simulate, included (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--output-dir", default="simulated_nights",
+                        help="directory the nights are written to")
+    parser.add_argument("--output-format", choices=["csv", "parquet"], default="csv",
+                        help="one CSV file per night, or a Parquet dataset partitioned by service date (needs pyarrow)")
+    parser.add_argument("--compression", choices=["gzip", "bz2", "xz"], default=None,
+                        help="compress the CSV files")
+    parser.add_argument("--menu-source", choices=["bigquery", "csv"], default="bigquery",
+                        help="where to load the menus from, see run_sim.py")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for a reproducible run (same output for any number of workers)")
+    parser.add_argument("--stream-batch-size", type=int, metavar="CUSTOMERS",
+                        help="generate, allocate and write each night this many customers at a time, "
+                             "so memory doesn't grow with the covers")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write per-stage durations and item counts, summed over every night, to this JSON file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --metrics, also record each stage's allocations with tracemalloc (slow)")
+    args = parser.parse_args()
+
+    if args.end_date < args.start_date:
+        parser.error("--end-date is before --start-date")
+
+    config = load_sim_config()
+    seed = resolve_seed(args.seed)
+    print(f"Seed: {seed}")
+
+    # The menu is loaded once here and handed to every worker
+    if args.menu_source == "csv":
+        master_df = load_offline_menu()
+    else:
+        master_df = fetch_bigquery_menu()
+
+    metrics_options = None
+    if args.metrics:
+        metrics_options = {"trace_memory": args.trace_memory}
+        metrics.enable()  # collects the workers' metrics
+
+    nights = simulate_nights(args.start_date, args.end_date, master_df, config, args.output_dir,
+                             args.output_format, args.compression, args.workers, seed, metrics_options,
+                             args.stream_batch_size)
+    print(f"Simulated {len(nights)} nights ({sum(night[1] for night in nights)} groups) into {args.output_dir}")
+
+    if args.metrics:
+        metrics.disable().write(args.metrics)
+        print(f"Metrics saved as {args.metrics}")
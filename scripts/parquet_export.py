@@ -0,0 +1,149 @@
+import datetime
+import itertools
+import os
+import tempfile
+
+import numpy as np
+
+
+# Files are laid out as <output_dir>/service_date=YYYY-MM-DD/orders.parquet (Hive-style partitions),
+# so readers can skip whole nights by directory name
+PARTITION_KEY = "service_date"
+PARTITION_FILENAME = "orders.parquet"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("The Parquet export needs pyarrow: pip install pyarrow") from e
+    return pa, pq
+
+
+def order_schema():
+    """
+    Returns the Arrow schema of an exported order row, the prepare_order_data(...) fields with column types:
+        table_no          int32, null for groups without a table
+        item_uuid         dictionary-encoded string (a night repeats a few hundred menu items)
+        datetime_ordered  timestamp (Parquet stores it in ms), null where no order time was allocated
+        dep               dictionary-encoded string ("kitchen" or "bar")
+        order_uuid        string
+    """
+    pa, _ = _import_pyarrow()
+    return pa.schema([
+        ("table_no", pa.int32()),
+        ("item_uuid", pa.dictionary(pa.int32(), pa.string())),
+        ("datetime_ordered", pa.timestamp("s")),
+        ("dep", pa.dictionary(pa.int8(), pa.string())),
+        ("order_uuid", pa.string()),
+    ])
+
+
+def rows_to_table(rows, schema=None):
+    """
+    Converts a list of order row dicts, as yielded by prepare_order_data(...), to an Arrow table.
+
+    Parameters:
+        rows (list): The order rows.
+        schema (pa.Schema): The target schema, order_schema() if None.
+
+    Returns:
+        pa.Table: One column per order field.
+    """
+    pa, _ = _import_pyarrow()
+    schema = schema or order_schema()
+
+    table_nos = [row["table_no"] for row in rows]
+    order_times = np.array([row["datetime_ordered"] or "NaT" for row in rows], dtype="datetime64[s]")
+
+    columns = [
+        pa.array([table_no if table_no != "" else None for table_no in table_nos], type=pa.int32()),
+        pa.array([row["item_uuid"] for row in rows], type=pa.string()).dictionary_encode(),
+        pa.array(order_times, type=pa.timestamp("s"), mask=np.isnat(order_times)),
+        pa.array([row["dep"] for row in rows], type=pa.string()).dictionary_encode(),
+        pa.array([row["order_uuid"] for row in rows], type=pa.string()),
+    ]
+    # dictionary_encode() picks int32 indices, cast each column to the exact schema type
+    columns = [column.cast(field.type) for column, field in zip(columns, schema)]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def partition_path(output_dir, service_date):
+    """Returns the path of the Parquet file holding one service date's orders."""
+    return os.path.join(output_dir, f"{PARTITION_KEY}={service_date.isoformat()}", PARTITION_FILENAME)
+
+
+def write_orders_parquet(rows, output_dir, service_date, chunk_size=65536):
+    """
+    Streams order rows to the Parquet partition of one service date, chunk_size rows per row group.
+
+    An existing file for the same date is replaced. The file is written next to its final path and
+    moved into place once complete (the dot prefix hides it from dataset readers meanwhile), so readers
+    never see a partial night.
+
+    Parameters:
+        rows (iterable): Order row dicts, e.g. the prepare_order_data(...) generator.
+        output_dir (str): Root directory of the partitioned dataset.
+        service_date (datetime.date): The night the orders belong to.
+        chunk_size (int): Number of rows converted and written at a time.
+
+    Returns:
+        tuple: (path of the written file, number of rows written)
+    """
+    _, pq = _import_pyarrow()
+    schema = order_schema()
+
+    path = partition_path(output_dir, service_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging_fd, staging_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".parquet.tmp")
+    os.close(staging_fd)
+
+    row_count = 0
+    try:
+        with pq.ParquetWriter(staging_path, schema, compression="zstd") as writer:
+            rows = iter(rows)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                writer.write_table(rows_to_table(chunk, schema))
+                row_count += len(chunk)
+        os.replace(staging_path, path)
+    except BaseException:
+        os.remove(staging_path)
+        raise
+    return path, row_count
+
+
+def read_orders_parquet(output_dir, columns=None, start_date=None, end_date=None):
+    """
+    Reads exported orders back, only touching the requested columns and the partitions of the requested nights.
+
+    Parameters:
+        output_dir (str): Root directory of the partitioned dataset.
+        columns (list): Order fields to read (service_date can be included), all if None.
+        start_date (datetime.date): First service date to read, unbounded if None.
+        end_date (datetime.date): Last service date to read (inclusive), unbounded if None.
+
+    Returns:
+        pd.DataFrame: The selected orders, with a service_date column when requested.
+    """
+    pa, _ = _import_pyarrow()
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor="hive")
+    dataset = ds.dataset(output_dir, format="parquet", partitioning=partitioning)
+
+    # Dates are compared as ISO strings, which sort like the dates themselves
+    date_filter = None
+    if start_date is not None:
+        date_filter = ds.field(PARTITION_KEY) >= start_date.isoformat()
+    if end_date is not None:
+        before_end = ds.field(PARTITION_KEY) <= end_date.isoformat()
+        date_filter = before_end if date_filter is None else date_filter & before_end
+
+    orders = dataset.to_table(columns=columns, filter=date_filter).to_pandas()
+    if PARTITION_KEY in orders.columns:
+        orders[PARTITION_KEY] = orders[PARTITION_KEY].map(datetime.date.fromisoformat)
+    return orders
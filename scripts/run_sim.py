@@ -1,18 +1,71 @@
-from generate_group_orders import generate_final_group_orders
-from allocate_ordering_times import allocate_ordering_times
+from generate_group_orders import generate_final_group_orders, generate_group_order_batches, STREAM_BATCH_SIZE
+from allocate_ordering_times import allocate_ordering_times, allocate_ordering_time_batches
+from menu_index import MenuIndex
+from columnar_orders import ColumnarOrders, DEPARTMENTS, NO_ITEM, NO_TABLE
+from sim_config import load_sim_config
+from menu_source import load_offline_menu, fetch_bigquery_menu
+from bigquery_sink import BigQuerySink, BigQuerySinkError
+from parquet_export import write_orders_parquet
+from seeding import night_rngs, resolve_seed, stage_rng
+from stage_cache import StageCache, cached_group_orders, stage_cache_directory, DEFAULT_MAX_BYTES
+import metrics
 from google.cloud import bigquery
 
 import os
-import pandas as pd
+import argparse
+import numpy as np
 import uuid
 import datetime
 import csv
+import itertools
+import gzip
+import bz2
+import lzma
 
-def prepare_order_data(group_orders):
+ORDER_FIELDS = ["table_no", "item_uuid", "datetime_ordered", "dep", "order_uuid"]
+
+# Stdlib openers for save_orders_summary_csv(..., compression=...), with the file suffix they add
+CSV_COMPRESSION = {
+    "gzip": (gzip.open, ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+def new_order_id(rng=None):
+    """Returns a random version 4 UUID string, drawn from rng when given so that order ids can be reproduced."""
+    if rng is None:
+        return str(uuid.uuid4())
+    return str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+def prepare_order_data(group_orders, menu_index, rng=None):
     """
-    Processes group_orders and returns a list of dicts with keys:
+    Processes group_orders and yields dicts with keys:
     table_no, item_uuid, datetime_ordered, dep, order_uuid
+
+    The orders hold int item codes all through the pipeline; this is where they are turned back into
+    item UUID strings, with the code -> UUID table of menu_index (the MenuIndex the orders were generated with).
+
+    Rows are generated one at a time, so callers can stream them without holding the whole night in memory
+    (wrap in list(...) when all rows are needed at once).
+    group_orders can be the nested dictionary, a ColumnarOrders, or an iterable of allocated ColumnarOrders
+    batches of one night (see stream_group_orders(...)), whose rows are prepared one batch at a time.
+    order_uuid values are drawn from rng if given (see new_order_id(...)).
     """
+    if isinstance(group_orders, ColumnarOrders):
+        yield from prepare_columnar_order_data(group_orders, menu_index, rng=rng)
+        return
+
+    if not isinstance(group_orders, dict):
+        order_ids = {}
+        for batch in group_orders:
+            yield from prepare_columnar_order_data(batch, menu_index, rng=rng, order_ids=order_ids)
+            # A table's next booking starts after its current one ends, so a later batch can't add to a booked
+            # order of this one; only the unbooked groups' orders (no table, no time) are shared across batches.
+            order_ids = {order_key: order_id for order_key, order_id in order_ids.items() if order_key[0] == ""}
+        return
+
+    item_uuids = menu_index.menu_item_uuids.tolist()
+
     department_by_category = {
         "starters": "kitchen", "mains": "kitchen",
         "desserts": "kitchen", "sides": "kitchen",
@@ -21,7 +74,6 @@ def prepare_order_data(group_orders):
     }
 
     order_ids = {}
-    rows = []
 
     for group_key, group_data in group_orders.items():
         table_no = group_data.get("table_no", "")
@@ -30,70 +82,281 @@ def prepare_order_data(group_orders):
             for item in items:
                 if item is None:
                     continue
-                item_uuid, order_time = item if isinstance(item, tuple) else (item, None)
+                item_code, order_time = item if isinstance(item, tuple) else (item, None)
+                if item_code is None:
+                    continue  # a course placeholder that was given a time (e.g. a mains entry without a main)
                 order_time_str = order_time.isoformat() if order_time else None
                 order_key = (table_no, order_time_str, dep)
 
                 if order_key not in order_ids:
-                    order_ids[order_key] = str(uuid.uuid4())
+                    order_ids[order_key] = new_order_id(rng)
 
-                rows.append({
+                yield {
                     "table_no": table_no,
-                    "item_uuid": item_uuid,
+                    "item_uuid": item_uuids[item_code],
                     "datetime_ordered": order_time_str,
                     "dep": dep,
                     "order_uuid": order_ids[order_key]
-                })
+                }
+
+def prepare_columnar_order_data(columnar_orders, menu_index, chunk_size=65536, rng=None, order_ids=None):
+    """
+    prepare_order_data(...) for a ColumnarOrders: the row fields (including the item UUIDs, decoded from
+    the item codes) are computed as arrays, chunk_size rows at a time, and the rows come out in the same
+    order as for the equivalent nested dictionary.
+    order_ids maps (table_no, datetime_ordered, dep) to order_uuid; pass the same dict to several calls
+    to share order ids between batches of one night.
+    """
+    rows_with_item = np.flatnonzero(columnar_orders.item_code != NO_ITEM)
+    departments = np.array(DEPARTMENTS, dtype=object)
+
+    order_ids = order_ids if order_ids is not None else {}
+    for chunk_start in range(0, len(rows_with_item), chunk_size):
+        rows = rows_with_item[chunk_start:chunk_start + chunk_size]
+
+        table_nos = columnar_orders.table_no[columnar_orders.group_id[rows]].astype(object)
+        table_nos[table_nos == NO_TABLE] = ""
+        # Times only become datetimes here, from integer seconds since the service-day origin
+        order_times = columnar_orders.datetimes(columnar_orders.order_time[rows])
+        order_time_strs = np.datetime_as_string(order_times, unit="s").astype(object)
+        order_time_strs[np.isnat(order_times)] = None
+        deps = departments[columnar_orders.department[rows]]
 
-    return rows
+        for table_no, item_uuid, order_time_str, dep in zip(table_nos.tolist(), menu_index.decode(columnar_orders.item_code[rows]).tolist(),
+                                                             order_time_strs.tolist(), deps.tolist()):
+            order_key = (table_no, order_time_str, dep)
+
+            if order_key not in order_ids:
+                order_ids[order_key] = new_order_id(rng)
+
+            yield {
+                "table_no": table_no,
+                "item_uuid": item_uuid,
+                "datetime_ordered": order_time_str,
+                "dep": dep,
+                "order_uuid": order_ids[order_key]
+            }
+
+def stream_group_orders(menu_index, config, batch_size=STREAM_BATCH_SIZE, service_date=None, rngs=None,
+                        customer_count=None):
+    """
+    Streams a night through generation and allocation batch_size customers at a time (see
+    generate_group_order_batches(...) and allocate_ordering_time_batches(...)). The result can be passed
+    as group_orders to prepare_order_data(...) and the save_orders_* functions, which then write every batch
+    before the next is generated, so memory is bounded by the batch size and the number of tables rather than
+    by the number of covers.
+
+    The batches are generated lazily and can only be consumed once: call this again (with fresh rngs from the
+    same seed for the same orders) for each output.
+
+    Returns:
+        iterator: Allocated ColumnarOrders batches.
+    """
+    batches = generate_group_order_batches(menu_index, config, batch_size, service_date, rngs, customer_count)
+    return allocate_ordering_time_batches(batches, config, service_date=service_date, rngs=rngs)
+
+def simulate_night(menu_index, config, service_date, seed, stage_cache=None, customer_count=None):
+    """
+    Generates and allocates one night's orders with the batched columnar engine, from the night's per-stage
+    random streams (see seeding.night_rngs(...)).
+
+    With a stage_cache, every stage's output is kept in (and read back from) the cache, see
+    stage_cache.cached_group_orders(...). The orders are the same with or without it.
+
+    Parameters:
+        menu_index (MenuIndex): The precomputed index of the master menu.
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night being simulated.
+        seed (int): The run's seed, see seeding.resolve_seed(...).
+        stage_cache (StageCache): Optional cache of stage outputs.
+        customer_count (int): Overrides the number of customers drawn from the config.
+
+    Returns:
+        ColumnarOrders: The night's orders with allocated times.
+    """
+    if stage_cache is not None:
+        return cached_group_orders(menu_index, config, service_date, seed, stage_cache, customer_count)
 
-def save_orders_summary_csv(group_orders):
-    orders = prepare_order_data(group_orders)
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    filename = f"orders_for_night_{today_str}.csv"
+    rngs = night_rngs(seed, service_date)
+    group_orders = generate_final_group_orders(menu_index, config, batched=True, columnar=True,
+                                               service_date=service_date, rngs=rngs, customer_count=customer_count)
+    return allocate_ordering_times(group_orders, config, service_date=service_date, rngs=rngs)
 
-    with open(filename, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=["table_no", "item_uuid", "datetime_ordered", "dep", "order_uuid"])
+def save_orders_summary_csv(group_orders, menu_index, filename=None, chunk_size=10000, compression=None,
+                            service_date=None, rng=None):
+    """
+    Streams the rows of prepare_order_data(...) to a CSV file, chunk_size rows at a time,
+    so memory use doesn't grow with the number of orders.
+
+    Parameters:
+        group_orders (dict | ColumnarOrders | iterable): The allocated group orders, or a stream of them
+                                                         (see stream_group_orders(...)).
+        menu_index (MenuIndex): The index the orders were generated with, to decode their item codes.
+        filename (str): Output path, defaults to orders_for_night_YYYY-MM-DD.csv for the service date.
+        chunk_size (int): Number of rows written per batch.
+        compression (str): None for a plain CSV, or "gzip", "bz2" or "xz" (the matching suffix is added to filename).
+        service_date (datetime.date): The night the orders belong to, defaults to today.
+        rng (np.random.Generator): Optional generator for the order ids, see prepare_order_data(...).
+
+    Returns:
+        str: The path of the written file.
+    """
+    # Row preparation and writing are measured as separate stages when metrics are enabled
+    orders = metrics.timed_iter("row_prep", prepare_order_data(group_orders, menu_index, rng))
+    if filename is None:
+        service_date_str = (service_date or datetime.date.today()).strftime("%Y-%m-%d")
+        filename = f"orders_for_night_{service_date_str}.csv"
+
+    if compression is None:
+        open_csv = open
+    else:
+        open_csv, suffix = CSV_COMPRESSION[compression]
+        filename += suffix
+
+    with metrics.stage("sink") as stage, open_csv(filename, "wt", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=ORDER_FIELDS)
         writer.writeheader()
-        writer.writerows(orders)
+        while True:
+            chunk = list(itertools.islice(orders, chunk_size))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            stage.add_items(len(chunk))
 
     print(f"CSV summary saved as {filename}")
+    return filename
 
-def save_orders_to_bigquery(group_orders):
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "annular-mesh-453913-r6-98bf2733520c.json"
-    client = bigquery.Client()
+def save_orders_parquet(group_orders, menu_index, output_dir="orders_parquet", service_date=None, chunk_size=65536,
+                        rng=None):
+    """
+    Streams the rows of prepare_order_data(...) to a Parquet dataset partitioned by service date
+    (output_dir/service_date=YYYY-MM-DD/orders.parquet), see parquet_export.write_orders_parquet(...).
+    Needs the optional pyarrow dependency.
 
-    table_ref = client.dataset("restaurant_data").table("orders")
-    rows_to_insert = prepare_order_data(group_orders)
+    Parameters:
+        group_orders (dict | ColumnarOrders | iterable): The allocated group orders, or a stream of them
+                                                         (see stream_group_orders(...)).
+        menu_index (MenuIndex): The index the orders were generated with, to decode their item codes.
+        output_dir (str): Root directory of the dataset.
+        service_date (datetime.date): The night the orders belong to, defaults to today.
+        chunk_size (int): Number of rows per Parquet row group.
+        rng (np.random.Generator): Optional generator for the order ids, see prepare_order_data(...).
 
-    errors = client.insert_rows_json(table_ref, rows_to_insert)
-    if errors:
-        print(f"BigQuery Insert Errors: {errors}")
-    else:
-        print("Data successfully inserted into BigQuery!")
+    Returns:
+        str: The path of the written file.
+    """
+    if service_date is None:
+        service_date = datetime.date.today()
+    orders = metrics.timed_iter("row_prep", prepare_order_data(group_orders, menu_index, rng))
+    with metrics.stage("sink") as stage:
+        path, written = write_orders_parquet(orders, output_dir, service_date, chunk_size)
+        stage.add_items(written)
+    print(f"Parquet orders saved as {path} ({written} rows)")
+    return path
 
-if __name__ == "__main__":
-    
-    client = bigquery.Client()
+def save_orders_to_bigquery(group_orders, menu_index, client=None, mode="stream", rng=None):
+    """
+    Writes the rows of prepare_order_data(...) to the restaurant_data.orders table through a BigQuerySink:
+    batched, concurrent streaming inserts with retries (mode="stream"), or a single load job (mode="load").
 
+    Parameters:
+        group_orders (dict | ColumnarOrders | iterable): The allocated group orders, or a stream of them
+                                                         (see stream_group_orders(...)).
+        menu_index (MenuIndex): The index the orders were generated with, to decode their item codes.
+        client: A bigquery.Client or a stand-in such as FakeBigQueryClient, created from the service account key if None.
+        mode (str): "stream" or "load", see BigQuerySink.
+        rng (np.random.Generator): Optional generator for the order ids, see prepare_order_data(...).
+    """
+    if client is None:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "annular-mesh-453913-r6-98bf2733520c.json"
+        client = bigquery.Client()
+
+    sink = BigQuerySink(client, "restaurant_data.orders", mode=mode)
     try:
-        ala_carte_data = client.query("SELECT * FROM `restaurant_data.a_la_carte_menu`").to_dataframe()
-        desserts_data = client.query("SELECT * FROM `restaurant_data.dessert_menu`").to_dataframe()
-        drinks_data  = client.query("SELECT * FROM `restaurant_data.cocktails_and_beer_menu`").to_dataframe()
-        wine_data    = client.query("SELECT * FROM `restaurant_data.wine_menu`").to_dataframe()
-    except Exception as e:
-        print(f"Error occurred while fetching data from BigQuery: {e}")
+        with metrics.stage("sink") as stage:
+            written = sink.write(metrics.timed_iter("row_prep", prepare_order_data(group_orders, menu_index, rng)))
+            stage.add_items(written)
+    except BigQuerySinkError as e:
+        print(f"BigQuery Insert Errors: {e}")
         raise
+    print(f"Data successfully inserted into BigQuery! ({written} rows)")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate a night of restaurant orders.")
+    parser.add_argument("--menu-source", choices=["bigquery", "csv"], default="bigquery",
+                        help="where to load the menus from: the BigQuery tables, or the CSV files in data/raw/menus "
+                             "(no network needed, cached as a binary snapshot in data/cache)")
+    parser.add_argument("--menu-ttl-hours", type=float, default=12,
+                        help="how long menus fetched from BigQuery are reused from the local cache before "
+                             "checking whether the tables have changed (0 to always check)")
+    parser.add_argument("--bigquery-mode", choices=["stream", "load"], default="stream",
+                        help="write orders with batched streaming inserts, or as a single load job for bulk volumes")
+    parser.add_argument("--parquet-dir",
+                        help="also export the orders to this Parquet dataset, partitioned by service date (needs pyarrow)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for a reproducible night (the same seed and date always give the same orders)")
+    parser.add_argument("--stream-batch-size", type=int, metavar="CUSTOMERS",
+                        help="generate, allocate and write the night this many customers at a time, so memory "
+                             f"doesn't grow with the covers (e.g. {STREAM_BATCH_SIZE})")
+    parser.add_argument("--stage-cache", nargs="?", const=stage_cache_directory, metavar="DIR",
+                        help="keep every stage's output in this cache directory (default: data/cache/stages) and "
+                             "only recompute the stages whose inputs, config fields or seed changed; use with --seed")
+    parser.add_argument("--stage-cache-mb", type=float, default=DEFAULT_MAX_BYTES / 2**20,
+                        help="size cap of the stage cache, least recently used outputs are evicted beyond it")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write per-stage durations and item counts to this JSON file")
+    parser.add_argument("--profile", action="store_true",
+                        help="with --metrics, also profile each stage with cProfile (PATH.<stage>.prof files)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="with --metrics, also record each stage's allocations with tracemalloc (slow)")
+    args = parser.parse_args()
+
+    if args.stage_cache and args.stream_batch_size:
+        parser.error("--stage-cache caches whole nights, it can't be combined with --stream-batch-size")
+
+    if args.metrics:
+        metrics.enable(profile=args.profile, trace_memory=args.trace_memory)
 
-    ala_carte_df = pd.DataFrame(ala_carte_data)
-    desserts_df = pd.DataFrame(desserts_data)
-    drinks_df = pd.DataFrame(drinks_data)
-    wine_df = pd.DataFrame(wine_data)
+    # Parse the config once, it is passed through the whole pipeline
+    config = load_sim_config()
+
+    if args.menu_source == "csv":
+        master_df = load_offline_menu()
+    else:
+        master_df = fetch_bigquery_menu(ttl=datetime.timedelta(hours=args.menu_ttl_hours))
+
+    # Index the menu by config category group once, so item selection doesn't rescan master_df
+    menu_index = MenuIndex(master_df, config.categories)
+
+    # One independent random stream per stage, derived from the seed and tonight's date
+    seed = resolve_seed(args.seed)
+    print(f"Seed: {seed}")
+    service_date = datetime.date.today()
+
+    if args.stream_batch_size:
+        # A stream can only be written once, so every output regenerates the night from the same seed
+        def night_orders():
+            return stream_group_orders(menu_index, config, args.stream_batch_size, service_date,
+                                       night_rngs(seed, service_date))
+    else:
+        # With a stage cache, only the stages whose inputs changed are recomputed; the orders are the same
+        stage_cache = StageCache(args.stage_cache, int(args.stage_cache_mb * 2**20)) if args.stage_cache else None
+        group_orders = simulate_night(menu_index, config, service_date, seed, stage_cache)
+        if stage_cache is not None:
+            print(f"Stage cache: reused {', '.join(stage_cache.hits) or 'nothing'}; "
+                  f"computed {', '.join(stage_cache.misses) or 'nothing'}")
 
-    master_df = pd.concat([ala_carte_df, desserts_df, drinks_df, wine_df], ignore_index=True)
+        def night_orders():
+            return group_orders
 
-    group_orders = generate_final_group_orders(master_df)
-    group_orders = allocate_ordering_times(group_orders)
+    # Every output gets a fresh order_ids stream, so the same order has the same order_uuid everywhere
+    # save_orders_summary_csv(night_orders(), menu_index, service_date=service_date, rng=stage_rng(seed, service_date, "order_ids"))
+    if args.parquet_dir:
+        save_orders_parquet(night_orders(), menu_index, args.parquet_dir, service_date=service_date,
+                            rng=stage_rng(seed, service_date, "order_ids"))
+    save_orders_to_bigquery(night_orders(), menu_index, mode=args.bigquery_mode, rng=stage_rng(seed, service_date, "order_ids"))
 
-    # save_orders_summary_csv(group_orders)
-    save_orders_to_bigquery(group_orders)
+    if args.metrics:
+        metrics.disable().write(args.metrics)
+        print(f"Metrics saved as {args.metrics}")
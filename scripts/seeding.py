@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Every stage of a night that draws random numbers gets its own stream, in this order.
+# Append new stages at the end: a stage's stream is picked by its position, so inserting one would
+# change the streams (and so the orders) of every stage after it.
+STAGES = [
+    "intentions",   # customer count and order intentions
+    "items",        # menu items for each customer's order
+    "groups",       # splitting customers into groups
+    "wines",        # wine selection for each group
+    "sides",        # sides, sauces and extras
+    "bookings",     # table order when booking
+    "drinks",       # drink order times
+    "food",         # food order times
+    "wine_times",   # wine order times
+    "order_ids",    # order UUIDs of the exported rows
+]
+
+
+def night_seed_sequence(seed, service_date):
+    """
+    Returns the SeedSequence of one night of a simulation run.
+
+    The night's sequence is keyed by the run's seed and the service date itself, not by the position of the night
+    in a date range or by the worker process that simulates it. A night therefore gets the same streams whether
+    it runs alone, in a serial loop or in any worker of a process pool.
+
+    Parameters:
+        seed (int): The run's seed, None for fresh entropy (see resolve_seed(...)).
+        service_date (datetime.date): The night being simulated.
+
+    Returns:
+        np.random.SeedSequence: The root of the night's streams.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(service_date.toordinal(),))
+
+
+def resolve_seed(seed=None):
+    """
+    Returns seed, or fresh entropy if it is None. Printing the result lets an unseeded run be repeated with --seed.
+    """
+    return seed if seed is not None else int(np.random.SeedSequence().entropy)
+
+
+def stage_rng(seed, service_date, stage):
+    """
+    Returns the random generator of one stage of a night: the child of night_seed_sequence(...) at the
+    stage's position in STAGES, as SeedSequence.spawn(...) would create it. Calling it again gives a new
+    generator that repeats the same numbers.
+    """
+    night = night_seed_sequence(seed, service_date)
+    return np.random.default_rng(np.random.SeedSequence(night.entropy, spawn_key=night.spawn_key + (STAGES.index(stage),)))
+
+
+def night_rngs(seed, service_date):
+    """
+    Returns one independent random generator per stage of a night, see stage_rng(...).
+
+    Giving each stage its own stream means a change to how many numbers one stage draws doesn't shift the
+    numbers every later stage sees, so optimised and reference versions of a stage can be compared on the same inputs.
+
+    Parameters:
+        seed (int): The run's seed, see resolve_seed(...).
+        service_date (datetime.date): The night being simulated.
+
+    Returns:
+        dict: Stage name (see STAGES) -> np.random.Generator.
+    """
+    return {stage: stage_rng(seed, service_date, stage) for stage in STAGES}
+
+
+def shared_rngs(rng):
+    """Returns a stage -> generator mapping that uses the same generator for every stage."""
+    return dict.fromkeys(STAGES, rng)
@@ -0,0 +1,204 @@
+import dataclasses
+import datetime
+import json
+import os
+import sys
+import types
+
+import numpy as np
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+config_file = os.path.join(script_dir, "..", "sim_config.json")
+config_file = os.path.abspath(config_file)  # normalize
+
+
+def _probabilities(values):
+    """Returns a read-only float array of Bernoulli probabilities."""
+    array = np.asarray(values, dtype=np.float64)
+    array.setflags(write=False)
+    return array
+
+
+def _minutes_range(raw, min_key, max_key):
+    """
+    Returns a (min, max) tuple of whole minutes, both ends included. The stages draw from it with
+    rng.integers(*range, endpoint=True) on a NumPy Generator.
+    """
+    return (int(raw[min_key]), int(raw[max_key]))
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class SimConfig:
+    """
+    An immutable, precompiled view of sim_config.json.
+
+    The file is parsed once by load_sim_config(...) and the resulting SimConfig is passed
+    through the whole pipeline, so no stage re-opens or re-parses the JSON. Values that
+    the stages derive from the raw config (durations, probability arrays, the booking
+    slot grid and the guest count -> table lookup) are computed up front.
+    """
+
+    raw: types.MappingProxyType                 # the parsed JSON, read-only
+
+    # Order intention probabilities
+    n_alc_drinks: np.ndarray
+    n_wine_servings: np.ndarray
+    n_dessert_wine_servings: np.ndarray
+    n_non_alc_drinks: np.ndarray
+    b_starter: float
+    b_main: float
+    b_dessert: float
+    customer_count_range: types.MappingProxyType  # weekday (0 = Monday) -> (min, max)
+
+    # Menu
+    categories: types.MappingProxyType          # category group -> tuple of menu categories
+    wine_serving_ml: int
+    dessert_wine_serving_ml: int
+    extra_chance_range: tuple
+
+    # Tables and bookings
+    two_top_tables: tuple
+    four_top_tables: tuple
+    six_top_tables: tuple
+    turn_time_two_top: datetime.timedelta
+    turn_time_four_top: datetime.timedelta
+    turn_time_six_top: datetime.timedelta
+    table_rules: tuple                          # indexed by min(guest_count, 5) -> (duration, tables)
+    booking_slots: tuple                        # offsets from midnight, nearest to the ideal time first
+
+    # Ordering times (ranges are whole minutes)
+    initial_drinks_order_wait_range: tuple
+    drink_round_prod_time: datetime.timedelta
+    drink_consumption_time_range: tuple
+    initial_food_order_wait_range: tuple
+    starters_consumption_time_range: tuple
+    mains_prep_time_range: tuple
+    mains_consumption_time_range: tuple
+    mains_consumption_time_max: datetime.timedelta
+    desserts_order_time_range: tuple
+    merge_orders_timeframe: datetime.timedelta
+
+    @classmethod
+    def from_dict(cls, raw):
+        """
+        Compiles a parsed sim_config.json dictionary into a SimConfig.
+
+        Parameters:
+            raw (dict): The configuration as loaded from the JSON file.
+
+        Returns:
+            SimConfig: The compiled configuration.
+        """
+        raw = json.loads(json.dumps(raw))  # private deep copy, so later edits to the dict can't leak in
+
+        two_top_tables = tuple(raw["two_top_tables"])
+        four_top_tables = tuple(raw["four_top_tables"])
+        six_top_tables = tuple(raw["six_top_tables"])
+        turn_time_two_top = datetime.timedelta(minutes=raw["turn_time_two_top"])
+        turn_time_four_top = datetime.timedelta(minutes=raw["turn_time_four_top"])
+        turn_time_six_top = datetime.timedelta(minutes=raw["turn_time_six_top"])
+
+        # 1-2 guests -> two tops, 3-4 guests -> four tops, 5+ guests -> six tops
+        two_top_rule = (turn_time_two_top, two_top_tables)
+        four_top_rule = (turn_time_four_top, four_top_tables)
+        six_top_rule = (turn_time_six_top, six_top_tables)
+        table_rules = (two_top_rule, two_top_rule, two_top_rule, four_top_rule, four_top_rule, six_top_rule)
+
+        # Bookings can start every 15 minutes between opening and last booking,
+        # tried in order of distance from the ideal booking time
+        opening = datetime.timedelta(hours=raw["opening_time"])
+        last_booking = datetime.timedelta(hours=raw["last_booking"])
+        ideal = datetime.timedelta(hours=raw["ideal_booking_time"])
+        booking_slots = []
+        current = opening
+        while current <= last_booking:
+            booking_slots.append(current)
+            current += datetime.timedelta(minutes=15)
+        booking_slots.sort(key=lambda t: abs((t - ideal).total_seconds()))
+
+        return cls(
+            raw=types.MappingProxyType(raw),
+            n_alc_drinks=_probabilities(raw["n_alc_drinks"]),
+            n_wine_servings=_probabilities(raw["n_wine_servings"]),
+            n_dessert_wine_servings=_probabilities(raw["n_dessert_wine_servings"]),
+            n_non_alc_drinks=_probabilities(raw["n_non_alc_drinks"]),
+            b_starter=float(raw["b_starter"][0]),
+            b_main=float(raw["b_main"][0]),
+            b_dessert=float(raw["b_dessert"][0]),
+            customer_count_range=types.MappingProxyType(
+                {int(day): tuple(count_range) for day, count_range in raw["customer_count_range"].items()}),
+            categories=types.MappingProxyType(
+                {group: tuple(categories) for group, categories in raw["categories"].items()}),
+            wine_serving_ml=int(raw["wine_serving_sizes"]["wine_serving"]),
+            dessert_wine_serving_ml=int(raw["wine_serving_sizes"]["dessert_wine_serving"]),
+            extra_chance_range=(raw["chance_of_ordering_an_extra"]["min_chance"],
+                                raw["chance_of_ordering_an_extra"]["max_chance"]),
+            two_top_tables=two_top_tables,
+            four_top_tables=four_top_tables,
+            six_top_tables=six_top_tables,
+            turn_time_two_top=turn_time_two_top,
+            turn_time_four_top=turn_time_four_top,
+            turn_time_six_top=turn_time_six_top,
+            table_rules=table_rules,
+            booking_slots=tuple(booking_slots),
+            initial_drinks_order_wait_range=_minutes_range(
+                raw, "initial_drinks_order_wait_time_min", "initial_drinks_order_wait_time_max"),
+            drink_round_prod_time=datetime.timedelta(minutes=raw["drink_round_prod_time"]),
+            drink_consumption_time_range=_minutes_range(
+                raw, "drink_consumption_time_min", "drink_consumption_time_max"),
+            initial_food_order_wait_range=_minutes_range(
+                raw, "initial_food_order_wait_time_min", "initial_food_order_wait_time_max"),
+            starters_consumption_time_range=_minutes_range(
+                raw, "starters_consumption_time_min", "starters_consumption_time_max"),
+            mains_prep_time_range=_minutes_range(raw, "mains_prep_time_min", "mains_prep_time_max"),
+            mains_consumption_time_range=_minutes_range(
+                raw, "mains_consumption_time_min", "mains_consumption__time_max"),
+            mains_consumption_time_max=datetime.timedelta(minutes=raw["mains_consumption__time_max"]),
+            desserts_order_time_range=_minutes_range(raw, "desserts_order_time_min", "desserts_order_time_max"),
+            merge_orders_timeframe=datetime.timedelta(seconds=raw["merge_orders_timeframe"]),
+        )
+
+    def __reduce__(self):
+        # MappingProxyType can't be pickled, so rebuild from the raw config (e.g. in worker processes)
+        return (SimConfig.from_dict, (dict(self.raw),))
+
+    def table_rule(self, guest_count):
+        """
+        Returns the booking duration and candidate tables for a group.
+
+        Parameters:
+            guest_count (int): Number of guests in the group.
+
+        Returns:
+            tuple: (booking duration as a timedelta, tuple of candidate table numbers)
+        """
+        return self.table_rules[min(guest_count, 5)]
+
+    def booking_start_times(self, service_date):
+        """
+        Returns the potential booking start times on service_date,
+        ordered by distance from the ideal booking time.
+        """
+        midnight = datetime.datetime.combine(service_date, datetime.time(0, 0))
+        return [midnight + offset for offset in self.booking_slots]
+
+
+def load_sim_config(path=config_file):
+    """
+    Reads and compiles the simulation config file.
+
+    Parameters:
+        path (str): Path to the JSON config file, defaults to sim_config.json at the repository root.
+
+    Returns:
+        SimConfig: The compiled configuration.
+    """
+    print("🔍 Looking for config at:", path)
+
+    if not os.path.exists(path):
+        print("❌ sim_config.json not found at:", path)
+        sys.exit(1)
+
+    with open(path, "r") as f:
+        return SimConfig.from_dict(json.load(f))
@@ -0,0 +1,283 @@
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import types
+
+import numpy as np
+
+from generate_group_orders import (generate_intention_table, generate_customer_orders_batched, group_customer_orders,
+                                   generate_group_wine_orders, generate_group_side_orders_batched,
+                                   build_columnar_group_orders)
+from allocate_ordering_times import (allocate_booking_times, allocate_drink_order_times, allocate_food_order_times,
+                                     allocate_wine_order_times)
+from seeding import stage_rng
+import metrics
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+stage_cache_directory = os.path.abspath(os.path.join(script_dir, "..", "data", "cache", "stages"))
+
+DEFAULT_MAX_BYTES = 2 * 1024**3  # total size of the cached stage outputs before the least recently used are evicted
+
+# The SimConfig fields each stage reads. A stage's cache key includes only these, so changing a timing
+# parameter (e.g. mains_prep_time_min -> mains_prep_time_range) only invalidates the stages that use it
+# and the stages downstream of them. Keep this in step with the stage functions.
+STAGE_CONFIG_FIELDS = {
+    "intentions": ("n_alc_drinks", "n_wine_servings", "n_dessert_wine_servings", "n_non_alc_drinks",
+                   "b_starter", "b_main", "b_dessert", "customer_count_range"),
+    "customer_orders": ("categories", "extra_chance_range"),
+    "grouping": ("categories",),
+    "wine": ("categories", "wine_serving_ml", "dessert_wine_serving_ml"),
+    "sides": (),
+    "booking": ("two_top_tables", "four_top_tables", "six_top_tables", "table_rules", "booking_slots"),
+    "drinks": ("initial_drinks_order_wait_range", "drink_round_prod_time", "drink_consumption_time_range"),
+    "food": ("initial_food_order_wait_range", "starters_consumption_time_range", "mains_prep_time_range",
+             "mains_consumption_time_range", "desserts_order_time_range"),
+    "wine_times": ("merge_orders_timeframe", "mains_consumption_time_max"),
+}
+
+# Modules whose code the cached outputs depend on. Their content is part of every key, so editing a stage
+# invalidates the cache instead of serving outputs of the old code.
+STAGE_MODULES = ["generate_group_orders.py", "allocate_ordering_times.py", "menu_index.py",
+                 "booking_scheduler.py", "columnar_orders.py", "seeding.py"]
+
+
+def _jsonable(value):
+    """Converts a config value (arrays, timedeltas, read-only mappings, tuples) to plain JSON for hashing."""
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _sha256(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def code_fingerprint():
+    """Returns a content hash of the STAGE_MODULES (content rather than mtime, like the menu snapshot)."""
+    digest = hashlib.sha256()
+    for module in STAGE_MODULES:
+        with open(os.path.join(script_dir, module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def menu_fingerprint(menu_index):
+    """Returns a content hash of the items, categories and serving sizes a MenuIndex draws from."""
+    return _sha256({
+        "item_uuids": menu_index.menu_item_uuids.tolist(),
+        "categories": menu_index.menu_categories.tolist(),
+        "serving_sizes": menu_index.menu_serving_sizes.tolist(),
+        "codes": {group: codes.tolist() for group, codes in menu_index.codes.items()},
+    })
+
+
+class StageCache:
+    """
+    A content-addressed, on-disk cache of stage outputs.
+
+    Each output is stored as <cache_dir>/<key>.pkl, where the key is a hash of everything the output depends on:
+    the stage, the keys of the stages it takes its inputs from, the config fields it reads (STAGE_CONFIG_FIELDS),
+    its random stream (seed, service date) and the code of the pipeline. Two runs that agree on all of these
+    share the output; anything else gets a new key, so stale entries are never read, only evicted.
+
+    Once the files add up to more than max_bytes, the least recently used ones are deleted.
+
+    Attributes:
+        cache_dir (str): Directory holding the cached outputs.
+        max_bytes (int): Size cap of the cache directory.
+        hits (list): Stages read from the cache since this object was created.
+        misses (list): Stages computed (and stored) since this object was created.
+    """
+
+    def __init__(self, cache_dir=stage_cache_directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.code = code_fingerprint()
+        self.hits = []
+        self.misses = []
+
+    def key(self, stage, inputs=(), config=None, **params):
+        """
+        Returns the cache key of one stage output.
+
+        Parameters:
+            stage (str): The stage name, a key of STAGE_CONFIG_FIELDS.
+            inputs (tuple): Keys of the stage outputs this stage reads.
+            config (SimConfig): The compiled config; only the stage's STAGE_CONFIG_FIELDS are hashed.
+            params: Any other inputs (seed, service date, menu fingerprint, ...), JSON-serialisable.
+        """
+        fields = STAGE_CONFIG_FIELDS[stage] if config is not None else ()
+        return _sha256({
+            "stage": stage,
+            "code": self.code,
+            "inputs": list(inputs),
+            "config": {field: _jsonable(getattr(config, field)) for field in fields},
+            "params": _jsonable(params),
+        })
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Returns (True, output) for a cached key, marking it as recently used, or (False, None)."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return False, None  # never stored, or evicted (possibly by another process) in the meantime
+        return True, value
+
+    def put(self, key, value):
+        """Stores an output under key, then evicts the least recently used outputs if the cache is over its size cap."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Written to a temporary file and moved into place, so readers (e.g. other processes) never see a partial one
+        staging_fd, staging_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(staging_fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(staging_path, self.path(key))
+        self.evict()
+
+    def run(self, stage, compute, inputs=(), config=None, **params):
+        """
+        Returns (key, output) of a stage, from the cache if it is there, otherwise by calling compute()
+        and storing its result.
+        """
+        key = self.key(stage, inputs, config, **params)
+        found, value = self.get(key)
+        if found:
+            self.hits.append(stage)
+            return key, value
+        value = compute()
+        self.put(key, value)
+        self.misses.append(stage)
+        return key, value
+
+    def entries(self):
+        """Returns (last used, size in bytes, path) of every cached output, least recently used first."""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        """Returns the total size of the cached outputs in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Deletes the least recently used outputs until the cache fits in max_bytes. Returns the number deleted."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        """Deletes every cached output."""
+        for _, _, path in self.entries():
+            os.remove(path)
+
+
+def cached_group_orders(menu_index, config, service_date, seed, cache=None, customer_count=None):
+    """
+    Simulates a night like generate_final_group_orders(..., batched=True, columnar=True) followed by
+    allocate_ordering_times(...), with every stage's output kept in a StageCache.
+
+    A rerun with the same inputs reads every stage from the cache. After a change to the config, only the stages
+    that read a changed field (see STAGE_CONFIG_FIELDS) are recomputed, along with every stage downstream of them:
+    e.g. a new mains_prep_time_min reruns food and wine_times on the cached bookings and drink times.
+
+    Each stage draws from its own stream (seeding.stage_rng(seed, service_date, stage)), so a stage's output
+    only depends on its inputs, and the orders are the same as those of an uncached run with
+    seeding.night_rngs(seed, service_date).
+
+    Parameters:
+        menu_index (MenuIndex): The precomputed index of the master menu.
+        config (SimConfig): The compiled simulation config.
+        service_date (datetime.date): The night being simulated.
+        seed (int): The run's seed (see seeding.resolve_seed(...)); outputs are only shared between runs with the same seed.
+        cache (StageCache): The cache to use, one in data/cache/stages if None.
+        customer_count (int): Overrides the number of customers drawn from the config.
+
+    Returns:
+        ColumnarOrders: The night's orders with allocated times.
+    """
+    cache = cache if cache is not None else StageCache()
+    night = {"seed": seed, "service_date": service_date, "menu": menu_fingerprint(menu_index)}
+
+    def rng(stage):
+        return stage_rng(seed, service_date, stage)
+
+    def measured(stage, compute, count=len):
+        # Generation stages are measured here, the allocate_* functions measure themselves
+        def run():
+            with metrics.stage(stage) as record:
+                result = compute()
+                record.add_items(count(result))
+            return result
+        return run
+
+    intentions_key, intention_table = cache.run(
+        "intentions", measured("intentions", lambda: generate_intention_table(
+            config, customer_count, rng("intentions"), service_date)),
+        config=config, customer_count=customer_count, **night)
+    customer_orders_key, (all_customer_orders, customer_side_orders) = cache.run(
+        "customer_orders", measured("customer_orders", lambda: generate_customer_orders_batched(
+            intention_table, menu_index.with_rng(rng("items")), config), count=lambda result: len(result[0])),
+        [intentions_key], config, **night)
+    grouping_key, customer_groups = cache.run(
+        "grouping", measured("grouping", lambda: group_customer_orders(
+            all_customer_orders, menu_index, rng("groups"))),
+        [customer_orders_key], config, **night)
+    wine_key, group_wine_orders = cache.run(
+        "wine", measured("wine", lambda: generate_group_wine_orders(
+            customer_groups, all_customer_orders, menu_index.with_rng(rng("wines")), config)),
+        [customer_orders_key, grouping_key], config, **night)
+    # The sides stage also assembles the ColumnarOrders the allocation stages start from
+    sides_key, orders = cache.run(
+        "sides", measured("sides", lambda: build_columnar_group_orders(
+            customer_groups, all_customer_orders, group_wine_orders,
+            generate_group_side_orders_batched(customer_groups, customer_side_orders))),
+        [customer_orders_key, grouping_key, wine_key], config, **night)
+
+    booking_key, orders = cache.run(
+        "booking", lambda: allocate_booking_times(orders, config, service_date=service_date, rng=rng("bookings")),
+        [sides_key], config, **night)
+    drinks_key, orders = cache.run(
+        "drinks", lambda: allocate_drink_order_times(orders, config, rng=rng("drinks")),
+        [booking_key], config, **night)
+    food_key, orders = cache.run(
+        "food", lambda: allocate_food_order_times(orders, config, rng=rng("food")),
+        [drinks_key], config, **night)
+    _, orders = cache.run(
+        "wine_times", lambda: allocate_wine_order_times(orders, config, rng=rng("wine_times")),
+        [food_key], config, **night)
+    return orders
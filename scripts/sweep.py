@@ -0,0 +1,304 @@
+from generate_group_orders import generate_final_group_orders
+from allocate_ordering_times import allocate_ordering_times
+from booking_scheduler import BookingScheduler
+from columnar_orders import DEPARTMENTS, NO_ITEM, NO_TIME
+from menu_index import MenuIndex
+from sim_config import SimConfig, load_sim_config
+from menu_source import load_offline_menu, fetch_bigquery_menu
+from seeding import night_rngs, resolve_seed
+
+import csv
+import json
+import time
+import argparse
+import datetime
+import itertools
+import concurrent.futures
+
+import numpy as np
+
+BIN_MINUTES = 15  # width of the items-per-department time bins
+
+# Set once per worker process by _init_worker(...), so the menu and base config are sent to each worker only once
+_worker_state = {}
+
+
+def parameter_points(grid):
+    """
+    Expands a parameter grid into every combination of its values.
+
+    Parameters:
+        grid (dict): sim_config.json key -> list of values to try, e.g. {"turn_time_two_top": [75, 90]}.
+
+    Returns:
+        list: One {key: value} dict per point of the grid, the last key varying fastest.
+    """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def apply_overrides(raw, overrides):
+    """
+    Returns a copy of a raw sim_config.json dictionary with some top-level keys replaced.
+
+    A [min, max] pair given for "customer_count_range" is used for every day of the week.
+
+    Raises:
+        KeyError: If a key isn't in the config, so a typo in the grid doesn't silently sweep nothing.
+    """
+    raw = json.loads(json.dumps(dict(raw)))
+    for key, value in overrides.items():
+        if key not in raw:
+            raise KeyError(f"{key!r} is not a sim_config.json key")
+        if key == "customer_count_range" and isinstance(value, list):
+            value = {day: value for day in raw[key]}
+        raw[key] = value
+    return raw
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_range(value):
+    return isinstance(value, list) and len(value) == 2 and all(_is_number(bound) for bound in value)
+
+
+def _expected_shape(key, base):
+    """
+    Returns a description of the values key accepts (the shape of its entry in the base config), and a function
+    checking a value has that shape.
+    """
+    if key == "customer_count_range":
+        return ("a [min, max] pair or an object of weekday -> [min, max]",
+                lambda value: _is_range(value) or (isinstance(value, dict) and all(map(_is_range, value.values()))))
+    if _is_number(base):
+        return "a number", _is_number
+    if isinstance(base, list) and all(map(_is_number, base)):
+        return "a list of numbers", lambda value: isinstance(value, list) and all(map(_is_number, value))
+    if isinstance(base, list):
+        return "a list", lambda value: isinstance(value, list)
+    if isinstance(base, dict):
+        return "an object", lambda value: isinstance(value, dict)
+    return f"a {type(base).__name__}", lambda value: isinstance(value, type(base))
+
+
+def check_grid(grid, raw):
+    """
+    Checks a parameter grid against the raw sim_config.json dictionary before any run is started, so a bad
+    grid fails with a clear message rather than inside a worker.
+
+    Raises:
+        KeyError: If a key isn't in the config.
+        ValueError: If a key isn't given a list of values, or one of its values doesn't have the shape of the
+                    key's entry in the config (e.g. customer_count_range=[300, 300] is two numbers, not one
+                    [min, max] pair: write [[300, 300]] to sweep that single range).
+    """
+    for key, values in grid.items():
+        if key not in raw:
+            raise KeyError(f"{key!r} is not a sim_config.json key")
+        if not isinstance(values, list):
+            raise ValueError(f"{key}: expected a list of values to sweep, got {json.dumps(values)}")
+        expected, has_shape = _expected_shape(key, raw[key])
+        for value in values:
+            if not has_shape(value):
+                raise ValueError(f"{key}: each swept value must be {expected}, got {json.dumps(value)}")
+
+
+def replication_seeds(seed, replications):
+    """
+    Returns the seed of each replication. Every grid point uses the same seeds (common random numbers),
+    so the differences between points come from their parameters rather than from different draws.
+    """
+    return [int(np.random.SeedSequence(seed, spawn_key=(replication,)).generate_state(1)[0])
+            for replication in range(replications)]
+
+
+def night_summary(orders, scheduler):
+    """
+    Summarises one allocated night instead of keeping its rows.
+
+    Parameters:
+        orders (ColumnarOrders): The allocated orders.
+        scheduler (BookingScheduler): The scheduler the night was booked on.
+
+    Returns:
+        dict: groups, covers, groups and covers seated, groups not allocated by allocate_booking_times(...),
+              items, and for each department its busiest 15 minutes and its item count in every 15-minute
+              bin (as "<dep>_HH:MM", the bin's start).
+    """
+    guest_counts = orders.category_sizes("mains")  # Each guest orders a main.
+    booked = orders.booking_time != NO_TIME
+    summary = {
+        "groups": len(orders),
+        "covers": int(guest_counts.sum()),
+        "groups_seated": int(booked.sum()),
+        "covers_seated": int(guest_counts[booked].sum()),
+        "groups_unallocated": len(scheduler.unallocated),
+    }
+
+    # Items with an order time, counted per (department, 15-minute bin)
+    timed = (orders.item_code != NO_ITEM) & (orders.order_time != NO_TIME)
+    bins = orders.order_time[timed] // (BIN_MINUTES * 60)
+    departments = orders.department[timed]
+    summary["items"] = int(timed.sum())
+    for d, department in enumerate(DEPARTMENTS):
+        counts = np.bincount(bins[departments == d], minlength=1)
+        summary[f"{department}_peak_{BIN_MINUTES}min"] = int(counts.max())
+        for time_bin in np.flatnonzero(counts).tolist():
+            hours, minutes = divmod(time_bin * BIN_MINUTES, 60)
+            summary[f"{department}_{hours:02d}:{minutes:02d}"] = int(counts[time_bin])
+    return summary
+
+
+def _init_worker(master_df, raw_config, service_date):
+    _worker_state["master_df"] = master_df
+    _worker_state["raw_config"] = raw_config
+    _worker_state["menu_index"] = MenuIndex(master_df, raw_config["categories"])
+    _worker_state["service_date"] = service_date
+
+
+def run_point(point, overrides, replication, seed):
+    """
+    Simulates one replication of one grid point and returns its summary row. Runs inside a worker process
+    set up by _init_worker(...).
+
+    Returns:
+        dict: point, replication, seed, the point's parameters (as JSON), seconds and night_summary(...).
+    """
+    config = SimConfig.from_dict(apply_overrides(_worker_state["raw_config"], overrides))
+    menu_index = _worker_state["menu_index"]
+    if "categories" in overrides:
+        menu_index = MenuIndex(_worker_state["master_df"], config.categories)  # the index depends on the category groups
+    service_date = _worker_state["service_date"]
+
+    start = time.perf_counter()
+    rngs = night_rngs(seed, service_date)
+    scheduler = BookingScheduler(config, service_date)
+    orders = generate_final_group_orders(menu_index, config, batched=True, columnar=True,
+                                         service_date=service_date, rngs=rngs)
+    orders = allocate_ordering_times(orders, config, service_date=service_date, rngs=rngs, scheduler=scheduler)
+
+    row = {"point": point, "replication": replication, "seed": seed}
+    row.update({key: json.dumps(value) for key, value in overrides.items()})
+    row["seconds"] = round(time.perf_counter() - start, 3)
+    row.update(night_summary(orders, scheduler))
+    return row
+
+
+def run_sweep(grid, replications, master_df, config, service_date, workers=None, seed=None):
+    """
+    Runs every point of a parameter grid replications times over a pool of worker processes.
+
+    Parameters:
+        grid (dict): sim_config.json key -> list of values, see parameter_points(...).
+        replications (int): Number of simulated nights per point.
+        master_df (pd.DataFrame): The master menu.
+        config (SimConfig): The base config the grid's values are applied to.
+        service_date (datetime.date): The night simulated (its weekday sets the customer count range).
+        workers (int): Number of worker processes, defaults to the number of CPUs; 1 runs in this process.
+        seed (int): Seed of the sweep, see replication_seeds(...); fresh entropy if None.
+
+    Returns:
+        list: One summary row per run (see run_point(...)), ordered by point then replication.
+    """
+    check_grid(grid, config.raw)  # fail on an unknown key or a malformed value before starting any run
+    points = parameter_points(grid)
+    seeds = replication_seeds(resolve_seed(seed), replications)
+    runs = [(point, overrides, replication, replication_seed)
+            for point, overrides in enumerate(points)
+            for replication, replication_seed in enumerate(seeds)]
+
+    raw_config = dict(config.raw)
+    if workers == 1:
+        # Runs one after another in this process
+        _init_worker(master_df, raw_config, service_date)
+        completed = (run_point(*run) for run in runs)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                          initargs=(master_df, raw_config, service_date))
+        futures = [executor.submit(run_point, *run) for run in runs]
+        completed = (future.result() for future in concurrent.futures.as_completed(futures))
+
+    rows = []
+    try:
+        for row in completed:
+            print(f"Point {row['point']}, replication {row['replication']}: {row['covers_seated']}/{row['covers']} "
+                  f"covers seated, {row['groups_unallocated']} groups not allocated ({row['seconds']}s)")
+            rows.append(row)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return sorted(rows, key=lambda row: (row["point"], row["replication"]))
+
+
+def write_results(rows, path):
+    """
+    Writes the summary rows to one CSV table. Time bin columns missing from a run (no items then) are 0.
+    """
+    fields = []
+    for row in rows:
+        fields.extend(field for field in row if field not in fields)
+    # Keep the 15-minute bins of each department together and in time order, after the other columns
+    bin_fields = sorted(field for field in fields if ":" in field)
+    fields = [field for field in fields if ":" not in field] + bin_fields
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval=0)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_param(text):
+    """Parses a --param KEY=JSON_LIST argument into (key, list of values)."""
+    key, _, values = text.partition("=")
+    values = json.loads(values)
+    if not key or not isinstance(values, list):
+        raise argparse.ArgumentTypeError(f"expected KEY=[value, ...], got {text!r}")
+    return key, values
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a Monte Carlo parameter sweep and write one summary row per run.")
+    parser.add_argument("--grid", metavar="PATH",
+                        help="JSON file mapping sim_config.json keys to the list of values to try")
+    parser.add_argument("--param", type=parse_param, action="append", default=[], metavar="KEY=JSON_LIST",
+                        help='a grid key and its values, e.g. turn_time_two_top=[75,90] (repeatable, added to --grid)')
+    parser.add_argument("--replications", type=int, default=10, help="simulated nights per grid point")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="night to simulate (YYYY-MM-DD), its weekday sets the customer count range")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--menu-source", choices=["bigquery", "csv"], default="bigquery",
+                        help="where to load the menus from, see run_sim.py")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the sweep (replication r of every point uses the same night)")
+    parser.add_argument("--output", default="sweep_results.csv", help="where to write the results table")
+    args = parser.parse_args()
+
+    grid = {}
+    if args.grid:
+        with open(args.grid, "r") as f:
+            grid = json.load(f)
+    grid.update(dict(args.param))
+    if not grid:
+        parser.error("give the parameters to sweep with --grid and/or --param")
+
+    config = load_sim_config()
+    try:
+        check_grid(grid, config.raw)  # before the menu is loaded
+    except (KeyError, ValueError) as e:
+        parser.error(e.args[0])
+    seed = resolve_seed(args.seed)
+    print(f"Seed: {seed}")
+
+    if args.menu_source == "csv":
+        master_df = load_offline_menu()
+    else:
+        master_df = fetch_bigquery_menu()
+
+    rows = run_sweep(grid, args.replications, master_df, config, args.date, args.workers, seed)
+    write_results(rows, args.output)
+    print(f"Swept {len(parameter_points(grid))} points x {args.replications} replications, results saved as {args.output}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules (they are run from scripts/), so the tests do the same
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
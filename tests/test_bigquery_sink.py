@@ -0,0 +1,132 @@
+import datetime
+
+import pyarrow as pa
+import pytest
+from google.cloud import bigquery
+
+import bigquery_sink
+from bigquery_sink import BigQuerySink, BigQuerySinkError, FakeBigQueryClient
+
+TABLE_ID = "restaurant_data.orders"
+
+
+def order_rows(count):
+    """Order rows shaped like run_sim.prepare_order_data(...)'s."""
+    return [{
+        "table_no": 1 + i % 7,
+        "item_uuid": f"item{i % 13:04d}",
+        "datetime_ordered": (datetime.datetime(2025, 3, 7, 18) + datetime.timedelta(minutes=i)).isoformat(),
+        "dep": "kitchen" if i % 2 else "bar",
+        "order_uuid": f"order{i:06d}",
+    } for i in range(count)]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(bigquery_sink.time, "sleep", delays.append)
+    return delays
+
+
+def test_streaming_retries_failed_requests_with_exponential_backoff(sleeps):
+    client = FakeBigQueryClient(fail_requests=3)
+    sink = BigQuerySink(client, TABLE_ID, max_batch_rows=50, max_workers=1, backoff_seconds=0.5)
+    rows = order_rows(120)
+
+    assert sink.write(rows) == len(rows)
+    assert client.tables[TABLE_ID] == rows
+    assert sleeps == [0.5, 1.0, 2.0]  # the first batch failed three times, then every batch went through
+
+
+def test_streaming_retries_rejected_rows_without_duplicating_them(sleeps):
+    client = FakeBigQueryClient(fail_row=lambda row: row["table_no"] == 3, failing_attempts=2)
+    sink = BigQuerySink(client, TABLE_ID, max_batch_rows=25, backoff_seconds=0.1)
+    rows = order_rows(100)
+
+    assert sink.write(rows) == len(rows)
+    written = client.tables[TABLE_ID]
+    assert sorted(row["order_uuid"] for row in written) == [row["order_uuid"] for row in rows]
+    assert sorted(sleeps) == [0.1] * 4 + [0.2] * 4  # two retries for each of the 4 batches
+
+
+def test_streaming_reports_rows_that_keep_failing(sleeps):
+    client = FakeBigQueryClient(fail_row=lambda row: row["table_no"] == 3, failing_attempts=10)
+    sink = BigQuerySink(client, TABLE_ID, max_batch_rows=25, max_retries=2, backoff_seconds=0.1)
+    rows = order_rows(100)
+
+    with pytest.raises(BigQuerySinkError) as error:
+        sink.write(rows)
+    rejected = [row for row in rows if row["table_no"] == 3]
+    assert sorted(error.value.failed_rows, key=lambda row: row["order_uuid"]) == rejected
+    # The rest of each partially failed batch was still written
+    assert sorted(client.tables[TABLE_ID], key=lambda row: row["order_uuid"]) == \
+        [row for row in rows if row["table_no"] != 3]
+
+
+def test_streaming_reports_a_batch_whose_requests_keep_failing(sleeps):
+    client = FakeBigQueryClient(fail_requests=100)
+    sink = BigQuerySink(client, TABLE_ID, max_retries=3, backoff_seconds=0.1)
+    rows = order_rows(10)
+
+    with pytest.raises(BigQuerySinkError) as error:
+        sink.write(rows)
+    assert error.value.failed_rows == rows
+    assert client.requests == 4
+    assert TABLE_ID not in client.tables
+
+
+def test_streaming_batches_are_bounded_by_size():
+    client = FakeBigQueryClient()
+    rows = order_rows(100)
+    sink = BigQuerySink(client, TABLE_ID, max_batch_bytes=2000)
+
+    assert sink.write(rows) == len(rows)
+    assert client.requests > 1
+    assert sorted(client.tables[TABLE_ID], key=lambda row: row["order_uuid"]) == rows
+
+
+def test_ndjson_load_job_writes_the_rows_as_is(sleeps):
+    client = FakeBigQueryClient(fail_requests=1)
+    sink = BigQuerySink(client, TABLE_ID, mode="load", backoff_seconds=0.1)
+    rows = order_rows(100)
+
+    assert sink.write(iter(rows)) == len(rows)
+    assert client.tables[TABLE_ID] == rows
+    assert sleeps == [0.1]
+    (job,) = client.load_jobs
+    assert job["source_format"] == bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+    assert job["schema"] is None
+
+
+def test_parquet_load_job_matches_the_orders_table_schema():
+    client = FakeBigQueryClient()
+    sink = BigQuerySink(client, TABLE_ID, mode="load", load_format="parquet")
+    rows = order_rows(100)
+    rows[5]["datetime_ordered"] = None  # no allocated time
+
+    assert sink.write(iter(rows)) == len(rows)
+    (job,) = client.load_jobs
+    assert job["source_format"] == bigquery.SourceFormat.PARQUET
+    assert job["schema"].names == ["table_no", "item_uuid", "datetime_ordered", "dep", "order_uuid"]
+    assert job["schema"].field("table_no").type == pa.string()
+    assert pa.types.is_timestamp(job["schema"].field("datetime_ordered").type)  # Parquet stores it in ms
+
+    loaded = client.tables[TABLE_ID]
+    assert [row["order_uuid"] for row in loaded] == [row["order_uuid"] for row in rows]
+    assert loaded[0]["table_no"] == str(rows[0]["table_no"])
+    assert loaded[0]["datetime_ordered"] == datetime.datetime.fromisoformat(rows[0]["datetime_ordered"])
+    assert loaded[5]["datetime_ordered"] is None
+
+
+@pytest.mark.parametrize("load_format", ["ndjson", "parquet"])
+def test_failed_load_job_reports_every_row(sleeps, load_format):
+    client = FakeBigQueryClient(fail_requests=100)
+    sink = BigQuerySink(client, TABLE_ID, mode="load", load_format=load_format, max_retries=2, backoff_seconds=0.1)
+    rows = order_rows(20)
+
+    with pytest.raises(BigQuerySinkError) as error:
+        sink.write(rows)
+    assert [row["order_uuid"] for row in error.value.failed_rows] == [row["order_uuid"] for row in rows]
+    assert sleeps == [0.1, 0.2]
+    assert client.load_jobs == []
@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from menu_source import (MENU_COLUMNS, MENU_TABLES, LocalMenuClient, fetch_bigquery_menu, menu_csv_path,
+                         menus_directory, read_menu_csvs)
+
+
+@pytest.fixture
+def menus_dir(tmp_path):
+    """A copy of the menu CSVs, so a test can change a table's modified time."""
+    menus_dir = tmp_path / "menus"
+    shutil.copytree(menus_directory, menus_dir)
+    return str(menus_dir)
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "bigquery_menu")
+
+
+class FailingClient:
+    """A client for which BigQuery is unreachable."""
+
+    def query(self, sql):
+        raise ConnectionError("BigQuery unreachable")
+
+    def get_table(self, table_id):
+        raise ConnectionError("BigQuery unreachable")
+
+
+class TypedMenuClient(LocalMenuClient):
+    """
+    Serves the CSVs with the dtypes the BigQuery client returns: STRING columns as text (so every price is text,
+    because of "Market price"), BOOL as bool and INTEGER as nullable Int64.
+    """
+
+    def query(self, sql):
+        job = super().query(sql)
+        menu_df = pd.read_csv(job.csv_path, dtype=str)
+        if "is_priced_per_weight" in menu_df.columns:
+            menu_df["is_priced_per_weight"] = menu_df["is_priced_per_weight"] == "t"
+        if "serving_size" in menu_df.columns:
+            menu_df["serving_size"] = pd.to_numeric(menu_df["serving_size"]).astype("Int64")
+        job.to_dataframe = lambda: menu_df
+        return job
+
+
+def age_cache(cache_dir, hours):
+    """Moves the cache's fetched_at the given number of hours into the past."""
+    metadata_path = os.path.join(cache_dir, "metadata.json")
+    with open(metadata_path, "r") as f:
+        metadata = json.load(f)
+    fetched_at = datetime.datetime.fromisoformat(metadata["fetched_at"]) - datetime.timedelta(hours=hours)
+    metadata["fetched_at"] = fetched_at.isoformat()
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+
+
+def test_cache_hit_within_ttl(menus_dir, cache_dir):
+    first = fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=cache_dir)
+
+    client = LocalMenuClient(menus_dir)
+    cached = fetch_bigquery_menu(client, cache_dir=cache_dir)
+    assert client.query_count == 0
+    assert client.get_table_count == 0
+    pd.testing.assert_frame_equal(cached, first)
+
+
+def test_expired_ttl_with_unchanged_tables_only_checks_freshness(menus_dir, cache_dir):
+    first = fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=cache_dir)
+    age_cache(cache_dir, hours=13)
+
+    client = LocalMenuClient(menus_dir)
+    menu_df = fetch_bigquery_menu(client, cache_dir=cache_dir)
+    assert client.query_count == 0
+    assert client.get_table_count == len(MENU_TABLES)
+    pd.testing.assert_frame_equal(menu_df, first)
+
+    # The freshness check reset the cache's age
+    client = LocalMenuClient(menus_dir)
+    fetch_bigquery_menu(client, cache_dir=cache_dir)
+    assert client.get_table_count == 0
+
+
+def test_expired_ttl_with_a_changed_table_refetches(menus_dir, cache_dir):
+    fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=cache_dir)
+    age_cache(cache_dir, hours=13)
+
+    wine_menu = menu_csv_path("wine_menu", menus_dir)
+    wine_df = pd.read_csv(wine_menu)
+    wine_df.loc[0, "price"] = 99
+    wine_df.to_csv(wine_menu, index=False)
+    modified = os.path.getmtime(wine_menu) + 60  # newer than the cache even on coarse filesystem clocks
+    os.utime(wine_menu, (modified, modified))
+
+    client = LocalMenuClient(menus_dir)
+    menu_df = fetch_bigquery_menu(client, cache_dir=cache_dir)
+    assert client.query_count == len(MENU_TABLES)
+    assert 99 in menu_df["price"].tolist()
+
+    # The refetched menu was cached
+    client = LocalMenuClient(menus_dir)
+    pd.testing.assert_frame_equal(fetch_bigquery_menu(client, cache_dir=cache_dir), menu_df)
+    assert client.query_count == 0
+
+
+def test_unreachable_bigquery_falls_back_to_the_stale_cache(menus_dir, cache_dir):
+    first = fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=cache_dir)
+    age_cache(cache_dir, hours=48)
+
+    pd.testing.assert_frame_equal(fetch_bigquery_menu(FailingClient(), cache_dir=cache_dir), first)
+
+    # The cache was not refreshed, so the next run checks BigQuery again
+    client = LocalMenuClient(menus_dir)
+    fetch_bigquery_menu(client, cache_dir=cache_dir)
+    assert client.get_table_count == len(MENU_TABLES)
+
+
+def test_unreachable_bigquery_without_a_cache_raises(cache_dir):
+    with pytest.raises(ConnectionError):
+        fetch_bigquery_menu(FailingClient(), cache_dir=cache_dir)
+
+
+def test_local_client_gives_the_same_frame_as_the_bigquery_path(menus_dir):
+    local_df = fetch_bigquery_menu(LocalMenuClient(menus_dir), cache_dir=None)
+    bigquery_df = fetch_bigquery_menu(TypedMenuClient(menus_dir), cache_dir=None)
+
+    assert list(local_df.columns) == list(MENU_COLUMNS)
+    assert local_df.shape == bigquery_df.shape == read_menu_csvs(menus_dir).shape
+    pd.testing.assert_series_equal(local_df.dtypes, bigquery_df.dtypes)
+    pd.testing.assert_frame_equal(local_df, bigquery_df)
+    assert np.isnan(local_df["price"]).sum() == 1  # "Market price"
+
+
+def test_menu_index_builds_from_the_bigquery_path(menus_dir):
+    from menu_index import MenuIndex
+    from sim_config import load_sim_config
+
+    menu_df = fetch_bigquery_menu(TypedMenuClient(menus_dir), cache_dir=None)
+    menu_index = MenuIndex(menu_df, load_sim_config().categories)
+    assert menu_index.menu_prices.dtype == np.float64
+    assert menu_index.size("wine") > 0
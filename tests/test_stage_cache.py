@@ -0,0 +1,69 @@
+import datetime
+import json
+
+import numpy as np
+import pytest
+
+from menu_index import MenuIndex
+from menu_source import read_menu_csvs
+from run_sim import prepare_order_data, simulate_night
+from seeding import stage_rng
+from sim_config import SimConfig, load_sim_config
+from stage_cache import StageCache
+
+SERVICE_DATE = datetime.date(2025, 3, 7)
+CUSTOMERS = 300
+
+ORDER_ARRAYS = ["group_id", "category", "item_code", "order_time", "department", "category_offsets", "offsets",
+                "table_no", "booking_time", "booking_duration"]
+
+
+@pytest.fixture(scope="module")
+def config():
+    return load_sim_config()
+
+
+@pytest.fixture(scope="module")
+def menu_index(config):
+    return MenuIndex(read_menu_csvs(), config.categories)
+
+
+def assert_same_orders(cached, uncached, menu_index, seed):
+    assert cached.group_keys == uncached.group_keys
+    for name in ORDER_ARRAYS:
+        np.testing.assert_array_equal(getattr(cached, name), getattr(uncached, name), err_msg=name)
+    # And the same exported rows, order ids included
+    cached_rows = list(prepare_order_data(cached, menu_index, stage_rng(seed, SERVICE_DATE, "order_ids")))
+    uncached_rows = list(prepare_order_data(uncached, menu_index, stage_rng(seed, SERVICE_DATE, "order_ids")))
+    assert cached_rows == uncached_rows
+
+
+@pytest.mark.parametrize("seed", [0, 1, 42])
+def test_cached_run_matches_uncached_run(tmp_path, menu_index, config, seed):
+    uncached = simulate_night(menu_index, config, SERVICE_DATE, seed, customer_count=CUSTOMERS)
+
+    cache = StageCache(str(tmp_path))
+    cold = simulate_night(menu_index, config, SERVICE_DATE, seed, cache, customer_count=CUSTOMERS)
+    assert cache.hits == []
+    assert_same_orders(cold, uncached, menu_index, seed)
+
+    cache = StageCache(str(tmp_path))
+    warm = simulate_night(menu_index, config, SERVICE_DATE, seed, cache, customer_count=CUSTOMERS)
+    assert cache.misses == []
+    assert_same_orders(warm, uncached, menu_index, seed)
+
+
+def test_partially_cached_run_matches_uncached_run(tmp_path, menu_index, config):
+    seed = 7
+    simulate_night(menu_index, config, SERVICE_DATE, seed, StageCache(str(tmp_path)), customer_count=CUSTOMERS)
+
+    raw = json.loads(json.dumps(dict(config.raw)))
+    raw["mains_prep_time_min"] += 10
+    raw["mains_prep_time_max"] += 10
+    changed = SimConfig.from_dict(raw)
+
+    cache = StageCache(str(tmp_path))
+    partial = simulate_night(menu_index, changed, SERVICE_DATE, seed, cache, customer_count=CUSTOMERS)
+    assert cache.misses == ["food", "wine_times"]
+    uncached = simulate_night(menu_index, changed, SERVICE_DATE, seed, customer_count=CUSTOMERS)
+    assert_same_orders(partial, uncached, menu_index, seed)